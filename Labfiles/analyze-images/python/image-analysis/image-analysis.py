@@ -1,17 +1,33 @@
-from unittest import result
 from dotenv import load_dotenv
 import os
-from PIL import Image, ImageDraw
+import glob
+import json
+import time
+import queue
+import threading
 import sys
-from matplotlib import pyplot as plt
-from azure.core.exceptions import HttpResponseError
-import requests
 
 # import namespaces
 # import namespaces
-from azure.ai.vision.imageanalysis import ImageAnalysisClient
 from azure.ai.vision.imageanalysis.models import VisualFeatures
-from azure.core.credentials import AzureKeyCredential
+
+# Make the shared helpers in Labfiles/common/python importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'common', 'python'))
+from analysis_cache import AnalysisCache
+import clients
+import image_annotation
+import image_preprocessing
+
+# Visual features requested for every image
+FEATURES = [
+    VisualFeatures.CAPTION,
+    VisualFeatures.DENSE_CAPTIONS,
+    VisualFeatures.TAGS,
+    VisualFeatures.OBJECTS,
+    VisualFeatures.PEOPLE]
+
+# File types picked up when a folder is analyzed
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tif', '.tiff', '.webp')
 
 def main():
 
@@ -31,27 +47,31 @@ def main():
         
 
         # Authenticate Azure AI Vision client
-        # Authenticate Azure AI Vision client
-        cv_client = ImageAnalysisClient(
-            endpoint=ai_endpoint,
-            credential=AzureKeyCredential(ai_key))
+        # (with pooled keep-alive connections, shared by every request in batch mode)
+        cv_client = clients.image_analysis_client(ai_endpoint, ai_key)
+
+        # Results for images analyzed before are read from the local cache
+        cache = AnalysisCache()
+
+        # Analyze a folder or glob pattern of images in batch mode
+        if os.path.isdir(image_file) or any(c in image_file for c in '*?['):
+            analyze_batch(cv_client, cache, image_file)
+            return
 
         # Analyze image
-        # Analyze image
-        with open(image_file, "rb") as f:
-            image_data = f.read()
+        # Analyze image (downsized first if PREPROCESS_IMAGES=1)
+        prepared = image_preprocessing.prepare(image_file, 'image-analysis')
         print(f'\nAnalyzing {image_file}\n')
 
-        result = cv_client.analyze(
-            image_data=image_data,
-            visual_features=[
-                VisualFeatures.CAPTION,
-                VisualFeatures.DENSE_CAPTIONS,
-                VisualFeatures.TAGS,
-                VisualFeatures.OBJECTS,
-                VisualFeatures.PEOPLE],
+        result = cache.analyze(
+            cv_client,
+            image_data=prepared.data,
+            visual_features=FEATURES,
         )
 
+        # Map coordinates back to the original image if it was downsized
+        image_preprocessing.rescale_analysis(result, prepared)
+
         # Get image captions
         if result.caption is not None:
             print("\nCaption:")
@@ -94,53 +114,173 @@ def main():
         print(ex)
 
 
-def show_objects(image_filename, detected_objects):
+def analyze_batch(cv_client, cache, pattern, output_file='results.jsonl', annotation_folder='annotated'):
+    """
+    Analyze every image in a folder (or matching a glob pattern) with one client.
+    Images already in the analysis cache are not sent to the service again.
+
+    The work runs as a pipeline connected by bounded queues, so file reads, analyze
+    calls and annotation rendering overlap:
+      reader thread -> analyze worker threads -> writer (this thread)
+    The writer appends one JSON object per image to output_file (JSON Lines) and saves
+    the object and people annotations for each image in annotation_folder, named after
+    the image's path relative to the folder (or the pattern's common folder), so images
+    with the same file name in different folders don't overwrite each other. An image
+    that can't be annotated gets an 'annotation_error' in its JSON object instead.
+
+    The number of analyze calls in flight is set by ANALYSIS_CONCURRENCY (default 4).
+    """
+    if os.path.isdir(pattern):
+        files = sorted(os.path.join(pattern, name) for name in os.listdir(pattern)
+                       if name.lower().endswith(IMAGE_EXTENSIONS))
+    else:
+        files = sorted(glob.glob(pattern))
+    workers = int(os.getenv('ANALYSIS_CONCURRENCY') or 4)
+    os.makedirs(annotation_folder, exist_ok=True)
+    annotation_names = annotation_file_names(files, pattern)
+    print(f'\nAnalyzing {len(files)} images with {workers} workers\n')
+
+    # Bounded queues keep only a few images in memory between stages
+    read_queue = queue.Queue(maxsize=workers * 2)
+    result_queue = queue.Queue(maxsize=workers * 2)
+    done = object()  # Sentinel marking the end of a stage's output
+
+    def read_images():
+        try:
+            for image_file in files:
+                try:
+                    read_queue.put((image_file, image_preprocessing.prepare(image_file, 'image-analysis'), None))
+                except Exception as ex:
+                    # Any failure (a missing file, or one Pillow can't decode) is reported for that image
+                    read_queue.put((image_file, None, ex))
+        finally:
+            # Always tell the workers to stop, so the batch can't hang waiting for them
+            for _ in range(workers):
+                read_queue.put(done)
+
+    def analyze_images():
+        while True:
+            item = read_queue.get()
+            if item is done:
+                result_queue.put(done)
+                return
+            image_file, prepared, error = item
+            result = None
+            if error is None:
+                try:
+                    result = cache.analyze(cv_client, image_data=prepared.data, visual_features=FEATURES)
+                    image_preprocessing.rescale_analysis(result, prepared)
+                except Exception as ex:
+                    # Keep going: one failed image shouldn't stop the batch
+                    error = ex
+            result_queue.put((image_file, result, error))
+
+    threads = [threading.Thread(target=read_images, daemon=True)]
+    threads += [threading.Thread(target=analyze_images, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    # Write results and render annotations as they arrive
+    start = time.perf_counter()
+    analyzed = failed = finished_workers = 0
+    with open(output_file, 'w') as results:
+        while finished_workers < workers:
+            item = result_queue.get()
+            if item is done:
+                finished_workers += 1
+                continue
+            image_file, result, error = item
+            if error is not None:
+                failed += 1
+                results.write(json.dumps({'image': image_file, 'error': str(error)}) + '\n')
+                print(f'  {image_file}: {error}')
+                continue
+
+            analyzed += 1
+            record = {'image': image_file, 'result': result.as_dict()}
+            name = annotation_names[image_file]
+            try:
+                if result.objects is not None:
+                    show_objects(image_file, result.objects.list, os.path.join(annotation_folder, name + '-objects.jpg'))
+                if result.people is not None:
+                    show_people(image_file, result.people.list, os.path.join(annotation_folder, name + '-people.jpg'))
+            except Exception as ex:
+                # The analysis result is still saved; only the annotated image is missing
+                record['annotation_error'] = str(ex)
+                print(f'  {image_file}: annotation failed: {ex}')
+            results.write(json.dumps(record) + '\n')
+
+    elapsed = time.perf_counter() - start
+    rate = len(files) / elapsed if elapsed > 0 else 0
+    print(f'\n{analyzed} analyzed, {failed} failed in {elapsed:.1f}s ({rate:.1f} images/sec, {cache.hits} cached)')
+    print('  Results saved in', output_file)
+
+
+def annotation_file_names(files, pattern):
+    """
+    Return a unique base name for each image's annotations (dict of file -> name).
+
+    Names are the image path relative to the folder being analyzed (or, for a glob pattern,
+    the folder all the matches share) without its extension, with folder separators
+    replaced by '_', such as 'street' or '2024_street'. A number is added if two names
+    still clash.
+    """
+    if os.path.isdir(pattern):
+        root = pattern
+    elif files:
+        root = os.path.commonpath([os.path.dirname(os.path.abspath(image_file)) for image_file in files])
+    else:
+        root = os.getcwd()
+    names = {}
+    used = set()
+    for index, image_file in enumerate(files):
+        relative = os.path.splitext(os.path.relpath(os.path.abspath(image_file), os.path.abspath(root)))[0]
+        name = relative.replace(os.sep, '_').replace('/', '_')
+        if name in used:
+            name = f'{name}-{index}'
+        used.add(name)
+        names[image_file] = name
+    return names
+
+
+def show_objects(image_filename, detected_objects, objectfile='objects.jpg'):
     print ("\nAnnotating objects...")
 
     # Prepare image for drawing
-    image = Image.open(image_filename)
-    fig = plt.figure(figsize=(image.width/100, image.height/100))
-    plt.axis('off')
-    draw = ImageDraw.Draw(image)
+    image = image_annotation.load(image_filename)
     color = 'cyan'
 
+    # Draw object bounding boxes, labelled with each object's tag
+    boxes = []
+    labels = []
     for detected_object in detected_objects:
-        # Draw object bounding box
         r = detected_object.bounding_box
-        bounding_box = ((r.x, r.y), (r.x + r.width, r.y + r.height)) 
-        draw.rectangle(bounding_box, outline=color, width=3)
-        plt.annotate(detected_object.tags[0].name,(r.x, r.y), backgroundcolor=color)
+        boxes.append((r.x, r.y, r.x + r.width, r.y + r.height))
+        labels.append(detected_object.tags[0].name)
+    image_annotation.draw_boxes(image, boxes, color, width=3, labels=labels)
 
     # Save annotated image
-    plt.imshow(image)
-    plt.tight_layout(pad=0)
-    objectfile = 'objects.jpg'
-    fig.savefig(objectfile)
+    image_annotation.save(image, objectfile)
     print('  Results saved in', objectfile)
 
 
-def show_people(image_filename, detected_people):
+def show_people(image_filename, detected_people, peoplefile='people.jpg'):
     print ("\nAnnotating objects...")
 
     # Prepare image for drawing
-    image = Image.open(image_filename)
-    fig = plt.figure(figsize=(image.width/100, image.height/100))
-    plt.axis('off')
-    draw = ImageDraw.Draw(image)
+    image = image_annotation.load(image_filename)
     color = 'cyan'
 
+    # Draw bounding boxes for people detected with enough confidence
+    boxes = []
     for detected_person in detected_people:
         if detected_person.confidence > 0.2:
-            # Draw object bounding box
             r = detected_person.bounding_box
-            bounding_box = ((r.x, r.y), (r.x + r.width, r.y + r.height))
-            draw.rectangle(bounding_box, outline=color, width=3)
+            boxes.append((r.x, r.y, r.x + r.width, r.y + r.height))
+    image_annotation.draw_boxes(image, boxes, color, width=3)
 
     # Save annotated image
-    plt.imshow(image)
-    plt.tight_layout(pad=0)
-    peoplefile = 'people.jpg'
-    fig.savefig(peoplefile)
+    image_annotation.save(image, peoplefile)
     print('  Results saved in', peoplefile)
 
 
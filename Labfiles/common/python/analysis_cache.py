@@ -0,0 +1,162 @@
+"""
+An on-disk cache of Azure AI Vision image analysis results.
+
+Results are keyed by the SHA-256 of the image bytes, the requested visual features,
+the API version and any other analyze options, so a byte-identical image analyzed with
+the same settings is answered from disk instead of calling the service again. The cache
+folder is shared by the lab scripts that call ImageAnalysisClient.analyze.
+
+Entries older than max_age are ignored and removed, and when the cache grows beyond
+max_bytes the least recently used entries are deleted.
+
+Settings (all optional, read from the environment):
+    ANALYSIS_CACHE_DIR        Folder for the cache (default ~/.cache/mslearn-ai-vision/image-analysis)
+    ANALYSIS_CACHE_MAX_MB     Maximum total size in megabytes (default 512)
+    ANALYSIS_CACHE_MAX_DAYS   Maximum age of an entry in days (default 30)
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from azure.ai.vision.imageanalysis.models import ImageAnalysisResult
+
+import throttle
+
+
+class AnalysisCache:
+    """Read-through, write-through cache for ImageAnalysisClient.analyze results."""
+
+    def __init__(self, folder=None, max_bytes=None, max_age=None):
+        """
+        Open (or create) the cache folder.
+
+        Args:
+            folder (str): Cache folder; defaults to ANALYSIS_CACHE_DIR or a per-user cache folder
+            max_bytes (int): Size limit in bytes; defaults to ANALYSIS_CACHE_MAX_MB
+            max_age (float): Entry lifetime in seconds; defaults to ANALYSIS_CACHE_MAX_DAYS
+        """
+        self.folder = folder or os.getenv('ANALYSIS_CACHE_DIR') or os.path.join(
+            os.path.expanduser('~'), '.cache', 'mslearn-ai-vision', 'image-analysis')
+        self.max_bytes = max_bytes or int(float(os.getenv('ANALYSIS_CACHE_MAX_MB') or 512) * 1024 * 1024)
+        self.max_age = max_age or float(os.getenv('ANALYSIS_CACHE_MAX_DAYS') or 30) * 24 * 3600
+        os.makedirs(self.folder, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._size = sum(os.path.getsize(path) for path, mtime in self._entries())
+
+    def key(self, image_data, visual_features, api_version, **options):
+        """Return the cache key for an image, its feature list, the API version and other options."""
+        digest = hashlib.sha256(image_data)
+        features = sorted(str(getattr(feature, 'value', feature)) for feature in visual_features)
+        settings = json.dumps({'features': features, 'api_version': api_version, 'options': options},
+                              sort_keys=True, default=str)
+        digest.update(settings.encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return the cached result dictionary for key, or None if it is missing or expired."""
+        path = self._path(key)
+        try:
+            with open(path, 'r') as entry_file:
+                entry = json.load(entry_file)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry.get('created', 0) > self.max_age:
+            self._remove(path)
+            return None
+        # Touch the file so eviction treats it as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            # Evicted (by another thread or process) since it was read: treat it as a miss
+            return None
+        return entry['result']
+
+    def put(self, key, result):
+        """Store a result dictionary under key, evicting old entries if the cache is too big."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file and rename it, so readers never see a partial entry
+        handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'w') as entry_file:
+                json.dump({'created': time.time(), 'result': result}, entry_file)
+            size = os.path.getsize(temp_path)
+            os.replace(temp_path, path)
+        finally:
+            # Only left behind if writing the entry failed
+            self._remove(temp_path)
+        with self._lock:
+            self._size += size
+            over_limit = self._size > self.max_bytes
+        if over_limit:
+            self.evict()
+
+    def analyze(self, cv_client, image_data, visual_features, **options):
+        """
+        Return cv_client.analyze(image_data, visual_features, **options), using the cache.
+
+        On a hit the stored result is returned without calling the service; on a miss the
+        service is called and its result is stored before being returned.
+        """
+        # ImageAnalysisClient doesn't expose its API version publicly, so read it from the client configuration
+        api_version = getattr(getattr(cv_client, '_config', None), 'api_version', None)
+        key = self.key(image_data, visual_features, api_version, **options)
+        cached = self.get(key)
+        with self._lock:
+            if cached is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if cached is not None:
+            return ImageAnalysisResult(cached)
+
+        result = throttle.call('vision', cv_client.analyze,
+                               image_data=image_data, visual_features=visual_features, **options)
+        self.put(key, result.as_dict())
+        return result
+
+    def evict(self):
+        """Remove expired entries, then the least recently used ones until the cache is under 90% of its limit."""
+        with self._lock:
+            now = time.time()
+            entries = []
+            for path, mtime in self._entries():
+                if now - mtime > self.max_age:
+                    self._remove(path)
+                else:
+                    entries.append((mtime, path))
+            self._size = sum(os.path.getsize(path) for mtime, path in entries if os.path.exists(path))
+            for mtime, path in sorted(entries):
+                if self._size <= self.max_bytes * 0.9:
+                    break
+                try:
+                    self._size -= os.path.getsize(path)
+                except OSError:
+                    continue  # Already removed by another process
+                self._remove(path)
+
+    def _path(self, key):
+        # Spread entries over subfolders so no single folder gets too large
+        return os.path.join(self.folder, key[:2], key + '.json')
+
+    def _entries(self):
+        for root, folders, files in os.walk(self.folder):
+            for name in files:
+                if name.endswith('.json'):
+                    path = os.path.join(root, name)
+                    try:
+                        yield path, os.path.getmtime(path)
+                    except OSError:
+                        continue
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
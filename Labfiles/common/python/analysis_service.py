@@ -0,0 +1,278 @@
+"""
+Resident analysis service: face detection, image analysis and OCR over local HTTP.
+
+Running analyze-faces.py, image-analysis.py or read-text.py once per file pays every
+time for interpreter startup, SDK imports, client creation (and its TLS connections)
+and an empty thread pool. This service starts once and keeps all of those warm: one
+pooled client per service, the on-disk analysis cache, and a shared pool of worker
+threads. The work itself is done by the scripts' own functions, so results match what
+the scripts produce.
+
+Endpoints (on 127.0.0.1:ANALYSIS_SERVICE_PORT, default 8780, or a Unix socket with --unix):
+    POST /faces, /analyze, /read
+        With a JSON body {"paths": ["images/a.jpg", ...]}, every image is processed
+        concurrently and one JSON line per image is streamed back as soon as it is done
+        (application/x-ndjson, in completion order):
+            {"image": "images/a.jpg", "result": {...}}   or   {"image": ..., "error": "..."}
+        Any other body is treated as the bytes of a single image (?name= labels it).
+        Relative paths are resolved against the folder the service was started in.
+    GET /metrics
+        Prometheus text format: queue depth, images in progress, request, image and error
+        counts, latency quantiles per operation, and analysis cache hits and misses.
+    GET /health
+
+Results: /faces returns the detected faces (rectangle, head pose, occlusion, accessories),
+/analyze the image analysis result (caption, dense captions, tags, objects, people) and
+/read one record per page in read-text.py's columnar format. No annotated images are saved.
+
+Usage (from a lab folder whose .env has AI_SERVICE_ENDPOINT and AI_SERVICE_KEY):
+    python ../../../common/python/analysis_service.py [--port 8780 | --unix /tmp/analysis.sock]
+    curl -N -d '{"paths": ["images/face1.jpg"]}' http://127.0.0.1:8780/faces
+    curl -N --data-binary @images/street.jpg http://127.0.0.1:8780/analyze?name=street.jpg
+
+Settings: SERVICE_CONCURRENCY (default 8) sets the number of worker threads.
+"""
+import argparse
+import json
+import os
+import socketserver
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dotenv import load_dotenv
+
+import clients
+import image_preprocessing
+from analysis_cache import AnalysisCache
+from lab_scripts import load_script
+
+# Number of recent latencies kept per operation for the /metrics quantiles
+LATENCY_WINDOW = 2048
+
+
+class Metrics:
+    """Thread-safe counters and recent latencies, reported in Prometheus text format."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.requests = defaultdict(int)
+        self.images = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.latency_sum = defaultdict(float)
+        self.latencies = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+
+    def render(self, cache):
+        """Return the metrics as Prometheus exposition text."""
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append('# HELP analysis_{} {}'.format(name, help_text))
+            lines.append('# TYPE analysis_{} {}'.format(name, kind))
+            for labels, value in samples:
+                lines.append('analysis_{}{} {}'.format(name, labels, value))
+
+        with self.lock:
+            operations = sorted(set(self.requests) | set(self.images))
+            metric('queue_depth', 'gauge', 'Images waiting for a worker thread.', [('', self.queued)])
+            metric('in_progress', 'gauge', 'Images being processed.', [('', self.running)])
+            metric('requests_total', 'counter', 'Requests received.',
+                   [('{{operation="{}"}}'.format(op), self.requests[op]) for op in operations])
+            metric('images_total', 'counter', 'Images processed.',
+                   [('{{operation="{}"}}'.format(op), self.images[op]) for op in operations])
+            metric('errors_total', 'counter', 'Images that failed.',
+                   [('{{operation="{}"}}'.format(op), self.errors[op]) for op in operations])
+            samples = []
+            for op in operations:
+                recent = sorted(self.latencies[op])
+                for quantile in (0.5, 0.95, 0.99):
+                    value = recent[min(len(recent) - 1, int(quantile * len(recent)))] if recent else 0
+                    samples.append(('{{operation="{}",quantile="{}"}}'.format(op, quantile), round(value, 4)))
+                samples.append(('_sum{{operation="{}"}}'.format(op), round(self.latency_sum[op], 4)))
+                samples.append(('_count{{operation="{}"}}'.format(op), self.images[op]))
+            metric('latency_seconds', 'summary', 'Time to process one image.', samples)
+        metric('cache_hits_total', 'counter', 'Analysis cache hits.', [('', cache.hits)])
+        metric('cache_misses_total', 'counter', 'Analysis cache misses.', [('', cache.misses)])
+        return '\n'.join(lines) + '\n'
+
+
+class AnalysisService:
+    """Warm clients, cache and worker threads, and the operations that use them."""
+
+    def __init__(self, endpoint, key, workers=None, base_folder=None):
+        self.faces_script = load_script('face/python/face-api/analyze-faces.py')
+        self.analysis_script = load_script('analyze-images/python/image-analysis/image-analysis.py')
+        self.read_script = load_script('ocr/python/read-text/read-text.py')
+
+        self.face_client = clients.face_client(endpoint, key)
+        self.cv_client = clients.image_analysis_client(endpoint, key)
+        self.cache = AnalysisCache()
+        self.executor = ThreadPoolExecutor(max_workers=workers or int(os.getenv('SERVICE_CONCURRENCY') or 8))
+        self.base_folder = base_folder or os.getcwd()
+        self.metrics = Metrics()
+
+        detection = self.faces_script.FaceAttributeTypeDetection01
+        self.face_features = [detection.HEAD_POSE, detection.OCCLUSION, detection.ACCESSORIES]
+        self.operations = {'faces': self.faces, 'analyze': self.analyze, 'read': self.read}
+
+    # ----- Operations: each takes an image file path and returns a JSON-serializable result -----
+
+    def faces(self, image_file):
+        detected_faces = self.faces_script.detect_faces(self.face_client, image_file, self.face_features)
+        return [face.as_dict() for face in detected_faces]
+
+    def analyze(self, image_file):
+        prepared = image_preprocessing.prepare(image_file, 'image-analysis')
+        result = self.cache.analyze(self.cv_client, image_data=prepared.data,
+                                    visual_features=self.analysis_script.FEATURES)
+        return image_preprocessing.rescale_analysis(result, prepared).as_dict()
+
+    def read(self, image_file):
+        # quiet: don't print each tiled page's size on the service's console
+        pages = self.read_script.read_pages(self.cv_client, self.cache, image_file, quiet=True)
+        return [self.read_script.document_record(image_file, document, page)
+                for page, document in enumerate(pages) if document is not None]
+
+    # ----- Scheduling -----
+
+    def submit(self, operation, image_file, name):
+        """Queue one image on the worker threads and return a future for its JSON line."""
+        with self.metrics.lock:
+            self.metrics.queued += 1
+
+        def run():
+            with self.metrics.lock:
+                self.metrics.queued -= 1
+                self.metrics.running += 1
+            start = time.perf_counter()
+            try:
+                record = {'image': name, 'result': self.operations[operation](image_file)}
+                failed = False
+            except Exception as ex:
+                # Report the failure for this image and carry on with the others
+                record = {'image': name, 'error': str(ex)}
+                failed = True
+            elapsed = time.perf_counter() - start
+            with self.metrics.lock:
+                self.metrics.running -= 1
+                self.metrics.images[operation] += 1
+                self.metrics.errors[operation] += failed
+                self.metrics.latency_sum[operation] += elapsed
+                self.metrics.latencies[operation].append(elapsed)
+            return record
+
+        return self.executor.submit(run)
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """HTTP front end for an AnalysisService (set on a subclass by make_server)."""
+
+    protocol_version = 'HTTP/1.1'
+    service = None
+
+    def log_message(self, format, *args):
+        pass  # Don't print a line per request
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self.send_body(self.service.metrics.render(self.service.cache).encode(), 'text/plain; version=0.0.4')
+        elif self.path == '/health':
+            self.send_body(b'{"status": "ok"}', 'application/json')
+        else:
+            self.send_body(b'{"error": "not found"}', 'application/json', 404)
+
+    def do_POST(self):
+        operation, _, query = self.path.lstrip('/').partition('?')
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        if operation not in self.service.operations:
+            return self.send_body(b'{"error": "not found"}', 'application/json', 404)
+        with self.service.metrics.lock:
+            self.service.metrics.requests[operation] += 1
+
+        spooled = None
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            try:
+                paths = json.loads(body)['paths']
+            except (ValueError, KeyError, TypeError):
+                return self.send_body(b'{"error": "expected {\\"paths\\": [...]}"}', 'application/json', 400)
+            futures = [self.service.submit(operation, os.path.join(self.service.base_folder, path), path)
+                       for path in paths]
+        else:
+            # The image itself was sent: spool it to a file so the scripts' functions can read it
+            name = dict(part.partition('=')[::2] for part in query.split('&') if part).get('name', '-')
+            with tempfile.NamedTemporaryFile(suffix=os.path.splitext(name)[1], delete=False) as spooled_file:
+                spooled_file.write(body)
+                spooled = spooled_file.name
+            futures = [self.service.submit(operation, spooled, name)]
+
+        # Stream one JSON line per image, as each one finishes
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for future in as_completed(futures):
+                line = json.dumps(future.result(), ensure_ascii=False).encode() + b'\n'
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(line), line))
+                self.wfile.flush()
+            self.wfile.write(b'0\r\n\r\n')
+        except OSError:
+            # The client went away; let the queued images finish, but stop writing
+            self.close_connection = True
+        finally:
+            if spooled is not None:
+                for future in futures:
+                    future.exception()
+                os.remove(spooled)
+
+    def send_body(self, data, content_type, status=200):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(service, port=None, unix_socket=None):
+    """Return an HTTP server for the service, listening on a local port or a Unix socket."""
+    handler = type('Handler', (ServiceHandler,), {'service': service})
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        return UnixHTTPServer(unix_socket, handler)
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Resident face, image analysis and OCR service.')
+    parser.add_argument('--port', type=int, default=int(os.getenv('ANALYSIS_SERVICE_PORT') or 8780))
+    parser.add_argument('--unix', help='Listen on this Unix socket instead of a TCP port')
+    args = parser.parse_args()
+
+    load_dotenv()
+    service = AnalysisService(os.getenv('AI_SERVICE_ENDPOINT'), os.getenv('AI_SERVICE_KEY'))
+    server = make_server(service, args.port, args.unix)
+    print('Analysis service listening on', args.unix or 'http://127.0.0.1:{}/'.format(args.port), '(Ctrl+C to stop)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.executor.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    main()
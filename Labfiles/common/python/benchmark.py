@@ -0,0 +1,424 @@
+"""
+Benchmark: throughput, latency, bytes uploaded, memory and annotation time of each lab
+script's core code path, run against the local mock service with fixed image sets.
+
+Each scenario loads a lab script as a module and calls its core functions (the same
+ones its main() uses) for every image in the scenario's folder, with the service calls
+going to a MockService started by this script. Scenarios run one at a time, each in its
+own Python process so that peak memory and import costs aren't shared between them.
+
+Reported for each scenario:
+    items_per_sec       Images (or prompts) processed per second of wall time
+    item_latency_ms     p50/p95/p99/max time to process one item (service calls plus annotation)
+    call_latency_ms     p50/p95/p99/max time of each service call, as seen by the client
+    network_seconds     Total time spent in service calls (summed over all threads)
+    annotation_seconds  Total time spent drawing and saving annotated images
+    bytes_uploaded      Request bytes received by the mock service
+    bytes_downloaded    Response bytes sent by the mock service
+    peak_rss_mb         Peak resident memory of the scenario's process (not on Windows)
+    errors, throttled   Items that failed, and requests the mock answered with 429
+
+The results are written as JSON (benchmark-results.json by default), so runs from two
+versions of the code can be compared with any diff tool.
+
+Usage:
+    python benchmark.py [--scenarios face,ocr] [--repeat 5] [--concurrency 8]
+                        [--latency 50] [--jitter 10] [--throttle-rate 0] [--error-rate 0]
+                        [--output benchmark-results.json]
+
+Client-side rate limits (see throttle.py) are turned off so the code itself is measured;
+pass --keep-rate-limits to include them.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from lab_scripts import LABFILES, load_script
+from mock_service import MockService
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tif', '.tiff', '.webp')
+
+# The fixed inputs for each scenario, relative to the Labfiles folder
+CORPORA = {
+    'face': 'face/python/face-api/images',
+    'image-analysis': 'analyze-images/python/image-analysis/images',
+    'ocr': 'ocr/python/read-text/images',
+    'classify': 'image-classification/python/test-classifier/test-images',
+    'detect': 'object-detection/python/train-detector/images',
+    'upload-classifier': 'image-classification/training-images',
+    'upload-detector': 'object-detection/python/train-detector/tagged-images.json',
+    'dalle': None,
+}
+
+PROMPTS = ['A robot eating spaghetti', 'A watercolor of a lighthouse at dawn', 'A cat wearing a space suit',
+           'A bowl of apples, bananas and oranges', 'A city skyline made of books', 'A dragon made of clouds']
+
+
+class Recorder:
+    """Collects the timings of service calls, annotation and whole items from all threads."""
+
+    def __init__(self):
+        self.calls = []
+        self.items = []
+        self.annotation = 0.0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def time_calls(self, owner, name):
+        """Replace owner.name (a client method) with a version that records how long each call takes."""
+        original = getattr(owner, name)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.calls.append(time.perf_counter() - start)
+        setattr(owner, name, timed)
+
+    @contextlib.contextmanager
+    def annotating(self):
+        """Count the time spent in the with block as annotation time."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.annotation += time.perf_counter() - start
+
+    def run(self, items, process, concurrency):
+        """Call process(item) for every item on concurrency threads, timing each one."""
+        def timed(item):
+            start = time.perf_counter()
+            try:
+                process(item)
+            except Exception:
+                with self._lock:
+                    self.errors += 1
+            with self._lock:
+                self.items.append(time.perf_counter() - start)
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(timed, items))
+
+
+def image_files(relative_folder, repeat=1):
+    """Return the image files in a corpus folder (and its subfolders), repeat times over."""
+    folder = os.path.join(LABFILES, relative_folder)
+    files = sorted(os.path.join(root, name) for root, _, names in os.walk(folder)
+                   for name in names if name.lower().endswith(IMAGE_EXTENSIONS))
+    return files * repeat
+
+
+# ----- Scenarios: each runs one script's core path against the mock service -----
+
+def run_face(endpoint, recorder, repeat, concurrency):
+    import clients
+    script = load_script('face/python/face-api/analyze-faces.py')
+    face_client = clients.face_client(endpoint, 'mock')
+    recorder.time_calls(face_client, 'detect')
+    features = [script.FaceAttributeTypeDetection01.HEAD_POSE, script.FaceAttributeTypeDetection01.OCCLUSION,
+                script.FaceAttributeTypeDetection01.ACCESSORIES]
+
+    def process(image_file):
+        detected_faces = script.detect_faces(face_client, image_file, features)
+        if detected_faces:
+            with recorder.annotating():
+                script.annotate_faces(image_file, detected_faces)
+
+    files = image_files(CORPORA['face'], repeat)
+    recorder.run(files, process, concurrency)
+    return len(files)
+
+
+def run_image_analysis(endpoint, recorder, repeat, concurrency):
+    import clients
+    import image_preprocessing
+    import throttle
+    script = load_script('analyze-images/python/image-analysis/image-analysis.py')
+    cv_client = clients.image_analysis_client(endpoint, 'mock')
+    recorder.time_calls(cv_client, 'analyze')
+
+    def process(item):
+        # The analysis cache is left out, so repeated images are sent to the service too
+        index, image_file = item
+        prepared = image_preprocessing.prepare(image_file, 'image-analysis')
+        result = throttle.call('vision', cv_client.analyze, image_data=prepared.data, visual_features=script.FEATURES)
+        image_preprocessing.rescale_analysis(result, prepared)
+        with recorder.annotating():
+            if result.objects is not None:
+                script.show_objects(image_file, result.objects.list, 'objects-{}.jpg'.format(index))
+            if result.people is not None:
+                script.show_people(image_file, result.people.list, 'people-{}.jpg'.format(index))
+
+    files = image_files(CORPORA['image-analysis'], repeat)
+    recorder.run(list(enumerate(files)), process, concurrency)
+    return len(files)
+
+
+def run_ocr(endpoint, recorder, repeat, concurrency):
+    import clients
+    from analysis_cache import AnalysisCache
+    script = load_script('ocr/python/read-text/read-text.py')
+    cv_client = clients.image_analysis_client(endpoint, 'mock')
+    recorder.time_calls(cv_client, 'analyze')
+
+    def process(image_file):
+        with tempfile.TemporaryDirectory(dir=os.getcwd()) as folder:
+            pages = script.read_pages(cv_client, AnalysisCache(folder=folder), image_file)
+        for page_number, document in enumerate(pages):
+            if document is not None:
+                with recorder.annotating():
+                    script.annotate_text(image_file, document, page=page_number,
+                                         suffix='-{}-{}'.format(os.path.basename(image_file), page_number))
+
+    files = image_files(CORPORA['ocr'], repeat)
+    recorder.run(files, process, concurrency)
+    return len(files)
+
+
+def run_classify(endpoint, recorder, repeat, concurrency):
+    import clients
+    script = load_script('image-classification/python/test-classifier/test-classifier.py')
+    prediction_client = clients.custom_vision_prediction_client(endpoint, 'mock')
+    recorder.time_calls(prediction_client, 'classify_image')
+
+    def process(image_file):
+        [(predictions, error)] = script.Classify_Images(prediction_client, 'project', 'model',
+                                                        os.path.dirname(image_file), [os.path.basename(image_file)], 1)
+        if error is not None:
+            raise error
+
+    files = image_files(CORPORA['classify'], repeat)
+    recorder.run(files, process, concurrency)
+    return len(files)
+
+
+def run_detect(endpoint, recorder, repeat, concurrency):
+    import clients
+    import image_preprocessing
+    import throttle
+    script = load_script('object-detection/python/test-detector/test-detector.py')
+    prediction_client = clients.custom_vision_prediction_client(endpoint, 'mock')
+    recorder.time_calls(prediction_client, 'detect_image')
+
+    def process(image_file):
+        prepared = image_preprocessing.prepare(image_file, 'custom-vision')
+        results = throttle.call('custom-vision-prediction', prediction_client.detect_image,
+                                'project', 'model', prepared.data)
+        with recorder.annotating():
+            script.save_tagged_images(image_file, results.predictions)
+
+    files = image_files(CORPORA['detect'], repeat)
+    recorder.run(files, process, concurrency)
+    return len(files)
+
+
+def run_upload_classifier(endpoint, recorder, repeat, concurrency):
+    import clients
+    from custom_vision_upload import UploadItem, upload_images
+    from tag_index import TagIndex
+    training_client = clients.custom_vision_training_client(endpoint, 'mock')
+    recorder.time_calls(training_client, 'create_images_from_files')
+    files = image_files(CORPORA['upload-classifier'], repeat)
+    tags = TagIndex(training_client, 'project')
+    tags.ensure(os.path.basename(os.path.dirname(image_file)) for image_file in files)
+    items = [UploadItem(name='{}-{}'.format(index, os.path.basename(image_file)), path=image_file,
+                        tag_ids=[tags[os.path.basename(os.path.dirname(image_file))]])
+             for index, image_file in enumerate(files)]
+
+    start = time.perf_counter()
+    summary = upload_images(training_client, 'project', items, max_workers=concurrency)
+    recorder.items.append(time.perf_counter() - start)
+    recorder.errors += len(summary.failed)
+    return len(items)
+
+
+def run_upload_detector(endpoint, recorder, repeat, concurrency):
+    import clients
+    from azure.cognitiveservices.vision.customvision.training.models import Region
+    from custom_vision_upload import UploadItem, upload_images
+    from tag_index import TagIndex
+    script = load_script('object-detection/python/train-detector/add-tagged-images.py')
+    training_client = clients.custom_vision_training_client(endpoint, 'mock')
+    recorder.time_calls(training_client, 'create_images_from_files')
+    json_path = os.path.join(LABFILES, CORPORA['upload-detector'])
+    tags = TagIndex(training_client, 'project')
+
+    def items():
+        for copy in range(repeat):
+            for entry in script.Read_Tagged_Images(json_path):
+                regions = [Region(tag_id=tags.id_for(tag['tag']), left=tag['left'], top=tag['top'],
+                                  width=tag['width'], height=tag['height']) for tag in entry['tags']]
+                yield UploadItem(name='{}-{}'.format(copy, entry['filename']),
+                                 path=os.path.join(os.path.dirname(json_path), 'images', entry['filename']),
+                                 regions=regions)
+
+    start = time.perf_counter()
+    summary = upload_images(training_client, 'project', items(), max_workers=concurrency)
+    recorder.items.append(time.perf_counter() - start)
+    recorder.errors += len(summary.failed)
+    return summary.uploaded + summary.duplicates + len(summary.failed)
+
+
+def run_dalle(endpoint, recorder, repeat, concurrency):
+    import clients
+    import throttle
+    from generation_cache import GenerationCache
+    script = load_script('dalle-client/python/dalle-client.py')
+    client = clients.openai_client(endpoint, '2024-02-01', api_key='mock')
+    # The script's own path: look the prompt up in the cache, generate and download on a miss,
+    # then copy the image to the images folder. The cache starts empty in the scenario's folder.
+    cache = GenerationCache(folder=os.path.join(os.getcwd(), 'generation-cache'))
+    recorder.time_calls(client.images, 'generate')
+    recorder.time_calls(script, 'download_image')
+
+    def process(item):
+        index, prompt = item
+
+        def generate(image_path):
+            result = throttle.call('openai', client.images.generate, model='dall-e-3', prompt=prompt, n=1)
+            script.download_image(result.data[0].url, image_path)
+            return {'revised_prompt': result.data[0].revised_prompt}
+
+        script.save_cached_image(cache.get_or_generate(prompt, 'dall-e-3', generate),
+                                 'image_{}.png'.format(index))
+
+    prompts = list(enumerate(PROMPTS * repeat))
+    recorder.run(prompts, process, concurrency)
+    return len(prompts)
+
+
+SCENARIOS = {
+    'face': run_face,
+    'image-analysis': run_image_analysis,
+    'ocr': run_ocr,
+    'classify': run_classify,
+    'detect': run_detect,
+    'upload-classifier': run_upload_classifier,
+    'upload-detector': run_upload_detector,
+    'dalle': run_dalle,
+}
+
+
+def percentiles(seconds):
+    """Return the p50, p95, p99 and max of a list of durations, in milliseconds."""
+    if not seconds:
+        return None
+    ordered = sorted(seconds)
+
+    def at(fraction):
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000, 1)
+    return {'p50': at(0.50), 'p95': at(0.95), 'p99': at(0.99), 'max': round(ordered[-1] * 1000, 1)}
+
+
+def peak_rss_mb():
+    """Return this process's peak resident memory in MB, or None where it can't be measured."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def run_child(scenario, endpoint, repeat, concurrency):
+    """Run one scenario in this process and print its measurements as JSON."""
+    recorder = Recorder()
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        items = SCENARIOS[scenario](endpoint, recorder, repeat, concurrency)
+        elapsed = time.perf_counter() - start
+    print(json.dumps({
+        'items': items,
+        'seconds': round(elapsed, 3),
+        'items_per_sec': round(items / elapsed, 2) if elapsed > 0 else None,
+        'item_latency_ms': percentiles(recorder.items),
+        'call_latency_ms': percentiles(recorder.calls),
+        'calls': len(recorder.calls),
+        'network_seconds': round(sum(recorder.calls), 3),
+        'annotation_seconds': round(recorder.annotation, 3),
+        'errors': recorder.errors,
+        'peak_rss_mb': peak_rss_mb(),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the lab scripts against the local mock service.')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help='Comma-separated scenarios to run (default: all of {})'.format(', '.join(SCENARIOS)))
+    parser.add_argument('--repeat', type=int, default=3, help='Times to process each scenario\'s inputs (default: 3)')
+    parser.add_argument('--concurrency', type=int, default=4, help='Items processed at once (default: 4)')
+    parser.add_argument('--latency', type=float, default=50, help='Mock median response time in ms (default: 50)')
+    parser.add_argument('--jitter', type=float, default=10, help='Mock response time standard deviation in ms')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of requests answered with 429')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 500')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the mock service (default: 0)')
+    parser.add_argument('--keep-rate-limits', action='store_true', help='Keep the client-side rate limits')
+    parser.add_argument('--output', default='benchmark-results.json', help='Results file')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--endpoint', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return run_child(args.child, args.endpoint, args.repeat, args.concurrency)
+
+    scenarios = [name for name in args.scenarios.split(',') if name]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error('unknown scenarios: ' + ', '.join(sorted(unknown)))
+
+    env = dict(os.environ)
+    if not args.keep_rate_limits:
+        for service in ('FACE', 'VISION', 'CUSTOM_VISION_TRAINING', 'CUSTOM_VISION_PREDICTION', 'OPENAI'):
+            env['RATE_LIMIT_' + service] = '0'
+
+    settings = {'repeat': args.repeat, 'concurrency': args.concurrency, 'latency_ms': args.latency,
+                'jitter_ms': args.jitter, 'throttle_rate': args.throttle_rate, 'error_rate': args.error_rate,
+                'seed': args.seed, 'rate_limits': args.keep_rate_limits,
+                'preprocess_images': os.getenv('PREPROCESS_IMAGES') == '1'}
+    results = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+               'platform': platform.platform(), 'settings': settings, 'scenarios': {}}
+
+    with MockService(latency=args.latency, jitter=args.jitter, throttle_rate=args.throttle_rate,
+                     error_rate=args.error_rate, retry_after=0.1, train_seconds=0, seed=args.seed) as mock:
+        for scenario in scenarios:
+            mock.state.reset()
+            print('Running {} ...'.format(scenario), end=' ', flush=True)
+            with tempfile.TemporaryDirectory() as workdir:
+                child = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', scenario,
+                                        '--endpoint', mock.endpoint, '--repeat', str(args.repeat),
+                                        '--concurrency', str(args.concurrency)],
+                                       cwd=workdir, env=env, capture_output=True, text=True)
+            if child.returncode != 0:
+                print('failed')
+                results['scenarios'][scenario] = {'error': child.stderr.strip().splitlines()[-1:]}
+                continue
+
+            result = json.loads(child.stdout.strip().splitlines()[-1])
+            stats = mock.state.stats()
+            result['bytes_uploaded'] = stats['bytes_received']
+            result['bytes_downloaded'] = stats['bytes_sent']
+            result['throttled'] = sum(stats['throttled'].values())
+            results['scenarios'][scenario] = result
+            print('{items_per_sec} items/sec, p95 {p95} ms'.format(
+                items_per_sec=result['items_per_sec'], p95=(result['item_latency_ms'] or {}).get('p95')))
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write('\n')
+    print('\nResults saved in', args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Creates the Azure AI clients used by the lab scripts, with pooled keep-alive connections.
+
+By default each SDK client opens connections with its own settings: the Custom Vision
+(msrest) clients don't keep connections alive between calls, and the azure-core and
+OpenAI clients keep only a handful. Batch modes that have many requests in flight then
+spend much of their time opening TLS connections. The factories here give every client a
+connection pool sized for the batch, keep-alive, and explicit timeouts.
+
+The async variants (http_client_async and openai_client_async) return httpx and
+AsyncAzureOpenAI clients, so many requests can be in flight from one thread (dalle-client.py
+uses them for its batch mode). The clients should be closed when done (use them with
+"async with").
+
+Settings (all optional, read from the environment):
+    HTTP_POOL_SIZE          Connections kept open per host (default 16)
+    HTTP_CONNECT_TIMEOUT    Seconds to wait for a connection (default 10)
+    HTTP_READ_TIMEOUT       Seconds to wait for a response (default 120)
+"""
+import os
+
+import requests
+from azure.core.credentials import AzureKeyCredential
+
+
+def pool_size():
+    """Return the number of connections to keep open per host."""
+    return int(os.getenv('HTTP_POOL_SIZE') or 16)
+
+
+def timeouts():
+    """Return the (connect, read) timeouts, in seconds."""
+    return (float(os.getenv('HTTP_CONNECT_TIMEOUT') or 10),
+            float(os.getenv('HTTP_READ_TIMEOUT') or 120))
+
+
+def session(retries=0):
+    """Return a requests Session whose connection pool holds pool_size() connections per host."""
+    size = pool_size()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=size, pool_maxsize=size, max_retries=retries)
+    http_session = requests.Session()
+    http_session.mount('https://', adapter)
+    http_session.mount('http://', adapter)
+    return http_session
+
+
+def transport():
+    """Return an azure-core transport that sends requests over a pooled session."""
+    from azure.core.pipeline.transport import RequestsTransport
+    connect, read = timeouts()
+    return RequestsTransport(session=session(), session_owner=True,
+                             connection_timeout=connect, read_timeout=read)
+
+
+def face_client(endpoint, key):
+    """Return a FaceClient that uses pooled connections."""
+    from azure.ai.vision.face import FaceClient
+    return FaceClient(endpoint=endpoint, credential=AzureKeyCredential(key), transport=transport())
+
+
+def image_analysis_client(endpoint, key):
+    """Return an ImageAnalysisClient that uses pooled connections."""
+    from azure.ai.vision.imageanalysis import ImageAnalysisClient
+    return ImageAnalysisClient(endpoint=endpoint, credential=AzureKeyCredential(key), transport=transport())
+
+
+def custom_vision_training_client(endpoint, key):
+    """Return a CustomVisionTrainingClient that keeps its pooled connections alive between calls."""
+    from azure.cognitiveservices.vision.customvision.training import CustomVisionTrainingClient
+    from msrest.authentication import ApiKeyCredentials
+    client = CustomVisionTrainingClient(endpoint, ApiKeyCredentials(in_headers={"Training-key": key}))
+    configure_msrest(client.config)
+    return client
+
+
+def custom_vision_prediction_client(endpoint, key):
+    """Return a CustomVisionPredictionClient that keeps its pooled connections alive between calls."""
+    from azure.cognitiveservices.vision.customvision.prediction import CustomVisionPredictionClient
+    from msrest.authentication import ApiKeyCredentials
+    client = CustomVisionPredictionClient(endpoint=endpoint,
+                                          credentials=ApiKeyCredentials(in_headers={"Prediction-key": key}))
+    configure_msrest(client.config)
+    return client
+
+
+def configure_msrest(config):
+    """
+    Turn on keep-alive for an msrest client configuration, with timeouts and a larger pool.
+
+    With keep_alive set, msrest reuses one requests Session for every call. Its adapters
+    only hold 10 connections per host, so the session is given a bigger pool (keeping
+    msrest's own retry policy) the first time it is used.
+    """
+    config.keep_alive = True
+    config.connection.timeout = timeouts()
+    size = pool_size()
+
+    def configure_session(http_session, global_config, local_config, **kwargs):
+        if not getattr(http_session, 'lab_pool_configured', False):
+            retries = http_session.get_adapter('https://').max_retries
+            adapter = requests.adapters.HTTPAdapter(pool_connections=size, pool_maxsize=size, max_retries=retries)
+            http_session.mount('https://', adapter)
+            http_session.mount('http://', adapter)
+            http_session.lab_pool_configured = True
+        return kwargs
+
+    config.session_configuration_callback = configure_session
+
+
+def http_client():
+    """Return an httpx Client with a pool of pool_size() connections and the configured timeouts."""
+    import httpx
+    connect, read = timeouts()
+    return httpx.Client(limits=httpx.Limits(max_connections=pool_size(), max_keepalive_connections=pool_size()),
+                        timeout=httpx.Timeout(read, connect=connect))
+
+
+def openai_client(endpoint, api_version, api_key=None, azure_ad_token_provider=None):
+    """Return an AzureOpenAI client that uses a pooled httpx client."""
+    from openai import AzureOpenAI
+    return AzureOpenAI(api_version=api_version, azure_endpoint=endpoint, api_key=api_key,
+                       azure_ad_token_provider=azure_ad_token_provider, http_client=http_client())
+
+
+def http_client_async():
+    """Return an httpx AsyncClient with a pool of pool_size() connections and the configured timeouts."""
+    import httpx
+    connect, read = timeouts()
+    return httpx.AsyncClient(limits=httpx.Limits(max_connections=pool_size(), max_keepalive_connections=pool_size()),
+                             timeout=httpx.Timeout(read, connect=connect))
+
+
+def openai_client_async(endpoint, api_version, api_key=None, azure_ad_token_provider=None):
+    """Return an AsyncAzureOpenAI client that uses a pooled httpx client."""
+    from openai import AsyncAzureOpenAI
+    return AsyncAzureOpenAI(api_version=api_version, azure_endpoint=endpoint, api_key=api_key,
+                            azure_ad_token_provider=azure_ad_token_provider, http_client=http_client_async())
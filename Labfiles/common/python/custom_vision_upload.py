@@ -0,0 +1,175 @@
+"""
+Batched, concurrent uploads of training images to an Azure Custom Vision project.
+
+The training scripts describe each image as a lightweight UploadItem (a file path plus
+its tags or regions). Items are grouped into ImageFileCreateBatch chunks, and each chunk
+is read from disk only when it is about to be sent, so memory use depends on the batch
+size and concurrency rather than on how many images there are.
+
+Chunks that fail with an exception, and images the service rejects with a transient
+status, are put on a retry queue and sent again after the main pass. An optional
+on_uploaded callback is told about each chunk's uploaded images as soon as the chunk
+completes, which is how the upload manifest records progress.
+"""
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from azure.cognitiveservices.vision.customvision.training.models import ImageFileCreateBatch, ImageFileCreateEntry
+
+import throttle
+
+# The service accepts at most 64 images in a single create_images_from_files call
+MAX_BATCH_SIZE = 64
+
+# Image statuses that mean the image is now in the project
+UPLOADED_STATUSES = ("OK", "OKDuplicate")
+
+# Image statuses worth retrying; other errors (bad format, too large, ...) fail the same way every time
+RETRYABLE_STATUSES = ("ErrorStorage", "ErrorUnknown")
+
+# One image to upload: a display name, the file path, and either classification tag IDs or detection regions
+# content_hash is filled in by the upload manifest so uploaded images can be recorded
+UploadItem = namedtuple('UploadItem', ['name', 'path', 'tag_ids', 'regions', 'content_hash'],
+                        defaults=[None, None, None])
+
+
+class UploadSummary:
+    """Counts of uploaded, duplicate and failed images for an upload run."""
+
+    def __init__(self):
+        self.uploaded = 0
+        self.duplicates = 0
+        self.failed = []  # List of (UploadItem, reason) tuples
+
+    def __str__(self):
+        return '{} uploaded, {} duplicates, {} failed'.format(self.uploaded, self.duplicates, len(self.failed))
+
+
+def chunked(items, size):
+    """Yield lists of up to size items from any iterable, consuming it lazily."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def upload_images(training_client, project_id, items, batch_size=MAX_BATCH_SIZE, max_workers=4,
+                  max_retries=3, retry_delay=2, on_uploaded=None):
+    """
+    Upload images to a Custom Vision project in concurrent batches.
+
+    Args:
+        training_client: An authenticated CustomVisionTrainingClient
+        project_id (str): The ID of the project to upload to
+        items: Iterable (typically a generator) of UploadItem
+        batch_size (int): Images per create_images_from_files call (at most 64)
+        max_workers (int): Number of batches uploaded at the same time
+        max_retries (int): Number of times the retry queue is sent again
+        retry_delay (float): Seconds to wait before the first retry; doubles for each later retry
+        on_uploaded (callable): Optional function called with the list of items from each
+                                chunk that are now in the project (including duplicates)
+
+    Returns:
+        UploadSummary: What was uploaded, and which images failed and why
+    """
+    batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+    summary = UploadSummary()
+
+    # Main pass over all the items, collecting anything that should be retried
+    retry_queue = _upload_pass(training_client, project_id, chunked(items, batch_size), max_workers, summary,
+                               on_uploaded)
+
+    # Send the retry queue again, backing off between attempts
+    for attempt in range(1, max_retries + 1):
+        if not retry_queue:
+            break
+        print('Retrying {} images (attempt {})...'.format(len(retry_queue), attempt))
+        time.sleep(retry_delay * 2 ** (attempt - 1))
+        pending = [item for item, reason in retry_queue]
+        retry_queue = _upload_pass(training_client, project_id, chunked(pending, batch_size), max_workers, summary,
+                                   on_uploaded)
+
+    # Whatever is still queued after the last attempt has failed
+    summary.failed.extend(retry_queue)
+    return summary
+
+
+def _upload_pass(training_client, project_id, chunks, max_workers, summary, on_uploaded):
+    """Upload chunks with at most max_workers in flight; return the (item, reason) retry queue."""
+    retry_queue = []
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        in_flight = {}
+        for chunk in chunks:
+            # Only pull the next chunk from the generator when there is room for it,
+            # so no more than max_workers * 2 chunks are held in memory
+            while len(in_flight) >= max_workers * 2:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    _collect(in_flight.pop(future), future, summary, retry_queue, on_uploaded)
+            in_flight[executor.submit(_upload_chunk, training_client, project_id, chunk)] = chunk
+
+        for future in list(in_flight):
+            _collect(in_flight.pop(future), future, summary, retry_queue, on_uploaded)
+    return retry_queue
+
+
+def _upload_chunk(training_client, project_id, chunk):
+    """Read the files for one chunk and send them as a single batch."""
+    entries = []
+    unreadable = []
+    for item in chunk:
+        try:
+            with open(item.path, mode="rb") as image_data:
+                entries.append(ImageFileCreateEntry(name=item.name, contents=image_data.read(),
+                                                    tag_ids=item.tag_ids, regions=item.regions))
+        except OSError as ex:
+            unreadable.append((item, str(ex)))
+
+    result = None
+    if entries:
+        result = throttle.call('custom-vision-training', training_client.create_images_from_files,
+                               project_id, ImageFileCreateBatch(images=entries))
+    return result, unreadable
+
+
+def _collect(chunk, future, summary, retry_queue, on_uploaded):
+    """Record the outcome of one chunk in the summary and retry queue."""
+    try:
+        result, unreadable = future.result()
+    except Exception as ex:
+        # The whole request failed (network error, throttling, ...), so retry every image in it
+        retry_queue.extend((item, str(ex)) for item in chunk)
+        return
+
+    # Files that couldn't be read won't get better by retrying
+    summary.failed.extend(unreadable)
+    skipped = set(item.name for item, reason in unreadable)
+
+    # The service reports each image by the name it was uploaded with
+    statuses = {}
+    if result is not None:
+        statuses = dict((image.source_url, image.status) for image in result.images)
+
+    uploaded = []
+    for item in chunk:
+        if item.name in skipped:
+            continue
+        status = statuses.get(item.name)
+        if status in UPLOADED_STATUSES:
+            uploaded.append(item)
+            if status == "OK":
+                summary.uploaded += 1
+            else:
+                summary.duplicates += 1
+        elif status is None or status in RETRYABLE_STATUSES:
+            retry_queue.append((item, status or 'no status returned'))
+        else:
+            summary.failed.append((item, status))
+
+    if uploaded and on_uploaded is not None:
+        on_uploaded(uploaded)
@@ -0,0 +1,260 @@
+"""
+An on-disk cache of generated images, keyed by prompt and generation settings.
+
+Entries are keyed by the normalized prompt (case, surrounding punctuation and runs of
+whitespace don't matter), the model deployment and the other generation options (such
+as size, quality and style), so a prompt that was generated before is answered from
+disk instead of generating (and paying for) a new image. Each entry is the image file
+and a JSON file with its metadata (prompt, revised prompt, settings, creation time).
+
+Identical prompts requested at the same time are generated only once: the first request
+generates the image and the others wait for it and share the result. This works for
+threads (get_or_generate) and for asyncio tasks (get_or_generate_async).
+
+Entries older than max_age are ignored and removed, and when the cache grows beyond
+max_bytes the least recently used entries are deleted.
+
+Settings (all optional, read from the environment):
+    GENERATION_CACHE            Set to 0 to turn the cache off (see enabled())
+    GENERATION_CACHE_DIR        Folder for the cache (default ~/.cache/mslearn-ai-vision/image-generation)
+    GENERATION_CACHE_MAX_MB     Maximum total size in megabytes (default 1024)
+    GENERATION_CACHE_MAX_DAYS   Maximum age of an entry in days (default 30)
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import unicodedata
+from concurrent.futures import Future
+
+
+def enabled():
+    """Return True unless the cache has been turned off (GENERATION_CACHE=0)."""
+    return os.getenv('GENERATION_CACHE') != '0'
+
+
+def normalize_prompt(prompt):
+    """Return the prompt with Unicode forms, case, whitespace runs and surrounding punctuation normalized."""
+    prompt = unicodedata.normalize('NFKC', prompt).casefold()
+    prompt = re.sub(r'\s+', ' ', prompt)
+    return prompt.strip(' .,;:!?"\'')
+
+
+class GenerationCache:
+    """Read-through cache of generated image files, with in-flight de-duplication."""
+
+    def __init__(self, folder=None, max_bytes=None, max_age=None):
+        """
+        Open (or create) the cache folder.
+
+        Args:
+            folder (str): Cache folder; defaults to GENERATION_CACHE_DIR or a per-user cache folder
+            max_bytes (int): Size limit in bytes; defaults to GENERATION_CACHE_MAX_MB
+            max_age (float): Entry lifetime in seconds; defaults to GENERATION_CACHE_MAX_DAYS
+        """
+        self.folder = folder or os.getenv('GENERATION_CACHE_DIR') or os.path.join(
+            os.path.expanduser('~'), '.cache', 'mslearn-ai-vision', 'image-generation')
+        self.max_bytes = max_bytes or int(float(os.getenv('GENERATION_CACHE_MAX_MB') or 1024) * 1024 * 1024)
+        self.max_age = max_age or float(os.getenv('GENERATION_CACHE_MAX_DAYS') or 30) * 24 * 3600
+        os.makedirs(self.folder, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0  # Requests that waited for an identical request already in flight
+        self._lock = threading.Lock()
+        self._pending = {}        # key -> concurrent.futures.Future, for threads
+        self._pending_async = {}  # key -> asyncio.Future, for asyncio tasks
+        self._size = sum(self._entry_size(path) for path, mtime in self._entries())
+
+    def key(self, prompt, model, **options):
+        """Return the cache key for a prompt, model deployment and other generation options."""
+        settings = json.dumps({'prompt': normalize_prompt(prompt), 'model': model, 'options': options},
+                              sort_keys=True, default=str)
+        return hashlib.sha256(settings.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        Return the cached entry for key, or None if it is missing or expired.
+
+        The entry is the image's metadata, with 'image' set to the path of the image file
+        and 'cached' set to True (entries for newly generated images have it set to False).
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'r') as entry_file:
+                entry = json.load(entry_file)
+        except (OSError, ValueError):
+            return None
+        image_path = self._image_path(key)
+        if time.time() - entry.get('created', 0) > self.max_age or not os.path.exists(image_path):
+            self._remove(path)
+            return None
+        # Touch the file so eviction treats it as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            # Evicted (by another thread or process) since it was read: treat it as a miss
+            return None
+        entry.update(image=image_path, cached=True)
+        return entry
+
+    def get_or_generate(self, prompt, model, generate, **options):
+        """
+        Return the cached entry for a prompt, generating the image first if it isn't cached.
+
+        generate(image_path) is called on a miss: it must generate the image, save it to
+        image_path and return a metadata dictionary (such as the revised prompt). If another
+        thread is already generating the same prompt, this waits for it instead.
+        """
+        key = self.key(prompt, model, **options)
+        entry = self.get(key)
+        if entry is not None:
+            self._count('hits')
+            return entry
+
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None:
+                # A request that just finished stores its entry before it stops being pending
+                entry = self.get(key)
+                if entry is not None:
+                    self.hits += 1
+                    return entry
+            leader = pending is None
+            if leader:
+                pending = self._pending[key] = Future()
+                self.misses += 1
+            else:
+                self.shared += 1
+        if not leader:
+            return pending.result()
+
+        try:
+            entry = self._store(key, prompt, model, options, generate(self._image_path(key)))
+            pending.set_result(entry)
+            return entry
+        except BaseException as ex:
+            pending.set_exception(ex)
+            raise
+        finally:
+            with self._lock:
+                del self._pending[key]
+
+    async def get_or_generate_async(self, prompt, model, generate, **options):
+        """Await the cached entry for a prompt, like get_or_generate, with an async generate(image_path)."""
+        key = self.key(prompt, model, **options)
+        entry = self.get(key)
+        if entry is not None:
+            self._count('hits')
+            return entry
+
+        pending = self._pending_async.get(key)
+        if pending is not None:
+            self._count('shared')
+            # shield() keeps a cancelled waiter from cancelling the generation the others wait for
+            return await asyncio.shield(pending)
+
+        # Another thread or process using the same folder may have stored it since the first look
+        entry = self.get(key)
+        if entry is not None:
+            self._count('hits')
+            return entry
+
+        self._count('misses')
+        pending = self._pending_async[key] = asyncio.get_running_loop().create_future()
+        try:
+            entry = self._store(key, prompt, model, options, await generate(self._image_path(key)))
+            pending.set_result(entry)
+            return entry
+        except asyncio.CancelledError:
+            pending.cancel()
+            raise
+        except BaseException as ex:
+            pending.set_exception(ex)
+            pending.exception()  # Mark it retrieved, so asyncio doesn't warn if nobody was waiting
+            raise
+        finally:
+            del self._pending_async[key]
+
+    def evict(self):
+        """Remove expired entries, then the least recently used ones until the cache is under 90% of its limit."""
+        with self._lock:
+            now = time.time()
+            entries = []
+            for path, mtime in self._entries():
+                if now - mtime > self.max_age:
+                    self._remove(path)
+                else:
+                    entries.append((mtime, path))
+            self._size = sum(self._entry_size(path) for mtime, path in entries)
+            for mtime, path in sorted(entries):
+                if self._size <= self.max_bytes * 0.9:
+                    break
+                self._size -= self._entry_size(path)
+                self._remove(path)
+
+    def _store(self, key, prompt, model, options, metadata):
+        """Write the metadata for a newly generated image and return its entry."""
+        path = self._path(key)
+        entry = dict(metadata or {}, prompt=prompt, model=model, options=options, created=time.time())
+        # Write to a temporary file and rename it, so readers never see a partial entry
+        handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'w') as entry_file:
+                json.dump(entry, entry_file, default=str)
+            os.replace(temp_path, path)
+        finally:
+            # Only left behind if writing the entry failed
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        with self._lock:
+            self._size += self._entry_size(path)
+            over_limit = self._size > self.max_bytes
+        if over_limit:
+            self.evict()
+        entry.update(image=self._image_path(key), cached=False)
+        return entry
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _path(self, key):
+        # Spread entries over subfolders so no single folder gets too large
+        folder = os.path.join(self.folder, key[:2])
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, key + '.json')
+
+    def _image_path(self, key):
+        return self._path(key)[:-len('.json')] + '.png'
+
+    def _entries(self):
+        for root, folders, files in os.walk(self.folder):
+            for name in files:
+                if name.endswith('.json'):
+                    path = os.path.join(root, name)
+                    try:
+                        yield path, os.path.getmtime(path)
+                    except OSError:
+                        continue
+
+    @staticmethod
+    def _entry_size(path):
+        size = 0
+        for file_path in (path, path[:-len('.json')] + '.png'):
+            try:
+                size += os.path.getsize(file_path)
+            except OSError:
+                pass
+        return size
+
+    @staticmethod
+    def _remove(path):
+        for file_path in (path, path[:-len('.json')] + '.png'):
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
@@ -0,0 +1,85 @@
+"""
+Draws detection results (boxes, polygons and labels) directly onto images with Pillow.
+
+The lab scripts used to draw on the image with PIL, show it in a matplotlib figure and
+save the figure, which re-rasterized and re-encoded the image at the figure's DPI. These
+helpers draw everything on the decoded image itself and encode it once, at its native
+resolution, when it is saved.
+
+Pillow is imported by the functions that use it rather than at the top of this module, so
+scripts can import these helpers without paying for Pillow on runs that never annotate.
+"""
+
+
+def load(image_file, page=0):
+    """
+    Open and decode an image, converted to RGB so it can be annotated in color and saved as JPEG.
+    For multi-page images (such as TIFF scans), page selects the page (frame) to load.
+    """
+    from PIL import Image
+    image = Image.open(image_file)
+    if page:
+        image.seek(page)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image
+
+
+def label_font(image):
+    """Return a font sized for the image (the default bitmap font on older Pillow versions)."""
+    from PIL import ImageFont
+    size = max(12, image.height // 50)
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 has no scalable default font
+        return ImageFont.load_default()
+
+
+def draw_boxes(image, boxes, color, width=3, labels=None):
+    """
+    Draw rectangles, with optional labels at their top-left corners.
+
+    Args:
+        image: A PIL Image, drawn on in place
+        boxes: Iterable of (left, top, right, bottom) pixel coordinates
+        color: Outline and label background color
+        width (int): Outline width in pixels
+        labels: Optional list of label strings, one per box
+    """
+    from PIL import ImageDraw
+    draw = ImageDraw.Draw(image)
+    font = label_font(image) if labels else None
+    for index, box in enumerate(boxes):
+        draw.rectangle(box, outline=color, width=width)
+        if labels:
+            draw_label(draw, labels[index], (box[0], box[1]), color, font)
+
+
+def draw_polygons(image, polygons, color, width=3):
+    """
+    Draw closed polygons (such as OCR bounding polygons).
+
+    Args:
+        image: A PIL Image, drawn on in place
+        polygons: Iterable of point sequences, each point an (x, y) pair
+        color: Outline color
+        width (int): Outline width in pixels
+    """
+    from PIL import ImageDraw
+    draw = ImageDraw.Draw(image)
+    for points in polygons:
+        draw.polygon([tuple(point) for point in points], outline=color, width=width)
+
+
+def draw_label(draw, text, position, color, font):
+    """Draw text in black on a filled background of the given color, with its top-left corner at position."""
+    left, top, right, bottom = draw.textbbox(position, text, font=font)
+    padding = 2
+    draw.rectangle((left - padding, top - padding, right + padding, bottom + padding), fill=color)
+    draw.text(position, text, fill='black', font=font)
+
+
+def save(image, output_file, quality=90):
+    """Encode and save the annotated image once, at its original resolution."""
+    image.save(output_file, quality=quality)
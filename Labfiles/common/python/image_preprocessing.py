@@ -0,0 +1,129 @@
+"""
+Optional client-side preprocessing that shrinks images before they are uploaded.
+
+Photos straight from a camera are often several megabytes and far larger than a service
+needs. When preprocessing is enabled (PREPROCESS_IMAGES=1), prepare() downsizes an image
+so its longest side is no more than the service's useful maximum, and re-encodes it as a
+JPEG without EXIF metadata (turned upright first, since its EXIF orientation is dropped).
+Coordinates the service returns for the smaller image are mapped back to the original
+image with the rescale_* helpers, so annotations still line up with the original file.
+
+Settings (all optional, read from the environment):
+    PREPROCESS_IMAGES          Set to 1 to enable preprocessing (default off)
+    PREPROCESS_MAX_DIMENSION   Override the longest side, in pixels, for every service
+    PREPROCESS_JPEG_QUALITY    JPEG quality for the re-encoded image (default 85)
+"""
+import io
+import os
+from collections import namedtuple
+
+# Longest side, in pixels, beyond which a larger image doesn't improve each service's results
+MAX_DIMENSIONS = {
+    'face': 1920,            # The Face API finds faces down to 36 px in images up to 1920 x 1080
+    'image-analysis': 2048,  # Captions, tags, objects and people
+    'ocr': 4096,             # Text needs more pixels; larger pages are tiled by read-text.py
+    'custom-vision': 1024,   # Custom Vision models work on much smaller inputs than this
+}
+
+# EXIF tag for the orientation the camera was held in
+ORIENTATION = 0x0112
+
+# The bytes to upload, and the factors that map coordinates on them back to the original image
+PreparedImage = namedtuple('PreparedImage', ['data', 'scale_x', 'scale_y'])
+
+
+def enabled():
+    """Return True if preprocessing has been turned on with PREPROCESS_IMAGES=1."""
+    return os.getenv('PREPROCESS_IMAGES') == '1'
+
+
+def prepare(image_file, service, force=None):
+    """
+    Return the bytes to upload for an image, downsized and re-encoded if preprocessing is enabled.
+
+    Args:
+        image_file (str): Path to the original image
+        service (str): One of the keys of MAX_DIMENSIONS
+        force (bool): Override the PREPROCESS_IMAGES setting (used by the benchmark)
+
+    Returns:
+        PreparedImage: The upload bytes, plus scale factors of 1.0 when the image wasn't resized
+    """
+    with open(image_file, 'rb') as f:
+        original = f.read()
+    if not (enabled() if force is None else force):
+        return PreparedImage(original, 1.0, 1.0)
+
+    # Pillow is only imported when preprocessing is enabled
+    from PIL import Image, ImageOps
+
+    max_dimension = int(os.getenv('PREPROCESS_MAX_DIMENSION') or MAX_DIMENSIONS[service])
+    quality = int(os.getenv('PREPROCESS_JPEG_QUALITY') or 85)
+
+    with Image.open(io.BytesIO(original)) as image:
+        # The EXIF orientation is applied before resizing, so sizes and scale factors are those
+        # of the upright image (the one services report coordinates on). Orientations 5 to 8
+        # turn the image a quarter turn, swapping its width and height
+        rotated = image.getexif().get(ORIENTATION, 1) in (5, 6, 7, 8)
+        width, height = image.size[::-1] if rotated else image.size
+        scale = min(1.0, max_dimension / max(width, height))
+        new_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        if scale < 1.0:
+            # Let the JPEG decoder skip detail that resizing would throw away anyway
+            image.draft('RGB', new_size[::-1] if rotated else new_size)
+        converted = ImageOps.exif_transpose(image).convert('RGB')
+        if converted.size != new_size:
+            converted = converted.resize(new_size, Image.LANCZOS)
+
+        # Saving without the exif argument strips the EXIF metadata
+        buffer = io.BytesIO()
+        converted.save(buffer, format='JPEG', quality=quality, optimize=True)
+        data = buffer.getvalue()
+
+    if scale == 1.0 and len(data) >= len(original):
+        # Re-encoding didn't make a full-size image any smaller, so upload the original
+        return PreparedImage(original, 1.0, 1.0)
+    return PreparedImage(data, width / new_size[0], height / new_size[1])
+
+
+def rescale_faces(detected_faces, prepared):
+    """Map face rectangles from a prepared image back to the original image, in place."""
+    if prepared.scale_x == 1.0 and prepared.scale_y == 1.0:
+        return detected_faces
+    for face in detected_faces:
+        r = face.face_rectangle
+        r.left, r.width = round(r.left * prepared.scale_x), round(r.width * prepared.scale_x)
+        r.top, r.height = round(r.top * prepared.scale_y), round(r.height * prepared.scale_y)
+    return detected_faces
+
+
+def rescale_analysis(result, prepared):
+    """
+    Map the coordinates in an ImageAnalysisResult from a prepared image back to the original image, in place.
+
+    Covers object, people and dense caption bounding boxes, text line and word
+    polygons, and the image size in the result metadata.
+    """
+    sx, sy = prepared.scale_x, prepared.scale_y
+    if sx == 1.0 and sy == 1.0:
+        return result
+
+    boxes = []
+    for detections in (result.objects, result.people, result.dense_captions):
+        if detections is not None:
+            boxes.extend(detection.bounding_box for detection in detections.list)
+    for box in boxes:
+        box.x, box.width = round(box.x * sx), round(box.width * sx)
+        box.y, box.height = round(box.y * sy), round(box.height * sy)
+
+    if result.read is not None:
+        for block in result.read.blocks:
+            for line in block.lines:
+                for item in [line] + list(line.words):
+                    for point in item.bounding_polygon:
+                        point.x, point.y = round(point.x * sx), round(point.y * sy)
+
+    if result.metadata is not None:
+        result.metadata.width = round(result.metadata.width * sx)
+        result.metadata.height = round(result.metadata.height * sy)
+    return result
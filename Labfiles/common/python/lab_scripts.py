@@ -0,0 +1,35 @@
+"""
+Locates the lab scripts and imports them as modules, so shared tools can reuse their functions.
+
+The scripts' file names contain hyphens (such as analyze-faces.py), so they can't be
+imported with an import statement. Loading a script runs its top-level code (imports
+and constants) but not its main() function.
+"""
+import importlib.util
+import os
+
+# The Labfiles folder, which contains every lab
+LABFILES = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+# Every lab script, relative to LABFILES
+SCRIPTS = [
+    'face/python/face-api/analyze-faces.py',
+    'analyze-images/python/image-analysis/image-analysis.py',
+    'ocr/python/read-text/read-text.py',
+    'image-classification/python/test-classifier/test-classifier.py',
+    'image-classification/python/train-classifier/train-classifier.py',
+    'object-detection/python/test-detector/test-detector.py',
+    'object-detection/python/train-detector/add-tagged-images.py',
+    'dalle-client/python/dalle-client.py',
+    'gen-ai-vision/python/chat-app.py',
+]
+
+
+def load_script(relative_path):
+    """Import a lab script (given relative to LABFILES) as a module and return it."""
+    path = os.path.join(LABFILES, relative_path)
+    name = os.path.splitext(os.path.basename(path))[0].replace('-', '_')
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,479 @@
+"""
+A local stand-in for the Azure AI services the lab scripts call, for load testing without
+using real quota.
+
+The server answers the subset of the REST API the scripts use, with plausible results
+generated from a hash of each request (so the same image always gets the same answer):
+    Image Analysis   POST .../computervision/imageanalysis:analyze (read, caption, tags,
+                     objects, people and denseCaptions)
+    Face             POST .../face/.../detect
+    Custom Vision    POST .../Prediction/{project}/classify|detect/iterations/{name}/image
+                     GET  .../training/projects/{project}
+                     GET/POST .../training/projects/{project}/tags
+                     POST .../training/projects/{project}/images/files
+                     POST .../training/projects/{project}/train
+                     GET  .../training/projects/{project}/iterations/{iteration}
+    Azure OpenAI     POST .../images/generations and .../chat/completions
+    Image downloads  GET  /_blob/{name}.png (the URLs returned by images/generations; the
+                     most recent MAX_BLOBS images are kept)
+and reports what it has served at GET /_stats (POST /_reset clears the counters).
+
+Latency, failures and throttling can be injected so the scripts' throughput and tail
+latency can be measured reproducibly:
+    --latency MS        Median response time (default 50)
+    --jitter MS         Standard deviation of the response time (default 10)
+    --slow-rate P       Fraction of requests that take --slow-ms longer (default 0)
+    --slow-ms MS        Extra time for slow requests (default 1000)
+    --error-rate P      Fraction of requests that fail with 500 (default 0)
+    --throttle-rate P   Fraction of requests that are refused with 429 (default 0)
+    --rate N            Requests per second accepted before answering 429, like a real
+                        quota (default 0, no limit)
+    --retry-after S     Retry-After value sent with 429 responses (default 1)
+    --train-seconds S   Time a training iteration takes to complete (default 2)
+    --seed N            Seed for the injected latency and failures (default 0)
+
+Usage:
+    python mock_service.py --port 8799 --latency 80 --throttle-rate 0.05
+then point a lab's .env at it, for example AI_SERVICE_ENDPOINT=http://localhost:8799/
+(any key is accepted). Scripts such as benchmark.py start it in-process with MockService.
+"""
+import argparse
+import base64
+import hashlib
+import io
+import json
+import random
+import re
+import struct
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter, OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+TAG_NAMES = ('apple', 'banana', 'orange')
+OBJECT_NAMES = ('person', 'car', 'bicycle', 'dog', 'chair', 'bottle')
+WORDS = ('the', 'quick', 'brown', 'fox', 'jumps', 'over', 'lazy', 'dog', 'Lincoln', 'memorial')
+ACCESSORY_TYPES = ('headwear', 'glasses', 'mask')
+
+# Generated images kept for download; older ones are dropped so a long run doesn't grow without bound
+MAX_BLOBS = 256
+
+
+def image_size(data):
+    """Return the (width, height) of image bytes, or a typical photo size if they can't be read."""
+    try:
+        from PIL import Image
+        with Image.open(io.BytesIO(data)) as image:
+            return image.size
+    except Exception:
+        return (1024, 768)
+
+
+def png(width, height, color):
+    """Return the bytes of a solid-color RGB PNG image (written without any imaging library)."""
+    def chunk(kind, payload):
+        return (struct.pack('>I', len(payload)) + kind + payload
+                + struct.pack('>I', zlib.crc32(kind + payload) & 0xffffffff))
+    row = b'\x00' + bytes(color) * width
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(row * height, 6))
+            + chunk(b'IEND', b''))
+
+
+def now_iso():
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+
+
+def box(rng, width, height):
+    """Return a random (x, y, w, h) box inside an image."""
+    w = rng.randint(max(1, width // 10), max(1, width // 3))
+    h = rng.randint(max(1, height // 10), max(1, height // 3))
+    return rng.randint(0, width - w), rng.randint(0, height - h), w, h
+
+
+class MockState:
+    """Settings, counters and training state shared by the request handlers."""
+
+    def __init__(self, latency=50, jitter=10, slow_rate=0.0, slow_ms=1000, error_rate=0.0,
+                 throttle_rate=0.0, rate=0.0, retry_after=1, train_seconds=2, seed=0):
+        self.latency = latency / 1000
+        self.jitter = jitter / 1000
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms / 1000
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.rate = rate
+        self.retry_after = retry_after
+        self.train_seconds = train_seconds
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.rng = random.Random(self.seed)
+            self.requests = Counter()
+            self.throttled = Counter()
+            self.failed = Counter()
+            self.bytes_received = 0
+            self.bytes_sent = 0
+            self.projects = {}
+            self.blobs = OrderedDict()
+            self._window = (0, 0)  # (second, requests received in it) for --rate
+
+    def stats(self):
+        with self.lock:
+            return {'requests': dict(self.requests), 'throttled': dict(self.throttled),
+                    'failed': dict(self.failed), 'bytes_received': self.bytes_received,
+                    'bytes_sent': self.bytes_sent}
+
+    def outcome(self, route):
+        """Decide, for one request, its delay and whether it is throttled or fails."""
+        with self.lock:
+            self.requests[route] += 1
+            delay = max(0.0, self.rng.gauss(self.latency, self.jitter))
+            if self.rng.random() < self.slow_rate:
+                delay += self.slow_ms
+            second = int(time.monotonic())
+            count = self._window[1] + 1 if self._window[0] == second else 1
+            self._window = (second, count)
+            if self.rng.random() < self.throttle_rate or (self.rate and count > self.rate):
+                self.throttled[route] += 1
+                return delay, 429
+            if self.rng.random() < self.error_rate:
+                self.failed[route] += 1
+                return delay, 500
+            return delay, 200
+
+    def project(self, project_id):
+        with self.lock:
+            return self.projects.setdefault(project_id, {'tags': {}, 'images': set(), 'iterations': {}})
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """Routes each request to a handler method; see the module docstring for the endpoints."""
+
+    protocol_version = 'HTTP/1.1'  # Keep connections alive, as the real services do
+    state = None                   # Set on a subclass by MockService
+
+    ROUTES = [
+        ('GET', r'/_stats$', 'stats'),
+        ('POST', r'/_reset$', 'reset'),
+        ('GET', r'/_blob/(?P<name>[^/]+)\.png$', 'blob'),
+        ('POST', r'/computervision/imageanalysis:analyze$', 'analyze'),
+        ('POST', r'/face/.*/detect$', 'face_detect'),
+        ('POST', r'/prediction/(?P<project>[^/]+)/(?P<kind>classify|detect)/iterations/[^/]+/image(/nostore)?$', 'predict'),
+        ('GET', r'/training/projects/(?P<project>[^/]+)$', 'get_project'),
+        ('GET', r'/training/projects/(?P<project>[^/]+)/tags$', 'get_tags'),
+        ('POST', r'/training/projects/(?P<project>[^/]+)/tags$', 'create_tag'),
+        ('POST', r'/training/projects/(?P<project>[^/]+)/images/files$', 'create_images'),
+        ('POST', r'/training/projects/(?P<project>[^/]+)/train$', 'train_project'),
+        ('GET', r'/training/projects/(?P<project>[^/]+)/iterations/(?P<iteration>[^/]+)$', 'get_iteration'),
+        ('POST', r'/images/generations$', 'generate_images'),
+        ('POST', r'/chat/completions$', 'chat'),
+    ]
+
+    def log_message(self, format, *args):
+        pass  # Don't print a line per request
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def dispatch(self, method):
+        url = urlparse(self.path)
+        self.query = parse_qs(url.query)
+        length = int(self.headers.get('Content-Length') or 0)
+        self.body = self.rfile.read(length) if length else b''
+        with self.state.lock:
+            self.state.bytes_received += len(self.body)
+
+        for route_method, pattern, route in self.ROUTES:
+            match = re.search(pattern, url.path, re.IGNORECASE)
+            if route_method == method and match:
+                break
+        else:
+            return self.send_json({'error': {'code': 'NotFound', 'message': 'No mock for ' + url.path}}, 404)
+
+        if not route.startswith(('stats', 'reset')):
+            delay, status = self.state.outcome(route)
+            time.sleep(delay)
+            if status == 429:
+                return self.send_json({'error': {'code': '429', 'message': 'Rate limit is exceeded. Try again later.'}},
+                                      429, {'Retry-After': str(self.state.retry_after)})
+            if status == 500:
+                return self.send_json({'error': {'code': 'InternalServerError', 'message': 'Injected failure'},
+                                       'code': 'InternalServerError', 'message': 'Injected failure'}, 500)
+        # Results depend only on the request, so repeated runs get the same answers
+        self.rng = random.Random(hashlib.sha256(url.path.encode() + self.body).digest())
+        getattr(self, 'handle_' + route)(**match.groupdict())
+
+    def send_json(self, payload, status=200, headers=None):
+        self.send_bytes(json.dumps(payload).encode(), 'application/json', status, headers)
+
+    def send_bytes(self, data, content_type, status=200, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+        with self.state.lock:
+            self.state.bytes_sent += len(data)
+
+    def json_body(self):
+        return json.loads(self.body or b'{}')
+
+    # ----- Mock internals -----
+
+    def handle_stats(self):
+        self.send_json(self.state.stats())
+
+    def handle_reset(self):
+        self.state.reset()
+        self.send_json({})
+
+    def handle_blob(self, name):
+        data = self.state.blobs.get(name)
+        if data is None:
+            return self.send_json({'error': {'code': 'BlobNotFound', 'message': name}}, 404)
+        self.send_bytes(data, 'image/png', headers={'Content-MD5': base64.b64encode(hashlib.md5(data).digest()).decode()})
+
+    # ----- Image Analysis -----
+
+    def handle_analyze(self):
+        rng = self.rng
+        width, height = image_size(self.body)
+        features = {name.lower() for value in self.query.get('features', []) for name in value.split(',')}
+        result = {'modelVersion': '2023-10-01', 'metadata': {'width': width, 'height': height}}
+        if 'caption' in features:
+            result['captionResult'] = {'text': 'a {} near a {}'.format(*rng.sample(OBJECT_NAMES, 2)),
+                                       'confidence': round(rng.uniform(0.5, 1.0), 4)}
+        if 'densecaptions' in features:
+            result['denseCaptionsResult'] = {'values': [
+                {'text': 'a ' + rng.choice(OBJECT_NAMES), 'confidence': round(rng.uniform(0.5, 1.0), 4),
+                 'boundingBox': dict(zip('xywh', box(rng, width, height)))} for _ in range(rng.randint(1, 5))]}
+        if 'tags' in features:
+            result['tagsResult'] = {'values': [{'name': name, 'confidence': round(rng.uniform(0.5, 1.0), 4)}
+                                               for name in rng.sample(OBJECT_NAMES, 3)]}
+        if 'objects' in features:
+            result['objectsResult'] = {'values': [
+                {'boundingBox': dict(zip('xywh', box(rng, width, height))),
+                 'tags': [{'name': rng.choice(OBJECT_NAMES), 'confidence': round(rng.uniform(0.5, 1.0), 4)}]}
+                for _ in range(rng.randint(0, 6))]}
+        if 'people' in features:
+            result['peopleResult'] = {'values': [
+                {'boundingBox': dict(zip('xywh', box(rng, width, height))), 'confidence': round(rng.uniform(0.0, 1.0), 4)}
+                for _ in range(rng.randint(0, 6))]}
+        if 'read' in features:
+            lines = []
+            line_height = max(10, height // 20)
+            for index in range(rng.randint(1, 10)):
+                top, left = index * line_height, 0
+                words = []
+                for text in rng.sample(WORDS, rng.randint(1, 5)):
+                    right = left + len(text) * line_height // 2
+                    words.append({'text': text, 'confidence': round(rng.uniform(0.7, 1.0), 3),
+                                  'boundingPolygon': [{'x': left, 'y': top}, {'x': right, 'y': top},
+                                                      {'x': right, 'y': top + line_height}, {'x': left, 'y': top + line_height}]})
+                    left = right + line_height // 4
+                polygon = [words[0]['boundingPolygon'][0], words[-1]['boundingPolygon'][1],
+                           words[-1]['boundingPolygon'][2], words[0]['boundingPolygon'][3]]
+                lines.append({'text': ' '.join(word['text'] for word in words), 'boundingPolygon': polygon, 'words': words})
+            result['readResult'] = {'blocks': [{'lines': lines}]}
+        self.send_json(result)
+
+    # ----- Face -----
+
+    def handle_face_detect(self):
+        rng = self.rng
+        width, height = image_size(self.body)
+        attributes = {name for value in self.query.get('returnFaceAttributes', []) for name in value.split(',')}
+        faces = []
+        for _ in range(rng.randint(0, 4)):
+            x, y, w, h = box(rng, width, height)
+            face = {'faceRectangle': {'left': x, 'top': y, 'width': w, 'height': h}, 'faceAttributes': {}}
+            if self.query.get('returnFaceId', ['false'])[0].lower() == 'true':
+                face['faceId'] = str(uuid.UUID(int=rng.getrandbits(128)))
+            if 'headPose' in attributes:
+                face['faceAttributes']['headPose'] = {name: round(rng.uniform(-45, 45), 1) for name in ('yaw', 'pitch', 'roll')}
+            if 'occlusion' in attributes:
+                face['faceAttributes']['occlusion'] = {name: rng.random() < 0.2 for name in
+                                                       ('foreheadOccluded', 'eyeOccluded', 'mouthOccluded')}
+            if 'accessories' in attributes:
+                face['faceAttributes']['accessories'] = [{'type': name, 'confidence': round(rng.uniform(0.5, 1.0), 2)}
+                                                         for name in ACCESSORY_TYPES if rng.random() < 0.3]
+            faces.append(face)
+        self.send_json(faces)
+
+    # ----- Custom Vision prediction -----
+
+    def handle_predict(self, project, kind):
+        rng = self.rng
+        if kind.lower() == 'classify':
+            scores = [rng.random() for _ in TAG_NAMES]
+            predictions = [{'probability': score / sum(scores), 'tagId': str(uuid.uuid5(uuid.NAMESPACE_OID, name)),
+                            'tagName': name} for name, score in zip(TAG_NAMES, scores)]
+        else:
+            predictions = []
+            for _ in range(rng.randint(0, 5)):
+                left, top = rng.uniform(0, 0.7), rng.uniform(0, 0.7)
+                name = rng.choice(TAG_NAMES)
+                predictions.append({'probability': rng.random(), 'tagId': str(uuid.uuid5(uuid.NAMESPACE_OID, name)),
+                                    'tagName': name, 'boundingBox': {'left': left, 'top': top,
+                                                                     'width': rng.uniform(0.05, 0.3),
+                                                                     'height': rng.uniform(0.05, 0.3)}})
+        predictions.sort(key=lambda prediction: prediction['probability'], reverse=True)
+        self.send_json({'id': str(uuid.uuid4()), 'project': project, 'iteration': str(uuid.uuid4()),
+                        'created': now_iso(), 'predictions': predictions})
+
+    # ----- Custom Vision training -----
+
+    def handle_get_project(self, project):
+        self.state.project(project)
+        self.send_json({'id': project, 'name': 'Mock project', 'description': '', 'created': now_iso(),
+                        'lastModified': now_iso(), 'settings': {'classificationType': 'Multiclass'}})
+
+    def tag_json(self, tag_id, name):
+        return {'id': tag_id, 'name': name, 'description': '', 'type': 'Regular', 'imageCount': 0}
+
+    def handle_get_tags(self, project):
+        tags = self.state.project(project)['tags']
+        self.send_json([self.tag_json(tag_id, name) for name, tag_id in tags.items()])
+
+    def handle_create_tag(self, project):
+        name = self.query['name'][0]
+        tags = self.state.project(project)['tags']
+        with self.state.lock:
+            tag_id = tags.setdefault(name, str(uuid.uuid4()))
+        self.send_json(self.tag_json(tag_id, name))
+
+    def handle_create_images(self, project):
+        seen = self.state.project(project)['images']
+        results = []
+        for entry in self.json_body().get('images', []):
+            digest = hashlib.sha256(base64.b64decode(entry.get('contents') or '')).hexdigest()
+            with self.state.lock:
+                duplicate = digest in seen
+                seen.add(digest)
+            results.append({'sourceUrl': entry.get('name'), 'status': 'OKDuplicate' if duplicate else 'OK',
+                            'image': {'id': str(uuid.uuid4()), 'created': now_iso()}})
+        self.send_json({'isBatchSuccessful': all(result['status'] == 'OK' for result in results), 'images': results})
+
+    def iteration_json(self, project, iteration_id, started):
+        done = time.time() - started >= self.state.train_seconds
+        return {'id': iteration_id, 'name': 'Iteration', 'projectId': project, 'created': now_iso(),
+                'lastModified': now_iso(), 'status': 'Completed' if done else 'Training'}
+
+    def handle_train_project(self, project):
+        iteration_id = str(uuid.uuid4())
+        started = time.time()
+        iterations = self.state.project(project)['iterations']
+        with self.state.lock:
+            iterations[iteration_id] = started
+        self.send_json(self.iteration_json(project, iteration_id, started))
+
+    def handle_get_iteration(self, project, iteration):
+        started = self.state.project(project)['iterations'].get(iteration)
+        if started is None:
+            return self.send_json({'code': 'BadRequestIterationInvalid', 'message': 'Invalid iteration'}, 400)
+        self.send_json(self.iteration_json(project, iteration, started))
+
+    # ----- Azure OpenAI -----
+
+    def handle_generate_images(self):
+        request = self.json_body()
+        images = []
+        for _ in range(int(request.get('n') or 1)):
+            name = uuid.UUID(int=self.rng.getrandbits(128)).hex
+            with self.state.lock:
+                self.state.blobs[name] = png(256, 256, [self.rng.randrange(256) for _ in range(3)])
+                self.state.blobs.move_to_end(name)
+                while len(self.state.blobs) > MAX_BLOBS:
+                    self.state.blobs.popitem(last=False)
+            images.append({'url': 'http://{}:{}/_blob/{}.png'.format(*self.server.server_address[:2], name),
+                           'revised_prompt': request.get('prompt')})
+        self.send_json({'created': int(time.time()), 'data': images})
+
+    def handle_chat(self):
+        request = self.json_body()
+        content = 'This looks like a {}.'.format(self.rng.choice(TAG_NAMES))
+        self.send_json({'id': 'chatcmpl-' + uuid.uuid4().hex, 'object': 'chat.completion', 'created': int(time.time()),
+                        'model': request.get('model'),
+                        'choices': [{'index': 0, 'finish_reason': 'stop',
+                                     'message': {'role': 'assistant', 'content': content}}],
+                        'usage': {'prompt_tokens': len(self.body) // 4, 'completion_tokens': len(content) // 4,
+                                  'total_tokens': (len(self.body) + len(content)) // 4}})
+
+
+class MockService:
+    """Runs the mock server on a background thread (use it as a context manager)."""
+
+    def __init__(self, host='127.0.0.1', port=0, **settings):
+        """
+        Args:
+            host (str): Interface to listen on
+            port (int): Port to listen on (0 picks a free port)
+            **settings: Latency, failure and throttling settings (see MockState)
+        """
+        self.state = MockState(**settings)
+        handler = type('Handler', (MockHandler,), {'state': self.state})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def endpoint(self):
+        """The base URL to use as the service endpoint, such as http://127.0.0.1:8799/."""
+        return 'http://{}:{}/'.format(*self.server.server_address[:2])
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local mock of the Azure AI service endpoints used by the labs.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8799)
+    parser.add_argument('--latency', type=float, default=50)
+    parser.add_argument('--jitter', type=float, default=10)
+    parser.add_argument('--slow-rate', type=float, default=0.0)
+    parser.add_argument('--slow-ms', type=float, default=1000)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--rate', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=float, default=1)
+    parser.add_argument('--train-seconds', type=float, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    args = vars(parser.parse_args())
+    service = MockService(args.pop('host'), args.pop('port'), **args)
+    print('Mock service listening on', service.endpoint, '(Ctrl+C to stop)')
+    try:
+        service.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.server.server_close()
+
+
+if __name__ == "__main__":
+    main()
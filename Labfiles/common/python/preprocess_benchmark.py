@@ -0,0 +1,104 @@
+"""
+Benchmark: upload size, latency and detection results with and without image preprocessing.
+
+Each image in a folder is sent to the service twice, once as the original file and once
+after image_preprocessing.prepare(), and the script reports the bytes uploaded, the
+request latency, the number of detections and how well the boxes agree (mean IoU of
+each original box with its best match from the preprocessed run).
+
+Usage (from a lab folder whose .env has AI_SERVICE_ENDPOINT and AI_SERVICE_KEY):
+    python ../../../common/python/preprocess_benchmark.py face images
+    python ../../../common/python/preprocess_benchmark.py image-analysis images
+"""
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+import clients
+import image_preprocessing
+
+
+def face_boxes(endpoint, key):
+    """Return a function that detects faces in image bytes and returns their boxes."""
+    from azure.ai.vision.face.models import FaceDetectionModel, FaceRecognitionModel
+    client = clients.face_client(endpoint, key)
+
+    def detect(prepared):
+        faces = client.detect(image_content=prepared.data,
+                              detection_model=FaceDetectionModel.DETECTION01,
+                              recognition_model=FaceRecognitionModel.RECOGNITION01,
+                              return_face_id=False)
+        image_preprocessing.rescale_faces(faces, prepared)
+        return [(f.face_rectangle.left, f.face_rectangle.top,
+                 f.face_rectangle.left + f.face_rectangle.width,
+                 f.face_rectangle.top + f.face_rectangle.height) for f in faces]
+    return detect
+
+
+def object_boxes(endpoint, key):
+    """Return a function that detects objects in image bytes and returns their boxes."""
+    from azure.ai.vision.imageanalysis.models import VisualFeatures
+    client = clients.image_analysis_client(endpoint, key)
+
+    def detect(prepared):
+        result = client.analyze(image_data=prepared.data, visual_features=[VisualFeatures.OBJECTS])
+        image_preprocessing.rescale_analysis(result, prepared)
+        return [(o.bounding_box.x, o.bounding_box.y,
+                 o.bounding_box.x + o.bounding_box.width,
+                 o.bounding_box.y + o.bounding_box.height) for o in result.objects.list]
+    return detect
+
+
+def iou(a, b):
+    """Intersection over union of two (left, top, right, bottom) boxes."""
+    width = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    height = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    intersection = width * height
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def mean_best_iou(original, preprocessed):
+    """Mean, over the original boxes, of the IoU with the closest preprocessed box."""
+    if not original:
+        return 1.0 if not preprocessed else 0.0
+    return sum(max([iou(box, other) for other in preprocessed] or [0.0]) for box in original) / len(original)
+
+
+def main():
+    load_dotenv()
+    service = sys.argv[1] if len(sys.argv) > 1 else 'face'
+    folder = sys.argv[2] if len(sys.argv) > 2 else 'images'
+    factories = {'face': face_boxes, 'image-analysis': object_boxes}
+    detect = factories[service](os.getenv('AI_SERVICE_ENDPOINT'), os.getenv('AI_SERVICE_KEY'))
+
+    totals = {'original': [0, 0.0], 'preprocessed': [0, 0.0]}
+    print('{:<30} {:>12} {:>12} {:>9} {:>9} {:>6} {:>6} {:>6}'.format(
+        'image', 'bytes', 'prep bytes', 'ms', 'prep ms', 'boxes', 'prep', 'IoU'))
+    for name in sorted(os.listdir(folder)):
+        image_file = os.path.join(folder, name)
+        if not os.path.isfile(image_file):
+            continue
+        runs = {}
+        for label, force in (('original', False), ('preprocessed', True)):
+            prepared = image_preprocessing.prepare(image_file, service, force=force)
+            start = time.perf_counter()
+            boxes = detect(prepared)
+            elapsed = time.perf_counter() - start
+            runs[label] = (len(prepared.data), elapsed, boxes)
+            totals[label][0] += len(prepared.data)
+            totals[label][1] += elapsed
+
+        (size, elapsed, boxes), (prep_size, prep_elapsed, prep_boxes) = runs['original'], runs['preprocessed']
+        print('{:<30} {:>12,} {:>12,} {:>9.0f} {:>9.0f} {:>6} {:>6} {:>6.2f}'.format(
+            name[:30], size, prep_size, elapsed * 1000, prep_elapsed * 1000,
+            len(boxes), len(prep_boxes), mean_best_iou(boxes, prep_boxes)))
+
+    print('\nTotal: {:,} bytes in {:.1f}s without preprocessing, {:,} bytes in {:.1f}s with it'.format(
+        totals['original'][0], totals['original'][1], totals['preprocessed'][0], totals['preprocessed'][1]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark: time per image to annotate and save detection results.
+
+Compares the approach the lab scripts used before (draw with PIL, show the image in a
+matplotlib figure, save the figure) with the shared image_annotation helpers (draw with
+PIL, save once at native resolution). matplotlib is only needed for the "before" timing.
+
+Usage:
+    python render_benchmark.py [image_file] [repeats]
+
+Without an image file, a synthetic 4000 x 3000 photo-sized image is used.
+"""
+import os
+import sys
+import tempfile
+import time
+
+from PIL import Image, ImageDraw
+
+import image_annotation
+
+
+def sample_boxes(width, height, count=20):
+    """Return count (left, top, right, bottom) boxes spread across the image, with labels."""
+    boxes = []
+    for index in range(count):
+        left = (index % 5) * width // 5 + 10
+        top = (index // 5) * height // 4 + 10
+        boxes.append((left, top, left + width // 8, top + height // 8))
+    return boxes, ['object {}'.format(index + 1) for index in range(count)]
+
+
+def render_matplotlib(image_file, boxes, labels, output_file):
+    """The previous approach: PIL drawing, then a matplotlib figure that is re-rendered and saved."""
+    from matplotlib import pyplot as plt
+    image = Image.open(image_file)
+    fig = plt.figure(figsize=(image.width/100, image.height/100))
+    plt.axis('off')
+    draw = ImageDraw.Draw(image)
+    for box, label in zip(boxes, labels):
+        draw.rectangle(box, outline='cyan', width=3)
+        plt.annotate(label, (box[0], box[1]), backgroundcolor='cyan')
+    plt.imshow(image)
+    plt.tight_layout(pad=0)
+    fig.savefig(output_file)
+    plt.close(fig)
+
+
+def render_pil(image_file, boxes, labels, output_file):
+    """The current approach: draw on the decoded image and encode it once."""
+    image = image_annotation.load(image_file)
+    image_annotation.draw_boxes(image, boxes, 'cyan', width=3, labels=labels)
+    image_annotation.save(image, output_file)
+
+
+def seconds_per_image(render, repeats, *args):
+    """Run render repeats times (after one warm-up run) and return the mean seconds per run."""
+    render(*args)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        render(*args)
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    with tempfile.TemporaryDirectory() as folder:
+        if len(sys.argv) > 1:
+            image_file = sys.argv[1]
+        else:
+            image_file = os.path.join(folder, 'sample.jpg')
+            Image.effect_noise((4000, 3000), 64).convert('RGB').save(image_file, quality=90)
+
+        with Image.open(image_file) as image:
+            width, height = image.size
+        boxes, labels = sample_boxes(width, height)
+        output_file = os.path.join(folder, 'annotated.jpg')
+        print('Annotating {} ({} x {}) with {} boxes, {} runs each\n'.format(
+            image_file, width, height, len(boxes), repeats))
+
+        after = seconds_per_image(render_pil, repeats, image_file, boxes, labels, output_file)
+        try:
+            before = seconds_per_image(render_matplotlib, repeats, image_file, boxes, labels, output_file)
+        except ImportError:
+            before = None
+
+        if before is not None:
+            print('  matplotlib figure: {:8.1f} ms per image'.format(before * 1000))
+        else:
+            print('  matplotlib figure:  (matplotlib not installed)')
+        print('  PIL only:          {:8.1f} ms per image'.format(after * 1000))
+        if before is not None:
+            print('  Speed-up:          {:8.1f}x'.format(before / after))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Benchmark: how long each lab script takes to start, before it does any work.
+
+Each script is imported (its main() isn't run) in a fresh interpreter with
+python -X importtime, which reports the time spent importing every module. The
+benchmark prints, for each script, the process wall time compared with an empty
+interpreter, the total import time, and the modules that took longest to import, so
+changes that make startup slower (such as a new top-level import) are easy to spot.
+
+Usage:
+    python startup_benchmark.py [script ...] [--repeat 5] [--top 5]
+
+Without script arguments, every lab script is measured. Scripts whose dependencies
+aren't installed are reported with the import error.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+from lab_scripts import LABFILES, SCRIPTS
+
+# Imports a script as a module, which runs its top-level imports but not main()
+IMPORT_SCRIPT = ("import importlib.util, sys; "
+                 "spec = importlib.util.spec_from_file_location('lab_script', sys.argv[1]); "
+                 "spec.loader.exec_module(importlib.util.module_from_spec(spec))")
+
+
+def run(args):
+    """Run a Python command and return (wall seconds, completed process)."""
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable] + args, capture_output=True, text=True)
+    return time.perf_counter() - start, process
+
+
+def import_times(stderr):
+    """
+    Parse python -X importtime output.
+
+    Returns:
+        list: (cumulative microseconds, module) for each top-level import, slowest first
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|', 2)
+        # Nested imports are indented below the import that caused them
+        if not name[1:].startswith(' '):
+            imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the startup (import) time of the lab scripts.')
+    parser.add_argument('scripts', nargs='*', help='Scripts to measure (default: all the lab scripts)')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per script; the fastest is reported (default: 5)')
+    parser.add_argument('--top', type=int, default=5, help='Slowest imports listed per script (default: 5)')
+    args = parser.parse_args()
+    scripts = [os.path.abspath(script) for script in args.scripts] or [os.path.join(LABFILES, script) for script in SCRIPTS]
+
+    baseline = min(run(['-c', 'pass'])[0] for _ in range(args.repeat))
+    print('Empty interpreter: {:.0f} ms\n'.format(baseline * 1000))
+
+    for script in scripts:
+        name = os.path.relpath(script, LABFILES)
+        runs = [run(['-X', 'importtime', '-c', IMPORT_SCRIPT, script]) for _ in range(args.repeat)]
+        wall, process = min(runs, key=lambda result: result[0])
+        if process.returncode != 0:
+            error = (process.stderr.strip().splitlines() or ['exit code {}'.format(process.returncode)])[-1]
+            print('{}\n  not measured: {}\n'.format(name, error))
+            continue
+
+        imports = import_times(process.stderr)
+        print('{}\n  startup {:.0f} ms ({:+.0f} ms over an empty interpreter), imports {:.0f} ms'.format(
+            name, wall * 1000, (wall - baseline) * 1000, sum(us for us, _ in imports) / 1000))
+        for microseconds, module in imports[:args.top]:
+            print('    {:>8.1f} ms  {}'.format(microseconds / 1000, module))
+        print()
+
+
+if __name__ == "__main__":
+    main()
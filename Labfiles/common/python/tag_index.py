@@ -0,0 +1,75 @@
+"""
+Name-to-ID lookup for the tags in an Azure Custom Vision project.
+
+The Custom Vision API refers to tags by ID, but training data refers to them by name.
+TagIndex fetches the project's tags once and keeps them in a dictionary, so each
+lookup is a single hash lookup instead of a scan over the tag list. Tags that the
+training data uses but the project doesn't have yet can be created in one pass.
+"""
+import threading
+
+import throttle
+
+
+class TagIndex:
+    """Maps tag names to tag IDs for one Custom Vision project."""
+
+    def __init__(self, training_client, project_id):
+        """
+        Build the index from the tags currently defined in the project.
+
+        Args:
+            training_client: An authenticated CustomVisionTrainingClient
+            project_id (str): The ID of the project whose tags are indexed
+        """
+        self._training_client = training_client
+        self._project_id = project_id
+        self._lock = threading.Lock()
+        tags = throttle.call('custom-vision-training', training_client.get_tags, project_id)
+        self._ids = dict((tag.name, tag.id) for tag in tags)
+
+    def __contains__(self, name):
+        return name in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, name):
+        """Return the ID of the named tag, raising KeyError if the project doesn't have it."""
+        try:
+            return self._ids[name]
+        except KeyError:
+            raise KeyError("Tag '{}' is not defined in the project".format(name)) from None
+
+    def names(self):
+        """Return the names of all indexed tags."""
+        return list(self._ids)
+
+    def ensure(self, names):
+        """
+        Make sure every tag in names exists, creating any that are missing.
+
+        Args:
+            names: Iterable of tag names used by the training data
+
+        Returns:
+            list: The names of the tags that were created
+        """
+        with self._lock:
+            missing = sorted(set(names) - set(self._ids))
+            for name in missing:
+                tag = throttle.call('custom-vision-training', self._training_client.create_tag, self._project_id, name)
+                self._ids[tag.name] = tag.id
+        if missing:
+            print('Created tags:', ', '.join(missing))
+        return missing
+
+    def id_for(self, name, create=True):
+        """
+        Return the ID of the named tag, creating the tag first if it is missing and create is True.
+        """
+        if name not in self._ids:
+            if not create:
+                return self[name]
+            self.ensure([name])
+        return self._ids[name]
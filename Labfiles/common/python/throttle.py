@@ -0,0 +1,194 @@
+"""
+Client-side rate limiting and throttling retries for calls to the Azure AI services.
+
+Each service's quota is a number of transactions per second (or per minute on the free
+tier). Without a limiter, batch modes send requests as fast as their workers can and get
+429 (Too Many Requests) responses, which the scripts used to report as errors and drop.
+
+call() sends every request through a token bucket for its service, shared by all the
+threads in the process, so requests go out at the quota rate. If the service still
+answers 429 (or 503), the request is retried after the delay in the response's
+Retry-After header, and the whole bucket is paused for that long so other threads back
+off too. call_async() does the same for coroutines.
+
+Settings (all optional, read from the environment):
+    SERVICE_TIER                 Pricing tier whose quotas are used: F0 or S0 (default S0)
+    RATE_LIMIT_<SERVICE>         Requests per second for one service, overriding the tier
+                                 (for example RATE_LIMIT_FACE=5 or RATE_LIMIT_CUSTOM_VISION_PREDICTION=2);
+                                 0 turns the limit off
+    RATE_LIMIT_RETRIES           Retries for a throttled request (default 5)
+"""
+import asyncio
+import email.utils
+import os
+import random
+import threading
+import time
+
+# Requests per second for each service and pricing tier. None means no client-side limit
+# (Azure OpenAI quotas depend on the deployment; set RATE_LIMIT_OPENAI to match yours).
+TIER_LIMITS = {
+    'F0': {'face': 20 / 60, 'vision': 20 / 60,
+           'custom-vision-training': 2, 'custom-vision-prediction': 2, 'openai': None},
+    'S0': {'face': 10, 'vision': 10,
+           'custom-vision-training': 10, 'custom-vision-prediction': 10, 'openai': None},
+}
+
+# HTTP status codes that mean "slow down and try again"
+THROTTLED_STATUSES = (429, 503)
+
+# Longest wait between retries when the service doesn't say how long to wait
+MAX_BACKOFF = 60
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket: up to burst requests at once, refilled at rate per second.
+
+    reserve() takes a token and returns how long the caller must wait before using it, so
+    callers sleep without holding the lock and are served in the order they arrived.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate or 1.0)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token and return the seconds to wait before sending the request."""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._paused_until - now)
+            if self.rate:
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                self._tokens -= 1
+                if self._tokens < 0:
+                    wait = max(wait, -self._tokens / self.rate)
+            return wait
+
+    def pause(self, seconds):
+        """Hold back every request for the next few seconds (after the service throttled one)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def acquire(self):
+        """Wait until a request may be sent."""
+        time.sleep(self.reserve())
+
+    async def acquire_async(self):
+        """Wait, without blocking the event loop, until a request may be sent."""
+        await asyncio.sleep(self.reserve())
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def rate_limit(service):
+    """Return the requests per second allowed for a service (None for no limit)."""
+    configured = os.getenv('RATE_LIMIT_' + service.upper().replace('-', '_'))
+    if configured:
+        return float(configured) or None
+    tier = (os.getenv('SERVICE_TIER') or 'S0').upper()
+    return TIER_LIMITS.get(tier, TIER_LIMITS['S0']).get(service)
+
+
+def limiter(service):
+    """Return the token bucket shared by every call to a service."""
+    with _buckets_lock:
+        if service not in _buckets:
+            _buckets[service] = TokenBucket(rate_limit(service))
+        return _buckets[service]
+
+
+def status_code(ex):
+    """Return the HTTP status code of an SDK exception (azure-core, msrest or openai), if it has one."""
+    status = getattr(ex, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(ex, 'response', None), 'status_code', None)
+    return status
+
+
+def retry_after(ex):
+    """Return the delay, in seconds, the service asked for in its Retry-After headers (or None)."""
+    headers = getattr(getattr(ex, 'response', None), 'headers', None) or {}
+    for name in ('retry-after-ms', 'x-ms-retry-after-ms'):
+        value = headers.get(name)
+        if value:
+            try:
+                return float(value) / 1000
+            except ValueError:
+                pass
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        # Retry-After can also be an HTTP date
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def throttled_delay(ex, attempt):
+    """Return how long to wait before retrying a throttled request, or None if ex wasn't throttling."""
+    if status_code(ex) not in THROTTLED_STATUSES:
+        return None
+    delay = retry_after(ex)
+    if delay is None:
+        # No Retry-After header: back off exponentially, with jitter so threads spread out
+        delay = min(MAX_BACKOFF, 2 ** attempt) * random.uniform(0.5, 1.0)
+    return delay
+
+
+def max_retries():
+    """Return the number of times a throttled request is retried."""
+    return int(os.getenv('RATE_LIMIT_RETRIES') or 5)
+
+
+def call(service, func, *args, **kwargs):
+    """
+    Call func(*args, **kwargs) within the service's rate limit, retrying it when throttled.
+
+    Args:
+        service (str): One of the services in TIER_LIMITS (such as 'face' or 'vision')
+        func: The SDK method to call
+
+    Returns:
+        Whatever func returns. Errors other than throttling (and throttling that outlasts
+        the retries) are raised to the caller as before.
+    """
+    bucket = limiter(service)
+    attempt = 0
+    while True:
+        bucket.acquire()
+        try:
+            return func(*args, **kwargs)
+        except Exception as ex:
+            delay = throttled_delay(ex, attempt)
+            if delay is None or attempt >= max_retries():
+                raise
+            bucket.pause(delay)
+            attempt += 1
+
+
+async def call_async(service, func, *args, **kwargs):
+    """Await func(*args, **kwargs) within the service's rate limit, retrying it when throttled (see call)."""
+    bucket = limiter(service)
+    attempt = 0
+    while True:
+        await bucket.acquire_async()
+        try:
+            return await func(*args, **kwargs)
+        except Exception as ex:
+            delay = throttled_delay(ex, attempt)
+            if delay is None or attempt >= max_retries():
+                raise
+            bucket.pause(delay)
+            attempt += 1
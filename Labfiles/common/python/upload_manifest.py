@@ -0,0 +1,102 @@
+"""
+A local record of the training images that have already been uploaded to Custom Vision.
+
+The manifest is a small SQLite database keyed by project, image content hash and the
+image's labels (its tag IDs, or its tagged regions). Before uploading, the training
+scripts pass their images through UploadManifest.pending(), which skips anything already
+recorded. After each chunk is accepted by the service, the uploaded images are recorded
+straight away, so an interrupted run resumes from the last committed chunk.
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+
+
+class UploadManifest:
+    """SQLite-backed set of (project, content hash, labels) entries for uploaded images."""
+
+    def __init__(self, path):
+        """
+        Open (or create) the manifest database.
+
+        Args:
+            path (str): Path to the SQLite file, usually next to the training script
+        """
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('''CREATE TABLE IF NOT EXISTS uploads (
+                                        project_id TEXT NOT NULL,
+                                        content_hash TEXT NOT NULL,
+                                        label_key TEXT NOT NULL,
+                                        name TEXT,
+                                        uploaded_at REAL,
+                                        PRIMARY KEY (project_id, content_hash, label_key))''')
+        self._connection.commit()
+        self.skipped = 0
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def pending(self, project_id, items):
+        """
+        Yield the items that haven't been uploaded to the project yet.
+
+        Each yielded item has its content_hash filled in, so it can be recorded
+        once it is uploaded. Items whose file can't be read are passed through
+        unchanged, so the uploader reports them as failures.
+
+        Args:
+            project_id (str): The ID of the Custom Vision project
+            items: Iterable of UploadItem
+        """
+        for item in items:
+            try:
+                content_hash = file_hash(item.path)
+            except OSError:
+                yield item
+                continue
+            if self.contains(project_id, content_hash, label_key(item)):
+                self.skipped += 1
+                continue
+            yield item._replace(content_hash=content_hash)
+
+    def contains(self, project_id, content_hash, key):
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT 1 FROM uploads WHERE project_id = ? AND content_hash = ? AND label_key = ?',
+                (project_id, content_hash, key)).fetchone()
+        return row is not None
+
+    def record(self, project_id, items):
+        """Record uploaded items and commit, so they are skipped by later runs."""
+        now = time.time()
+        rows = [(project_id, item.content_hash, label_key(item), item.name, now)
+                for item in items if item.content_hash]
+        with self._lock:
+            self._connection.executemany('INSERT OR IGNORE INTO uploads VALUES (?, ?, ?, ?, ?)', rows)
+            self._connection.commit()
+
+
+def file_hash(path, block_size=1024 * 1024):
+    """Return the SHA-256 hex digest of a file, reading it in blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as image_file:
+        for block in iter(lambda: image_file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def label_key(item):
+    """Return a stable text key for an item's tag IDs or tagged regions."""
+    if item.regions:
+        regions = sorted('{}:{:.6f},{:.6f},{:.6f},{:.6f}'.format(r.tag_id, r.left, r.top, r.width, r.height)
+                         for r in item.regions)
+        return 'regions:' + ';'.join(regions)
+    return 'tags:' + ','.join(sorted(item.tag_ids or []))
@@ -0,0 +1,232 @@
+"""
+Persistent worker: runs lab scripts in an interpreter that has already imported the SDKs.
+
+Starting a script pays for the interpreter and for importing the Azure SDKs, Pillow and
+NumPy every time, which dominates when a script is run once per file from a shell loop.
+The worker imports them once and then runs each script it is sent, exactly as
+"python script.py args..." would (with __name__ == "__main__"), streaming the script's
+output back to the client. On Linux and macOS each run happens in a process forked
+from the warm worker, so runs are isolated from each other and can overlap; elsewhere
+runs are handled one at a time in the worker process itself.
+
+Start the worker once:
+    python worker.py serve
+Then run scripts through it (from the script's folder, as usual):
+    python ../../../common/python/worker.py run analyze-faces.py images/face1.jpg
+The client only uses the standard library, so it starts in a few milliseconds. If no
+worker is running, the client runs the script itself.
+
+Only the user who started the worker can use it: it listens on 127.0.0.1 only, and
+every request must carry a random token that the worker writes, when it starts, to a
+file only that user can read (WORKER_TOKEN_FILE, default
+~/.cache/mslearn-ai-vision/worker-token). It only runs scripts inside the Labfiles folder.
+
+Scripts that read from the keyboard (such as dalle-client.py) can't be run through the
+worker. Settings: WORKER_PORT (default 8765) selects the local TCP port.
+"""
+import contextlib
+import hmac
+import importlib
+import io
+import json
+import os
+import runpy
+import secrets
+import socket
+import socketserver
+import sys
+
+from lab_scripts import LABFILES
+
+# Modules imported before serving, so runs don't pay for them (missing ones are skipped)
+PRELOAD = [
+    'dotenv',
+    'PIL.Image', 'PIL.ImageDraw', 'PIL.ImageFont',
+    'numpy',
+    'requests',
+    'azure.core.pipeline.transport',
+    'azure.ai.vision.face', 'azure.ai.vision.face.models',
+    'azure.ai.vision.imageanalysis', 'azure.ai.vision.imageanalysis.models',
+    'azure.cognitiveservices.vision.customvision.training',
+    'azure.cognitiveservices.vision.customvision.prediction',
+    'msrest.authentication',
+    'openai', 'azure.identity',
+    'clients', 'throttle', 'image_annotation', 'image_preprocessing', 'analysis_cache', 'generation_cache',
+]
+
+# Marks the end of a run's output; the exit code follows it
+EXIT_MARKER = '\0exit:'
+
+
+def port():
+    return int(os.getenv('WORKER_PORT') or 8765)
+
+
+def token_file():
+    return os.getenv('WORKER_TOKEN_FILE') or os.path.join(
+        os.path.expanduser('~'), '.cache', 'mslearn-ai-vision', 'worker-token')
+
+
+def create_token():
+    """Write a new random token to token_file(), readable only by this user, and return it."""
+    path = token_file()
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    token = secrets.token_hex(32)
+    # Replace any old file rather than writing into it, so its permissions are always 0600
+    if os.path.exists(path):
+        os.remove(path)
+    handle = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(handle, 'w') as file:
+        file.write(token)
+    return token
+
+
+def read_token():
+    """Return the worker's token, or None if no worker has written one."""
+    try:
+        with open(token_file()) as file:
+            return file.read().strip()
+    except OSError:
+        return None
+
+
+def check_request(request, token):
+    """Raise ValueError unless a request has the worker's token and a valid script inside LABFILES."""
+    if not isinstance(request, dict) or not hmac.compare_digest(str(request.get('token', '')), token):
+        raise ValueError('invalid worker token')
+    script = os.path.realpath(str(request.get('script', '')))
+    if os.path.commonpath([script, os.path.realpath(LABFILES)]) != os.path.realpath(LABFILES) \
+            or not script.endswith('.py') or not os.path.isfile(script):
+        raise ValueError('only lab scripts inside {} can be run'.format(LABFILES))
+    argv, env = request.get('argv', []), request.get('env') or {}
+    if not (isinstance(argv, list) and all(isinstance(arg, str) for arg in argv)
+            and isinstance(env, dict) and all(isinstance(k, str) and isinstance(v, str) for k, v in env.items())
+            and os.path.isdir(str(request.get('cwd', '')))):
+        raise ValueError('malformed request')
+    return script
+
+
+def preload():
+    """Import the PRELOAD modules that are installed, and return their names."""
+    loaded = []
+    for name in PRELOAD:
+        try:
+            importlib.import_module(name)
+            loaded.append(name)
+        except ImportError:
+            pass
+    return loaded
+
+
+def run_script(script, argv):
+    """Run a script as __main__ with the given arguments and return its exit code."""
+    sys.argv = [script] + list(argv)
+    script_folder = os.path.dirname(os.path.abspath(script))
+    sys.path.insert(0, script_folder)
+    try:
+        runpy.run_path(script, run_name='__main__')
+        return 0
+    except SystemExit as ex:
+        if ex.code is None or isinstance(ex.code, int):
+            return ex.code or 0
+        print(ex.code, file=sys.stderr)
+        return 1
+    finally:
+        sys.path.remove(script_folder)
+
+
+class RunHandler(socketserver.StreamRequestHandler):
+    """Runs one script per connection, sending its output (stdout and stderr) back."""
+
+    def handle(self):
+        output = io.TextIOWrapper(self.wfile, encoding='utf-8', errors='replace', line_buffering=True)
+        try:
+            request = json.loads(self.rfile.readline(1024 * 1024))
+            script = check_request(request, self.server.token)
+        except ValueError as ex:
+            output.write('Request refused: {}\n{}1\n'.format(ex, EXIT_MARKER))
+            output.flush()
+            output.detach()
+            return
+
+        saved = (os.getcwd(), dict(os.environ), sys.argv)
+        code = 1
+        try:
+            os.chdir(request['cwd'])
+            # The script sees exactly the client's environment, not the worker's
+            os.environ.clear()
+            os.environ.update(request.get('env') or {})
+            with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+                code = run_script(script, request.get('argv', []))
+        except Exception as ex:
+            output.write('{}: {}\n'.format(type(ex).__name__, ex))
+        finally:
+            # Restore the worker's state (only needed when runs share the worker process)
+            os.chdir(saved[0])
+            os.environ.clear()
+            os.environ.update(saved[1])
+            sys.argv = saved[2]
+        output.write('{}{}\n'.format(EXIT_MARKER, code))
+        output.flush()
+        output.detach()
+
+
+if hasattr(socketserver, 'ForkingTCPServer'):
+    class WorkerServer(socketserver.ForkingTCPServer):
+        allow_reuse_address = True
+else:
+    class WorkerServer(socketserver.TCPServer):
+        allow_reuse_address = True
+
+
+def serve():
+    loaded = preload()
+    server = WorkerServer(('127.0.0.1', port()), RunHandler)
+    server.token = create_token()
+    print('Worker listening on port {} with {} modules preloaded (Ctrl+C to stop)'.format(port(), len(loaded)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def run(script, argv):
+    """Run a script through the worker, or directly if no worker is running. Returns its exit code."""
+    script = os.path.abspath(script)
+    token = read_token()
+    if token is None:
+        return run_script(script, argv)
+    try:
+        connection = socket.create_connection(('127.0.0.1', port()), timeout=1)
+    except OSError:
+        return run_script(script, argv)
+
+    with connection:
+        connection.settimeout(None)
+        # Environment variables the script may need that the worker didn't start with
+        request = {'token': token, 'script': script, 'argv': argv, 'cwd': os.getcwd(), 'env': dict(os.environ)}
+        connection.sendall(json.dumps(request).encode() + b'\n')
+        code = 1
+        for line in connection.makefile('r', encoding='utf-8', errors='replace'):
+            if line.startswith(EXIT_MARKER):
+                code = int(line[len(EXIT_MARKER):])
+                break
+            sys.stdout.write(line)
+            sys.stdout.flush()
+        return code
+
+
+def main():
+    if len(sys.argv) >= 2 and sys.argv[1] == 'serve':
+        serve()
+    elif len(sys.argv) >= 3 and sys.argv[1] == 'run':
+        sys.exit(run(sys.argv[2], sys.argv[3:]))
+    else:
+        print(__doc__)
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
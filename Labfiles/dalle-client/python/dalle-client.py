@@ -1,12 +1,25 @@
 import os  # For file and directory operations
+import sys  # For locating the shared lab helpers
 import json  # For parsing JSON responses from the API
+import time  # For timing batch runs
+import asyncio  # For generating a batch of images concurrently
+import base64  # For decoding the Content-MD5 checksum of downloaded images
+import hashlib  # For checking downloaded images against their checksum
+import tempfile  # For writing downloads to a temporary file before renaming them
+import shutil  # For copying images out of the generation cache
 
 # Add references
 # Azure authentication and OpenAI client for DALL-E image generation
 from dotenv import load_dotenv  # Loads environment variables from .env file
 from azure.identity import DefaultAzureCredential, get_bearer_token_provider  # Azure authentication
-from openai import AzureOpenAI  # OpenAI client configured for Azure
 import requests  # For downloading generated images
+import urllib3  # The HTTP library used by requests (its errors can surface while streaming)
+
+# Make the shared helpers in Labfiles/common/python importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'common', 'python'))
+import clients  # Creates the OpenAI client configured for Azure, with pooled keep-alive connections
+import throttle  # Keeps requests within the service rate limit and retries throttled ones
+import generation_cache  # Keeps generated images, so repeated prompts aren't generated again (GENERATION_CACHE=0 turns it off)
 
 
 def main():
@@ -18,6 +31,9 @@ def main():
     3. Creates an OpenAI client preconfigured for Azure
     4. Loops to accept user prompts and generate images
     5. Saves generated images to disk
+
+    Batch mode: python dalle-client.py prompts.txt generates an image for every prompt
+    in the file (one per line) concurrently instead of asking for prompts.
     """
 
     # Clear the console screen for a clean UI
@@ -63,15 +79,30 @@ def main():
             "https://cognitiveservices.azure.com/.default"
         )
         
+        # =============================================================================
+        # BATCH MODE: GENERATE AN IMAGE FOR EVERY PROMPT IN A FILE
+        # =============================================================================
+        # If a prompt file was given on the command line, the prompts are sent concurrently
+        # with the async client instead of being read one at a time from the keyboard
+        if len(sys.argv) > 1:
+            batch_client = clients.openai_client_async(
+                endpoint,
+                api_version,
+                azure_ad_token_provider=token_provider
+            )
+            cache = generation_cache.GenerationCache() if generation_cache.enabled() else None
+            asyncio.run(generate_batch(batch_client, model_deployment, sys.argv[1], cache))
+            return
+
         # Create the Azure OpenAI client preconfigured for this service
         # This client handles all communication with the DALL-E model
         # Parameters:
         # - api_version: Specifies which Azure OpenAI API version to use
         # - azure_endpoint: Base URL for the service
         # - azure_ad_token_provider: Function that provides authentication tokens
-        client = AzureOpenAI(
-            api_version=api_version,
-            azure_endpoint=endpoint,
+        client = clients.openai_client(
+            endpoint,
+            api_version,
             azure_ad_token_provider=token_provider
         )
         
@@ -81,6 +112,11 @@ def main():
         # Counter to track how many images have been generated in this session
         # Increments with each image to create unique filenames (image_1.png, image_2.png, etc.)
         img_no = 0
+
+        # Images generated before are kept in a local cache, so repeating a prompt
+        # returns its image straight away instead of generating a new one
+        # (unless GENERATION_CACHE=0, which generates a new image every time)
+        cache = generation_cache.GenerationCache() if generation_cache.enabled() else None
         
         # Loop until the user types 'quit'
         # This creates an interactive session where users can request multiple images
@@ -100,30 +136,41 @@ def main():
                 continue
             
             # =============================================================================
-            # STEP 4: SEND PROMPT TO DALL-E MODEL AND RETRIEVE GENERATED IMAGE URL
+            # STEP 4: SEND PROMPT TO DALL-E MODEL AND DOWNLOAD THE GENERATED IMAGE
             # =============================================================================
-            # Send the user's prompt to the DALL-E model and request image generation
-            # Parameters:
-            # - model: Specifies which deployed DALL-E model to use
-            # - prompt: The user's description of the image to generate
-            # - n: Number of images to generate (1 in this case)
-            result = client.images.generate(
-                model=model_deployment,
-                prompt=input_text,
-                n=1
-            )
-            
-            # Convert the result object to JSON format for easier data access
-            # The model_dump_json() method serializes the response object to JSON string
-            # json.loads() parses the JSON string into a Python dictionary
-            json_response = json.loads(result.model_dump_json())
-            
-            # Extract the URL of the generated image from the response
-            # json_response["data"][0]["url"] navigates to:
-            # - "data": Array of generated images
-            # - [0]: First (and only) image in the array
-            # - "url": The URL where the generated image is hosted
-            image_url = json_response["data"][0]["url"]
+            # This function generates an image for the prompt and downloads it to image_path
+            # The cache calls it only when the prompt hasn't been generated before
+            def generate(image_path):
+                # Send the user's prompt to the DALL-E model and request image generation
+                # Parameters:
+                # - model: Specifies which deployed DALL-E model to use
+                # - prompt: The user's description of the image to generate
+                # - n: Number of images to generate (1 in this case)
+                # throttle.call() keeps requests within RATE_LIMIT_OPENAI (if set), and retries the
+                # request after the delay the service asks for if it responds 429 Too Many Requests
+                result = throttle.call(
+                    'openai',
+                    client.images.generate,
+                    model=model_deployment,
+                    prompt=input_text,
+                    n=1
+                )
+
+                # Convert the result object to JSON format for easier data access
+                # The model_dump_json() method serializes the response object to JSON string
+                # json.loads() parses the JSON string into a Python dictionary
+                json_response = json.loads(result.model_dump_json())
+
+                # Extract the URL of the generated image from the response
+                # json_response["data"][0]["url"] navigates to:
+                # - "data": Array of generated images
+                # - [0]: First (and only) image in the array
+                # - "url": The URL where the generated image is hosted
+                image_url = json_response["data"][0]["url"]
+
+                # Download the image, and return details worth keeping with it in the cache
+                download_image(image_url, image_path)
+                return {'revised_prompt': json_response["data"][0].get("revised_prompt")}
 
             # =============================================================================
             # STEP 5: SAVE THE GENERATED IMAGE
@@ -134,12 +181,23 @@ def main():
             # Create a filename for the generated image
             # Format: image_1.png, image_2.png, etc.
             file_name = f"image_{img_no}.png"
+
+            if cache is None:
+                # The cache is turned off: generate the image straight into the images folder
+                image_path = os.path.join(image_folder(), file_name)
+                generate(image_path)
+                print(f"Image saved as {image_path}")
+                continue
+
+            # Get the image from the cache, or generate it if this prompt is new
+            # Prompts that differ only in case, spacing or surrounding punctuation share an image
+            entry = cache.get_or_generate(input_text, model_deployment, generate)
             
-            # Call the save_image function to download and save the image locally
+            # Copy the image from the cache to the images folder
             # Parameters:
-            # - image_url: The URL of the generated image (from DALL-E)
+            # - entry: The cache entry for the image
             # - file_name: The filename to save it as
-            save_image(image_url, file_name)
+            save_cached_image(entry, file_name)
 
 
     # Error handling: Catch and display any exceptions that occur
@@ -148,55 +206,284 @@ def main():
         print(ex)
 
 
-def save_image(image_url, file_name):
+async def generate_batch(client, model_deployment, prompt_file, cache):
     """
-    Downloads an image from a URL and saves it to disk.
-    
+    Generates an image for every prompt in a file, with several generations in flight.
+
     Parameters:
+    - client: AsyncAzureOpenAI client (it is closed when the batch is done)
+    - model_deployment: Name of the deployed DALL-E model
+    - prompt_file: Text file with one prompt per line (blank lines and lines starting with # are skipped)
+    - cache: GenerationCache that images are looked up in and added to (None to always generate)
+
+    Up to DALLE_CONCURRENCY generations (default 4) run at the same time. Each image is
+    downloaded as soon as it has been generated, outside that limit, so downloads overlap
+    with the next generations instead of holding them up. The image for the prompt on
+    line N of the file (counting only prompts) is saved as images/image_N.png.
+
+    Prompts already in the cache aren't generated again, and a prompt repeated in the
+    file is generated once, even while its first generation is still in flight.
+    """
+
+    # Read the prompts, skipping blank lines and comments
+    with open(prompt_file, encoding='utf-8') as prompts_file:
+        prompts = [line.strip() for line in prompts_file
+                   if line.strip() and not line.lstrip().startswith('#')]
+
+    workers = int(os.getenv('DALLE_CONCURRENCY') or 4)
+    print(f"Generating {len(prompts)} images with {workers} concurrent requests")
+
+    # A semaphore caps the number of generations in flight
+    generation_slots = asyncio.Semaphore(workers)
+
+    # One pooled async HTTP client is shared by all the downloads
+    async with client, clients.http_client_async() as http_client:
+
+        async def generate(img_no, prompt):
+
+            # Called by the cache only for prompts it doesn't have yet
+            async def generate_image(image_path):
+                async with generation_slots:
+                    result = await throttle.call_async(
+                        'openai',
+                        client.images.generate,
+                        model=model_deployment,
+                        prompt=prompt,
+                        n=1
+                    )
+                # The slot is free again, so the next generation starts while this image downloads
+                await download_image_async(http_client, result.data[0].url, image_path)
+                return {'revised_prompt': result.data[0].revised_prompt}
+
+            if cache is None:
+                image_path = os.path.join(image_folder(), f"image_{img_no}.png")
+                await generate_image(image_path)
+                print(f"Image saved as {image_path}")
+                return
+            entry = await cache.get_or_generate_async(prompt, model_deployment, generate_image)
+            save_cached_image(entry, f"image_{img_no}.png")
+
+        start = time.perf_counter()
+        # return_exceptions=True lets the other prompts carry on when one fails
+        outcomes = await asyncio.gather(
+            *(generate(img_no, prompt) for img_no, prompt in enumerate(prompts, 1)),
+            return_exceptions=True
+        )
+        elapsed = time.perf_counter() - start
+
+    # Report the prompts that failed, then a summary of the batch
+    failed = 0
+    for img_no, (prompt, outcome) in enumerate(zip(prompts, outcomes), 1):
+        if isinstance(outcome, Exception):
+            failed += 1
+            print(f"  Prompt {img_no} ('{prompt}') failed: {outcome}")
+    rate = len(prompts) / elapsed if elapsed > 0 else 0
+    from_cache = cache.hits + cache.shared if cache is not None else 0
+    print(f"\n{len(prompts) - failed} saved, {failed} failed in {elapsed:.1f}s ({rate:.2f} images/sec, "
+          f"{from_cache} from the cache)")
+
+
+async def download_image_async(http_client, image_url, image_path):
+    """
+    Downloads an image with an async HTTP client and saves it as image_path.
+
+    Parameters:
+    - http_client: httpx.AsyncClient used for the download
     - image_url: URL of the image to download (provided by DALL-E)
+    - image_path: Path to save the image as (should be .png)
+
+    Works like download_image: the image is streamed to a temporary file, verified, and
+    then renamed into place, and failed downloads are retried.
+    """
+    import httpx
+
+    retries = download_retries()
+    for attempt in range(retries + 1):
+        delay = retry_delay(attempt)
+        try:
+            async with http_client.stream('GET', image_url, headers=IDENTITY_ENCODING) as response:
+                if response.status_code in RETRY_STATUSES and attempt < retries:
+                    delay = retry_delay(attempt, response.headers)
+                    raise DownloadError(f"HTTP {response.status_code}")
+                response.raise_for_status()
+                with ImageDownload(image_path) as download:
+                    async for chunk in response.aiter_raw(DOWNLOAD_CHUNK_SIZE):
+                        download.write(chunk)
+                    download.finish(response.headers)
+            break
+        except (DownloadError, httpx.TransportError):
+            if attempt == retries:
+                raise
+            await asyncio.sleep(delay)
+
+
+def save_cached_image(entry, file_name):
+    """
+    Copies an image from the generation cache to the images folder.
+
+    Parameters:
+    - entry: Cache entry returned by GenerationCache (entry['image'] is the cached file)
     - file_name: Filename to save the image as (should be .png)
-    
+    """
+    image_path = os.path.join(image_folder(), file_name)
+    shutil.copyfile(entry['image'], image_path)
+    source = " (from the cache)" if entry.get('cached') else ""
+    print(f"Image saved as {image_path}{source}")
+
+
+def download_image(image_url, image_path):
+    """
+    Downloads an image from a URL and saves it as image_path.
+
+    Parameters:
+    - image_url: URL of the image to download (provided by DALL-E)
+    - image_path: Path to save the image as (should be .png)
+
     This function:
-    1. Creates an 'images' directory if it doesn't exist
-    2. Downloads the image from the URL
-    3. Saves the image to the images folder
-    4. Prints confirmation message
+    1. Streams the image from the URL into a temporary file, a chunk at a time
+    2. Checks the file against the size and MD5 checksum the server sent
+    3. Renames the temporary file to image_path
+
+    Downloads use one pooled session (so connections are reused) with timeouts, and
+    are retried (DOWNLOAD_RETRIES times, default 3) if the connection fails, the server
+    is busy or the file doesn't match its checksum.
     """
-    
-    # =============================================================================
-    # CREATE IMAGES DIRECTORY IF IT DOESN'T EXIST
-    # =============================================================================
-    # Set the directory path for storing generated images
-    # os.path.join() combines the current working directory with 'images' folder name
-    image_dir = os.path.join(os.getcwd(), 'images')
-
-    # Check if the images directory already exists
-    # os.path.isdir() returns True if the path is an existing directory
-    if not os.path.isdir(image_dir):
-        # Create the 'images' directory if it doesn't exist
-        # os.mkdir() creates a single new directory
-        os.mkdir(image_dir)
-
-    # =============================================================================
-    # DOWNLOAD AND SAVE THE IMAGE
-    # =============================================================================
-    # Create the full file path by combining the images directory and filename
-    image_path = os.path.join(image_dir, file_name)
-
-    # Download the image from the URL
-    # requests.get() fetches the image content
-    # .content returns the binary image data (not text)
-    generated_image = requests.get(image_url).content
-    
-    # Open a file in binary write mode ('wb') and save the image
-    # 'wb' mode writes binary data (the image file)
-    # The 'with' statement ensures the file is properly closed after writing
-    with open(image_path, "wb") as image_file:
-        # Write the downloaded image data to the file
-        image_file.write(generated_image)
-    
-    # Print confirmation message showing where the image was saved
-    print(f"Image saved as {image_path}")
+    # This loop is the only place downloads are retried: after connection errors, busy
+    # responses (429, 5xx), and downloads that break off or fail verification
+    retries = download_retries()
+    for attempt in range(retries + 1):
+        delay = retry_delay(attempt)
+        try:
+            # stream=True fetches the body as it's read, rather than all at once into memory
+            # The timeout applies to connecting and to each wait for data
+            # IDENTITY_ENCODING asks for the file as it is stored, not compressed for the trip
+            with download_session().get(image_url, stream=True, timeout=clients.timeouts(),
+                                        headers=IDENTITY_ENCODING) as response:
+                # A busy server is tried again, after the delay it asks for (Retry-After) if any
+                if response.status_code in RETRY_STATUSES and attempt < retries:
+                    delay = retry_delay(attempt, response.headers)
+                    raise DownloadError(f"HTTP {response.status_code}")
+                response.raise_for_status()
+
+                # Write the image to a temporary file a chunk at a time (so memory use stays
+                # flat however large the image is), then verify it and move it into place
+                # raw.stream(decode_content=False) yields the bytes exactly as sent, which is
+                # what the Content-Length and Content-MD5 headers describe
+                with ImageDownload(image_path) as download:
+                    for chunk in response.raw.stream(DOWNLOAD_CHUNK_SIZE, decode_content=False):
+                        download.write(chunk)
+                    download.finish(response.headers)
+            break
+        except (DownloadError, requests.ConnectionError, requests.Timeout, requests.exceptions.RetryError,
+                requests.exceptions.ChunkedEncodingError, urllib3.exceptions.HTTPError):
+            if attempt == retries:
+                raise
+            time.sleep(delay)
+
+
+# =============================================================================
+# DOWNLOAD HELPERS
+# =============================================================================
+# Size of the pieces an image is read and written in
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Responses worth trying again: too many requests, and temporary server errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Ask for images uncompressed, so the bytes received are the file itself
+IDENTITY_ENCODING = {'Accept-Encoding': 'identity'}
+
+# Created the first time they're needed, then reused for every image
+_image_dir = None
+_download_session = None
+
+
+class DownloadError(IOError):
+    """A download that was cut short or doesn't match its checksum."""
+
+
+def download_retries():
+    return int(os.getenv('DOWNLOAD_RETRIES') or 3)
+
+
+def image_folder():
+    """Returns the path of the 'images' folder, creating it the first time it's used."""
+    global _image_dir
+    if _image_dir is None:
+        image_dir = os.path.join(os.getcwd(), 'images')
+        os.makedirs(image_dir, exist_ok=True)
+        _image_dir = image_dir
+    return _image_dir
+
+
+def retry_delay(attempt, headers=None):
+    """Returns the seconds to wait before retrying a download: the server's Retry-After, or a growing delay."""
+    retry_after = (headers or {}).get('Retry-After')
+    if retry_after is not None:
+        try:
+            return min(float(retry_after), 60)
+        except ValueError:
+            pass  # An HTTP date rather than a number of seconds
+    return 0.5 * 2 ** attempt
+
+
+def download_session():
+    """Returns the requests Session shared by every download, with pooled connections."""
+    global _download_session
+    if _download_session is None:
+        # Failed downloads are retried by download_image(), not by the session, so a
+        # failing URL is tried at most DOWNLOAD_RETRIES + 1 times
+        _download_session = clients.session()
+    return _download_session
+
+
+class ImageDownload:
+    """
+    Writes a downloaded image to a temporary file next to its final path, counting its
+    size and MD5 checksum as it goes. finish() checks them against the response headers
+    and renames the file into place, so an image file is either complete or not there.
+    If the download fails, the temporary file is removed.
+    """
+
+    def __init__(self, image_path):
+        self.image_path = image_path
+        self.file = tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(image_path),
+            prefix='.' + os.path.basename(image_path),
+            suffix='.part',
+            delete=False
+        )
+        self.md5 = hashlib.md5()
+        self.size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.file.close()
+            os.remove(self.file.name)
+
+    def write(self, chunk):
+        self.file.write(chunk)
+        self.md5.update(chunk)
+        self.size += len(chunk)
+
+    def finish(self, headers):
+        self.file.close()
+
+        # Content-Length: the number of bytes the server said it would send
+        expected_size = headers.get('Content-Length')
+        if expected_size is not None and int(expected_size) != self.size:
+            raise DownloadError(f"Got {self.size} of {expected_size} bytes")
+
+        # Content-MD5 (x-ms-blob-content-md5 for Azure blobs): base64 MD5 of the file
+        expected_md5 = headers.get('Content-MD5') or headers.get('x-ms-blob-content-md5')
+        if expected_md5 and base64.b64decode(expected_md5) != self.md5.digest():
+            raise DownloadError("The downloaded image doesn't match its MD5 checksum")
+
+        # os.replace() renames in one step, replacing any earlier file with the same name
+        os.replace(self.file.name, self.image_path)
 
 
 # This guard ensures the main() function only runs when the script is executed directly
@@ -9,18 +9,30 @@ import os
 # sys.argv[0] is the script name, sys.argv[1] onwards are user-provided arguments
 import sys
 
-# Import PIL (Python Imaging Library) components for image manipulation
-# Image: used to open and work with image files
-# ImageDraw: used to draw shapes (rectangles, polygons, etc.) on images
-from PIL import Image, ImageDraw
+# Import time to report how fast a batch of images was processed
+import time
 
-# Import matplotlib's pyplot module for displaying and saving images
-# This is used to visualize the annotated images with faces highlighted
-from matplotlib import pyplot as plt
+# Import the thread pool used to keep several detect calls in flight in batch mode
+from concurrent.futures import ThreadPoolExecutor
 
-# Import Azure AI Vision Face API components for face detection and analysis
-# FaceClient: The main client for communicating with Azure Face API
-from azure.ai.vision.face import FaceClient
+# Make the shared helpers in Labfiles/common/python importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'common', 'python'))
+
+# Import the shared annotation helpers, which draw boxes and labels on images with PIL
+# This is used to save the annotated images with faces highlighted
+import image_annotation
+
+# Import the shared preprocessing helpers, which can shrink images before they are uploaded
+# (enabled with PREPROCESS_IMAGES=1 in the .env file)
+import image_preprocessing
+
+# Import the shared client factory, which creates the FaceClient (the main client for
+# communicating with Azure Face API) with pooled keep-alive connections
+import clients
+
+# Import the shared rate limiter, which spaces requests to stay within the service quota
+# and retries requests the service throttles
+import throttle
 
 # Import models used for face detection configuration
 # FaceDetectionModel: Specifies which detection algorithm to use
@@ -28,10 +40,6 @@ from azure.ai.vision.face import FaceClient
 # FaceAttributeTypeDetection01: Enum for available facial attributes to detect
 from azure.ai.vision.face.models import FaceDetectionModel, FaceRecognitionModel, FaceAttributeTypeDetection01
 
-# Import credential handler for Azure API authentication
-# AzureKeyCredential: Wraps the API key for secure authentication with Azure services
-from azure.core.credentials import AzureKeyCredential
-
 
 def main():
     """
@@ -82,11 +90,10 @@ def main():
         # This client object will be used to send all face detection requests to Azure
         # Parameters explained:
         #   - endpoint: The base URL of the Azure Face API service for your region
-        #   - credential: Wrapped API key that authenticates each request
-        # The FaceClient communicates with Azure's servers to perform face detection
-        face_client = FaceClient(
-            endpoint=cog_endpoint,
-            credential=AzureKeyCredential(cog_key))
+        #   - key: The API key that authenticates each request
+        # The FaceClient communicates with Azure's servers to perform face detection,
+        # keeping its connections open so batch mode's concurrent calls can reuse them
+        face_client = clients.face_client(cog_endpoint, cog_key)
 
         # Define which facial attributes we want Azure to detect and return
         # The Face API can detect many attributes; we specify only the ones we need
@@ -99,25 +106,18 @@ def main():
                     FaceAttributeTypeDetection01.OCCLUSION,
                     FaceAttributeTypeDetection01.ACCESSORIES]
 
+        # If a folder was given, analyze every image in it with this one client and
+        # save the results in the face store instead of printing them
+        if os.path.isdir(image_file):
+            analyze_folder(face_client, image_file, features)
+            return
+
         # Send image to Azure Face API for face detection and analysis
-        # Open the image file in binary read mode ('rb') to get raw bytes
-        # The Azure API expects binary image data, not a file path
-        with open(image_file, mode="rb") as image_data:
-            # Call the detect method on the Face API client
-            # Parameters explained:
-            #   - image_content: The binary image data to analyze
-            #   - detection_model: DETECTION01 is the standard face detection model
-            #   - recognition_model: RECOGNITION01 is used for recognizing face characteristics
-            #   - return_face_id: False (we don't need unique face IDs for this exercise)
-            #   - return_face_attributes: The list of attributes we want Azure to analyze
-            # Returns: A list of detected faces with their attributes
-            detected_faces = face_client.detect(
-                image_content=image_data.read(),
-                detection_model=FaceDetectionModel.DETECTION01,
-                recognition_model=FaceRecognitionModel.RECOGNITION01,
-                return_face_id=False,
-                return_face_attributes=features,
-            )
+        # detect_faces() reads the image, calls the Face API's detect method for the requested
+        # attributes, and maps the face rectangles back to the original image if it was
+        # downsized first (see detect_faces below for the details)
+        # Returns: A list of detected faces with their attributes
+        detected_faces = detect_faces(face_client, image_file, features)
 
         # Initialize face counter to track and number detected faces
         face_count = 0
@@ -171,6 +171,95 @@ def main():
         # Print the error message to help debug the issue
         print(ex)
 
+def detect_faces(face_client, image_file, features):
+    """
+    Detect the faces in one image and return them, with their rectangles mapped back
+    to the original image if it was downsized before upload.
+    """
+    # prepare() reads the image file as raw bytes; with preprocessing enabled, it also
+    # downsizes large photos and strips their metadata so there is less to upload
+    # The Azure API expects binary image data, not a file path
+    prepared = image_preprocessing.prepare(image_file, 'face')
+
+    # Call the detect method on the Face API client
+    # Parameters explained:
+    #   - image_content: The binary image data to analyze
+    #   - detection_model: DETECTION01 is the standard face detection model
+    #   - recognition_model: RECOGNITION01 is used for recognizing face characteristics
+    #   - return_face_id: False (we don't need unique face IDs for this exercise)
+    #   - return_face_attributes: The list of attributes we want Azure to analyze
+    # throttle.call() keeps the request within the Face API's rate limit, and retries it
+    # (after the delay the service asks for) if the service responds 429 Too Many Requests
+    detected_faces = throttle.call(
+        'face',
+        face_client.detect,
+        image_content=prepared.data,
+        detection_model=FaceDetectionModel.DETECTION01,
+        recognition_model=FaceRecognitionModel.RECOGNITION01,
+        return_face_id=False,
+        return_face_attributes=features,
+    )
+    # If the image was downsized, map the face rectangles back to the original image
+    return image_preprocessing.rescale_faces(detected_faces, prepared)
+
+
+def analyze_folder(face_client, folder, features, store_folder='face-store'):
+    """
+    Detect the faces in every image in a folder and save them in the face store.
+
+    The folder is streamed (images are listed as they are needed, not all up front) and
+    one FaceClient is shared by all the worker threads. At most FACE_CONCURRENCY detect
+    calls (default 4) are in flight, plus as many again waiting, so memory use stays flat
+    however many images there are. Each face's rectangle, head pose, occlusion flags and
+    accessories are written to NumPy .npz shards in store_folder (FACE_STORE_DIR), so the
+    results can be analyzed later without calling the Face API again. Images already in
+    the store (from an earlier run) are skipped.
+    """
+    # The columnar face store (and NumPy, which it uses) is only imported in batch mode
+    import face_store
+
+    workers = int(os.getenv('FACE_CONCURRENCY') or 4)
+    store_folder = os.getenv('FACE_STORE_DIR') or store_folder
+    print(f'Analyzing faces in {folder} with {workers} workers\n')
+
+    # List the image files lazily, so a huge folder starts processing straight away
+    images = (entry.path for entry in os.scandir(folder)
+              if entry.is_file() and entry.name.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp')))
+
+    start = time.perf_counter()
+    analyzed = failed = skipped = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor, face_store.FaceStoreWriter(store_folder) as store:
+        in_flight = []
+        while True:
+            # Keep the pipeline full, but never more than two calls per worker
+            for image_file in images:
+                if image_file in store:
+                    # Stored by an earlier run, so don't pay to detect its faces again
+                    skipped += 1
+                    continue
+                in_flight.append((image_file, executor.submit(detect_faces, face_client, image_file, features)))
+                if len(in_flight) >= workers * 2:
+                    break
+            if not in_flight:
+                break
+
+            # Store the oldest image's faces (results are stored in the order the folder was listed)
+            image_file, future = in_flight.pop(0)
+            try:
+                store.add(image_file, future.result())
+                analyzed += 1
+            except Exception as ex:
+                # Keep going: one failed image shouldn't stop the batch
+                failed += 1
+                print(f'  {image_file}: {ex}')
+
+    elapsed = time.perf_counter() - start
+    rate = (analyzed + failed) / elapsed if elapsed > 0 else 0
+    print(f'\n{analyzed} images analyzed, {failed} failed in {elapsed:.1f}s ({rate:.1f} images/sec)'
+          f', {skipped} already in the store')
+    print(f'  {store.faces_written} faces saved in {store_folder}')
+
+
 def annotate_faces(image_file, detected_faces):
     """
     Create a visual annotation of detected faces by drawing bounding boxes around them.
@@ -180,87 +269,46 @@ def annotate_faces(image_file, detected_faces):
     3. Labels each face with a number
     4. Saves the annotated image to disk for visual inspection
     
+    The boxes and labels are drawn straight onto the image with PIL, and the image is
+    saved once at its original resolution (no matplotlib figure is involved).
+    
     Args:
         image_file: Path to the original image file to annotate
         detected_faces: List of face objects returned by the Face API containing face rectangles
     """
     print('\nAnnotating faces in image...')
 
-    # Create a matplotlib figure for displaying the image
-    # figsize=(8, 6) sets the display size to 8x6 inches
-    # This is independent of the actual image size
-    fig = plt.figure(figsize=(8, 6))
-    
-    # Hide the axis labels and gridlines for a cleaner appearance
-    # This shows just the image without matplotlib's default axis decorations
-    plt.axis('off')
-    
-    # Open the original image file using PIL
-    # Image.open() loads the image from disk into memory
-    image = Image.open(image_file)
+    # Open the original image file
+    # image_annotation.load() decodes the image once, ready for drawing
+    image = image_annotation.load(image_file)
     
-    # Create a drawing context for the image
-    # ImageDraw.Draw() allows us to draw shapes on the image
-    draw = ImageDraw.Draw(image)
+    # Calculate the bounding box for each face
+    # The face_rectangle contains:
+    #   - left: X-coordinate of the left edge of the face
+    #   - top: Y-coordinate of the top edge of the face
+    #   - width: Width of the bounding box in pixels
+    #   - height: Height of the bounding box in pixels
+    # Boxes are given as two corners: top-left (left, top) and bottom-right (left + width, top + height)
+    boxes = [(face.face_rectangle.left,
+              face.face_rectangle.top,
+              face.face_rectangle.left + face.face_rectangle.width,
+              face.face_rectangle.top + face.face_rectangle.height) for face in detected_faces]
     
-    # Set the color for the bounding boxes
-    # 'lightgreen' is a named color in PIL (RGB: 144, 238, 144)
-    color = 'lightgreen'
-
-    # Initialize face counter for numbering faces in the annotated image
-    face_count = 0
-    
-    # Loop through each detected face to draw a bounding box around it
-    for face in detected_faces:
-        # Increment the face counter to assign a unique number to each face
-        face_count += 1
-        
-        # Extract the face rectangle coordinates from the detected face
-        # The face_rectangle contains:
-        #   - left: X-coordinate of the left edge of the face
-        #   - top: Y-coordinate of the top edge of the face
-        #   - width: Width of the bounding box in pixels
-        #   - height: Height of the bounding box in pixels
-        r = face.face_rectangle
-        
-        # Calculate the bounding box coordinates for the rectangle
-        # PIL's draw.rectangle() expects two points: top-left and bottom-right corners
-        # Top-left corner: (left, top)
-        # Bottom-right corner: (left + width, top + height)
-        bounding_box = ((r.left, r.top), (r.left + r.width, r.top + r.height))
-        
-        # Redraw the drawing context (this is sometimes necessary for proper rendering)
-        draw = ImageDraw.Draw(image)
-        
-        # Draw the rectangle (bounding box) around the detected face
-        # Parameters:
-        #   - bounding_box: The coordinates of the rectangle
-        #   - outline: The color of the rectangle border (lightgreen)
-        #   - width: The thickness of the border in pixels (5 pixels = thick border)
-        draw.rectangle(bounding_box, outline=color, width=5)
-        
-        # Create a text label for this face (e.g., "Face number 1")
-        annotation = 'Face number {}'.format(face_count)
-        
-        # Annotate the image with the face label
-        # Parameters:
-        #   - annotation: The text to display
-        #   - (r.left, r.top): The position where the label appears (top-left of face)
-        #   - backgroundcolor: The background color behind the text for visibility
-        plt.annotate(annotation,(r.left, r.top), backgroundcolor=color)
+    # Create a text label for each face (e.g., "Face number 1")
+    labels = ['Face number {}'.format(face_count) for face_count in range(1, len(detected_faces) + 1)]
     
-    # Display the annotated image in the matplotlib window
-    # plt.imshow() renders the image with all the rectangles we drew
-    plt.imshow(image)
+    # Draw each rectangle (bounding box) with its label at the top-left of the face
+    # Parameters:
+    #   - color: 'lightgreen' is a named color in PIL (RGB: 144, 238, 144)
+    #   - width: The thickness of the border in pixels (5 pixels = thick border)
+    image_annotation.draw_boxes(image, boxes, 'lightgreen', width=5, labels=labels)
     
     # Define the output filename for the annotated image
     # The image will be saved in the current working directory
     outputfile = 'detected_faces.jpg'
     
-    # Save the figure with all annotations to a JPEG file
-    # fig.savefig() writes the current matplotlib figure to disk
-    # The image includes the annotated image with bounding boxes and labels
-    fig.savefig(outputfile)
+    # Save the annotated image to a JPEG file
+    image_annotation.save(image, outputfile)
     
     # Inform the user that the annotated image has been saved successfully
     # The output shows the filename where results can be found
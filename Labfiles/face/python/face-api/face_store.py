@@ -0,0 +1,248 @@
+"""
+Compact columnar storage for face detection results.
+
+Each detected face becomes one row of a NumPy structured array (FACE_DTYPE): its
+rectangle, head pose angles, occlusion flags and accessories (as a bit mask). Rows are
+written in shards of up to shard_size faces or shard_images images (whichever comes
+first, so an interrupted run keeps most of its results), as shard-NNNNN.npz files holding:
+    faces   the structured array of face rows
+    images  the image paths; each face row's 'image' field is an index into this array
+
+Images are keyed by their path: an image already in the store is not added again, so
+running the batch again over the same folder only adds the images that are new (or
+that failed last time).
+
+Analytics can then load the shards with NumPy instead of calling the Face API again.
+FaceIndex loads every shard into one array and answers attribute queries (such as
+"yaw over 30 degrees with the mouth occluded") with vectorized filters.
+"""
+import os
+
+import numpy as np
+
+# Accessory types reported by the Face API, in bit order for the 'accessories' field
+ACCESSORY_TYPES = ('headwear', 'glasses', 'mask')
+
+FACE_DTYPE = np.dtype([
+    ('image', np.int32),             # Index into the shard's images array
+    ('face', np.int16),              # Face number within the image, starting at 1
+    ('left', np.int32),
+    ('top', np.int32),
+    ('width', np.int32),
+    ('height', np.int32),
+    ('yaw', np.float32),
+    ('pitch', np.float32),
+    ('roll', np.float32),
+    ('forehead_occluded', np.bool_),
+    ('eye_occluded', np.bool_),
+    ('mouth_occluded', np.bool_),
+    ('accessories', np.uint8),       # Bit mask over ACCESSORY_TYPES
+])
+
+# Fields FaceIndex can filter on with a (low, high) range, and with True/False
+RANGE_FIELDS = ('yaw', 'pitch', 'roll')
+FLAG_FIELDS = ('forehead_occluded', 'eye_occluded', 'mouth_occluded')
+
+
+def accessory_name(accessory):
+    """Return the name of an accessory type (a string, an AccessoryType or an object with a .type)."""
+    accessory = getattr(accessory, 'type', accessory)
+    # AccessoryType is a str Enum: str() gives 'AccessoryType.GLASSES', its value gives 'glasses'
+    return str(getattr(accessory, 'value', accessory)).lower()
+
+
+def accessory_mask(accessories):
+    """Return the bit mask for a list of accessory types (or objects with a .type)."""
+    mask = 0
+    for accessory in accessories:
+        name = accessory_name(accessory)
+        if name in ACCESSORY_TYPES:
+            mask |= 1 << ACCESSORY_TYPES.index(name)
+    return mask
+
+
+def shard_number(shard_file):
+    """Return the number of a shard file (shard-NNNNN.npz), or None if it isn't one."""
+    name = os.path.basename(shard_file)
+    number = name[len('shard-'):-len('.npz')]
+    if name.startswith('shard-') and name.endswith('.npz') and number.isdigit():
+        return int(number)
+    return None
+
+
+def shard_files(folder):
+    """Return the shard files in a store folder, in the order they were written."""
+    if not os.path.isdir(folder):
+        return []
+    shards = [os.path.join(folder, name) for name in os.listdir(folder)]
+    return sorted((path for path in shards if shard_number(path) is not None), key=shard_number)
+
+
+def stored_images(folder):
+    """Return the set of image paths already in a store folder."""
+    images = set()
+    for shard_file in shard_files(folder):
+        # Only the images array is read from each shard, not its face rows
+        with np.load(shard_file) as shard:
+            images.update(shard['images'].tolist())
+    return images
+
+
+class FaceStoreWriter:
+    """Collects face rows and writes them to .npz shards."""
+
+    def __init__(self, folder, shard_size=100000, shard_images=1000):
+        """
+        Args:
+            folder (str): Store folder; new shards are numbered after any already in it
+            shard_size (int): Maximum number of faces per shard
+            shard_images (int): Maximum number of images per shard
+        """
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.shard_size = shard_size
+        self.shard_images = shard_images
+        shards = shard_files(folder)
+        self.next_shard = shard_number(shards[-1]) + 1 if shards else 0
+        self.images = stored_images(folder)  # Every image path in the store, including this run's
+        self.faces_written = 0
+        self._rows = []
+        self._images = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def __contains__(self, image_file):
+        return image_file in self.images
+
+    def add(self, image_file, detected_faces):
+        """
+        Add the faces detected in one image (an image with no faces is still recorded).
+
+        Returns False, and adds nothing, if the image is already in the store.
+        """
+        if image_file in self.images:
+            return False
+        self.images.add(image_file)
+        image_index = len(self._images)
+        self._images.append(image_file)
+        for face_number, face in enumerate(detected_faces, 1):
+            r = face.face_rectangle
+            attributes = face.face_attributes
+            pose = attributes.head_pose
+            occlusion = attributes.occlusion
+            self._rows.append((image_index, face_number, r.left, r.top, r.width, r.height,
+                               pose.yaw, pose.pitch, pose.roll,
+                               occlusion["foreheadOccluded"], occlusion["eyeOccluded"], occlusion["mouthOccluded"],
+                               accessory_mask(attributes.accessories or [])))
+        if len(self._rows) >= self.shard_size or len(self._images) >= self.shard_images:
+            self.flush()
+        return True
+
+    def flush(self):
+        """Write the collected rows to the next shard file."""
+        if not self._images:
+            return
+        shard_file = os.path.join(self.folder, 'shard-{:05d}.npz'.format(self.next_shard))
+        np.savez(shard_file,
+                 faces=np.array(self._rows, dtype=FACE_DTYPE),
+                 images=np.array(self._images, dtype=np.str_))
+        self.faces_written += len(self._rows)
+        self.next_shard += 1
+        self._rows = []
+        self._images = []
+
+
+class FaceIndex:
+    """
+    All the faces in a store, loaded into one structured array for fast queries.
+
+    Filters are applied to whole columns at once with NumPy. The first range filter in a
+    query uses a sorted index of that column (built the first time the column is queried)
+    to find its matching rows with a binary search, so only those rows are tested against
+    the other filters.
+    """
+
+    def __init__(self, folder):
+        faces, images = [], []
+        offset = 0
+        for shard_file in shard_files(folder):
+            with np.load(shard_file) as shard:
+                shard_faces = shard['faces']
+                # Make image numbers refer to the combined images array
+                shard_faces['image'] += offset
+                faces.append(shard_faces)
+                images.append(shard['images'])
+                offset += len(shard['images'])
+        self.faces = np.concatenate(faces) if faces else np.empty(0, dtype=FACE_DTYPE)
+        self.images = np.concatenate(images) if images else np.empty(0, dtype=np.str_)
+        self._sorted = {}
+
+    def __len__(self):
+        return len(self.faces)
+
+    def _sorted_index(self, field):
+        """Return the row order that sorts a column, and the sorted column values."""
+        if field not in self._sorted:
+            order = np.argsort(self.faces[field], kind='stable')
+            self._sorted[field] = (order, self.faces[field][order])
+        return self._sorted[field]
+
+    def select(self, accessories=(), no_accessories=(), **filters):
+        """
+        Return the row numbers of the faces that match every filter.
+
+        Args:
+            accessories: Accessory types a face must all have (such as 'glasses' or AccessoryType.GLASSES)
+            no_accessories: Accessory types a face must not have
+            **filters: A (low, high) range for each of RANGE_FIELDS to filter on (inclusive;
+                either end can be None), and True or False for each of FLAG_FIELDS
+
+        Returns:
+            numpy.ndarray: Row numbers into self.faces, in ascending order
+        """
+        unknown = set(filters) - set(RANGE_FIELDS) - set(FLAG_FIELDS)
+        if unknown:
+            raise ValueError('Unknown face filters: {}'.format(', '.join(sorted(unknown))))
+        accessories = [accessory_name(accessory) for accessory in accessories]
+        no_accessories = [accessory_name(accessory) for accessory in no_accessories]
+        unknown = (set(accessories) | set(no_accessories)) - set(ACCESSORY_TYPES)
+        if unknown:
+            raise ValueError('Unknown accessory types: {}'.format(', '.join(sorted(unknown))))
+        ranges = [(field, value) for field, value in filters.items() if field in RANGE_FIELDS]
+        flags = [(field, value) for field, value in filters.items() if field in FLAG_FIELDS]
+
+        # Narrow the candidates with the sorted index of the first range filter
+        if ranges:
+            field, (low, high) = ranges.pop(0)
+            order, values = self._sorted_index(field)
+            first = 0 if low is None else np.searchsorted(values, low, side='left')
+            last = len(values) if high is None else np.searchsorted(values, high, side='right')
+            rows = np.sort(order[first:last])
+        else:
+            rows = np.arange(len(self.faces))
+
+        candidates = self.faces[rows]
+        mask = np.ones(len(rows), dtype=bool)
+        for field, (low, high) in ranges:
+            if low is not None:
+                mask &= candidates[field] >= low
+            if high is not None:
+                mask &= candidates[field] <= high
+        for field, value in flags:
+            mask &= candidates[field] == bool(value)
+        required, excluded = accessory_mask(accessories), accessory_mask(no_accessories)
+        if required:
+            mask &= (candidates['accessories'] & required) == required
+        if excluded:
+            mask &= (candidates['accessories'] & excluded) == 0
+        return rows[mask]
+
+    def query(self, **filters):
+        """Return (image path, face number) pairs for the faces that match the filters (see select)."""
+        rows = self.select(**filters)
+        matches = self.faces[rows]
+        return list(zip(self.images[matches['image']].tolist(), matches['face'].tolist()))
@@ -0,0 +1,68 @@
+# Query the faces saved by analyze-faces.py in batch mode (python analyze-faces.py <folder>)
+# without calling the Face API again.
+#
+# Examples:
+#   python query-faces.py --yaw 30: --mouth-occluded
+#   python query-faces.py --pitch -10:10 --accessory glasses --no-accessory mask
+#
+# Ranges are LOW:HIGH in degrees (inclusive); either end can be left out.
+
+import argparse
+import os
+import time
+
+import face_store
+
+
+def angle_range(text):
+    """Parse a LOW:HIGH range argument into a (low, high) tuple, with None for a missing end."""
+    low, separator, high = text.partition(':')
+    if not separator:
+        raise argparse.ArgumentTypeError('expected LOW:HIGH, for example 30: or -10:10')
+    try:
+        return (float(low) if low else None, float(high) if high else None)
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected numbers in LOW:HIGH, got {}'.format(text))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Find faces by head pose, occlusion and accessories.')
+    parser.add_argument('--store', default=os.getenv('FACE_STORE_DIR') or 'face-store',
+                        help='Face store folder (default: face-store)')
+    for field in face_store.RANGE_FIELDS:
+        parser.add_argument('--' + field, type=angle_range, metavar='LOW:HIGH',
+                            help='Head pose {} range in degrees'.format(field))
+    for field in face_store.FLAG_FIELDS:
+        option = '--' + field.replace('_', '-')
+        parser.add_argument(option, dest=field, action='store_true', default=None,
+                            help='Only faces with the {} occluded'.format(field.split('_')[0]))
+        parser.add_argument('--not-' + field.replace('_', '-'), dest=field, action='store_false',
+                            help='Only faces without the {} occluded'.format(field.split('_')[0]))
+    parser.add_argument('--accessory', action='append', default=[], choices=face_store.ACCESSORY_TYPES,
+                        help='Only faces wearing this accessory (can be repeated)')
+    parser.add_argument('--no-accessory', action='append', default=[], choices=face_store.ACCESSORY_TYPES,
+                        help='Only faces not wearing this accessory (can be repeated)')
+    parser.add_argument('--limit', type=int, default=20, help='Number of matches to list (default: 20)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = face_store.FaceIndex(args.store)
+    loaded = time.perf_counter()
+
+    filters = {field: getattr(args, field) for field in face_store.RANGE_FIELDS + face_store.FLAG_FIELDS
+               if getattr(args, field) is not None}
+    matches = index.query(accessories=args.accessory, no_accessories=args.no_accessory, **filters)
+    queried = time.perf_counter()
+
+    print('{} of {} faces match ({} images)'.format(
+        len(matches), len(index), len(set(image for image, _ in matches))))
+    print('  Loaded in {:.0f} ms, queried in {:.1f} ms\n'.format(
+        (loaded - start) * 1000, (queried - loaded) * 1000))
+    for image_file, face_number in matches[:args.limit]:
+        print('  {}  face {}'.format(image_file, face_number))
+    if len(matches) > args.limit:
+        print('  ... and {} more'.format(len(matches) - args.limit))
+
+
+if __name__ == "__main__":
+    main()
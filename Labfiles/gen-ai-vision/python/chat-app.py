@@ -1,5 +1,6 @@
 # Standard library imports for system and file operations
 import os  # Provides access to operating system functions (e.g., clearing console)
+import sys  # For locating the shared lab helpers
 from urllib.request import urlopen, Request  # For downloading images from URLs
 import base64  # For encoding binary image data to text format for API transmission
 from pathlib import Path  # For handling file paths in a cross-platform way
@@ -11,6 +12,10 @@ from azure.identity import DefaultAzureCredential  # Handles Azure authenticatio
 from azure.ai.projects import AIProjectClient  # Client for Azure AI Foundry projects
 from openai import AzureOpenAI  # OpenAI client configured for Azure deployment
 
+# Make the shared helpers in Labfiles/common/python importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'common', 'python'))
+import throttle  # Keeps requests within the service rate limit and retries throttled ones
+
 
 def main():
     """
@@ -121,7 +126,9 @@ def main():
 
                 # Include the image file data in the prompt
                 data_url = f"data:{mime_type};base64,{base64_encoded_data}"
-                response = openai_client.chat.completions.create(
+                response = throttle.call(
+                        'openai',
+                        openai_client.chat.completions.create,
                         model=model_deployment,
                         messages=[
                             {"role": "system", "content": system_message},
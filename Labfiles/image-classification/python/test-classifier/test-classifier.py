@@ -1,7 +1,14 @@
 # Import required modules for Azure Custom Vision prediction and file operations
-from azure.cognitiveservices.vision.customvision.prediction import CustomVisionPredictionClient
-from msrest.authentication import ApiKeyCredentials
-import os  # Used for environment variables and file/folder operations  # Used for environment variables and file/folder operations
+import os  # Used for environment variables and file/folder operations
+import sys  # Used to read the optional test folder from the command line
+import time  # Used to measure classification throughput
+from concurrent.futures import ThreadPoolExecutor  # Used to run classify calls concurrently
+
+# Make the shared helpers in Labfiles/common/python importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'common', 'python'))
+import clients  # Creates Azure clients with pooled keep-alive connections
+import image_preprocessing  # Optionally shrinks images before upload (PREPROCESS_IMAGES=1)
+import throttle  # Keeps requests within the service rate limit and retries throttled ones
 
 def main():
     """
@@ -10,14 +17,17 @@ def main():
     This function:
     1. Loads configuration from environment variables
     2. Authenticates with the Azure Custom Vision prediction service
-    3. Tests the trained model on images in the test-images folder
-    4. Prints predictions for each image with confidence > 50%
+    3. Tests the trained model on images in the test-images folder (or the folder
+       passed as the first command-line argument), several images at a time
+    4. Prints predictions for each image with confidence > 50%, in folder order
+    5. Reports the total time and throughput for the batch
     
     The script expects a .env file containing:
     - PredictionEndpoint: The Azure Custom Vision prediction API endpoint
     - PredictionKey: The API key for the prediction service
     - ProjectID: The ID of the Custom Vision project
     - ModelName: The name of the published model iteration to test
+    - MaxConcurrency (optional): Number of images classified at once (default 8)
     """
     from dotenv import load_dotenv  # Load environment variables from .env file
 
@@ -33,32 +43,39 @@ def main():
         prediction_endpoint = os.getenv('PredictionEndpoint')  # Azure endpoint URL for predictions
         prediction_key = os.getenv('PredictionKey')  # API key for prediction authentication
         project_id = os.getenv('ProjectID')  # ID of the Custom Vision project
-        model_name = os.getenv('ModelName')  # Name of the trained model to use for predictions  # Name of the trained model to use for predictions
+        model_name = os.getenv('ModelName')  # Name of the trained model to use for predictions
 
         # ===== AUTHENTICATION =====
-        # Create authentication credentials with the prediction key
-        # This key will be included in the header of all prediction API requests
-        credentials = ApiKeyCredentials(in_headers={"Prediction-key": prediction_key})
-        
-        # Initialize the Custom Vision Prediction client with the endpoint and credentials
-        # This client is used to make predictions on images using the trained model
-        prediction_client = CustomVisionPredictionClient(endpoint=prediction_endpoint, credentials=credentials)
+        # Initialize the Custom Vision Prediction client with the endpoint and prediction key
+        # The key is included in the header of all prediction API requests, and the client
+        # keeps its connections open so concurrent classify calls can reuse them
+        prediction_client = clients.custom_vision_prediction_client(prediction_endpoint, prediction_key)
 
         # ===== IMAGE CLASSIFICATION =====
-        # Process each test image in the test-images folder
-        for image in os.listdir('test-images'):
-            # Read the image file as binary data
-            image_path = os.path.join('test-images', image)
-            image_data = open(image_path, "rb").read()
-            
-            # Send the image to the trained model for classification
-            # The model analyzes the image and returns predictions for each category
-            # (e.g., apple, banana, oranges with confidence percentages)
-            results = prediction_client.classify_image(project_id, model_name, image_data)
+        # Use the folder given on the command line, or the test-images folder by default
+        folder = 'test-images'
+        if len(sys.argv) > 1:
+            folder = sys.argv[1]
+
+        # Number of classify calls allowed in flight at the same time
+        max_concurrency = int(os.getenv('MaxConcurrency') or 8)
+
+        # Classify every image in the folder and time the whole batch
+        images = sorted(os.listdir(folder))
+        start = time.perf_counter()
+        results = Classify_Images(prediction_client, project_id, model_name, folder, images, max_concurrency)
+        elapsed = time.perf_counter() - start
+
+        # ===== RESULTS PROCESSING =====
+        # Results come back in the same order as the input images
+        for image, (predictions, error) in zip(images, results):
+            if error is not None:
+                # A failed image is reported but does not stop the rest of the batch
+                print(image, ': failed ({})'.format(error))
+                continue
 
-            # ===== RESULTS PROCESSING =====
             # Loop over each predicted label returned by the model
-            for prediction in results.predictions:
+            for prediction in predictions:
                 # Only print predictions with confidence > 50%
                 # This filters out low-confidence guesses for cleaner output
                 # prediction.probability is a decimal (0.0 to 1.0)
@@ -66,10 +83,54 @@ def main():
                     # Print the image filename, predicted category, and confidence percentage
                     # Format: image.jpg : apple (85%)
                     print(image, ': {} ({:.0%})'.format(prediction.tag_name, prediction.probability))
+
+        # ===== THROUGHPUT =====
+        # Report how long the batch took and how many images per second were classified
+        rate = len(images) / elapsed if elapsed > 0 else 0
+        print('\nClassified {} images in {:.2f}s ({:.1f} images/sec, concurrency {})'.format(
+            len(images), elapsed, rate, max_concurrency))
     except Exception as ex:
         # If any error occurs during prediction, print it for debugging
         print(ex)
 
+def Classify_Images(prediction_client, project_id, model_name, folder, images, max_concurrency):
+    """
+    Classify a list of images using a bounded pool of worker threads.
+
+    Each worker reads one image and sends it to the prediction endpoint, so at most
+    max_concurrency requests are in flight at any time. The prediction client is
+    shared by all workers.
+
+    Args:
+        prediction_client: An authenticated CustomVisionPredictionClient
+        project_id (str): The ID of the Custom Vision project
+        model_name (str): The name of the published model iteration
+        folder (str): Folder containing the images
+        images (list): Image filenames to classify, in the order results should be returned
+        max_concurrency (int): Maximum number of classify calls in flight
+
+    Returns:
+        list: One (predictions, error) tuple per image, in the same order as images.
+              error is None when the image was classified successfully.
+    """
+    def classify(image):
+        try:
+            # Read the image file as binary data, downsized first if preprocessing is enabled
+            prepared = image_preprocessing.prepare(os.path.join(folder, image), 'custom-vision')
+            
+            # Send the image to the trained model for classification
+            # (within the prediction rate limit, retrying if the service throttles the request)
+            results = throttle.call('custom-vision-prediction', prediction_client.classify_image,
+                                    project_id, model_name, prepared.data)
+            return results.predictions, None
+        except Exception as ex:
+            # Keep the error with the image so one failure doesn't abort the batch
+            return None, ex
+
+    # executor.map yields results in input order, regardless of which call finishes first
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        return list(executor.map(classify, images))
+
 if __name__ == "__main__":
     """
     Script entry point.
@@ -1,15 +1,30 @@
 # Import required modules for Azure Custom Vision and file operations
-from azure.cognitiveservices.vision.customvision.training import CustomVisionTrainingClient
-from azure.cognitiveservices.vision.customvision.training.models import ImageFileCreateBatch, ImageFileCreateEntry, Region
-from msrest.authentication import ApiKeyCredentials
 import time  # Used for delays during model training polling
+import random  # Used to add jitter to the polling delays
+import asyncio  # Used by the async variant of the training poller
 import os  # Used for environment variables and file/folder operations
+import sys  # Used to locate the shared lab helpers
+from concurrent.futures import ThreadPoolExecutor  # Used to poll training in the background
+
+# Make the shared helpers in Labfiles/common/python importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'common', 'python'))
+import clients  # Creates Azure clients with pooled keep-alive connections
+from custom_vision_upload import UploadItem, upload_images  # Batched, concurrent image uploads
+from tag_index import TagIndex  # Tag name to tag ID lookup
+from upload_manifest import UploadManifest  # Record of images already uploaded
+import throttle  # Keeps requests within the service rate limit and retries throttled ones
 
 # Global variables that will be set during initialization
 # These store the Azure client and project information needed throughout the script
 training_client = None
 custom_vision_project = None
 
+# Iteration statuses after which training won't change state again
+TERMINAL_STATUSES = ("Completed", "Failed")
+
+# Background threads used by Start_Training to poll several trainings at once
+training_pollers = ThreadPoolExecutor(max_workers=8)
+
 def main():
     """
     Main entry point for the image classification training script.
@@ -44,18 +59,15 @@ def main():
         project_id = os.getenv('ProjectID')  # ID of the project to train
 
         # ===== AUTHENTICATION =====
-        # Create authentication credentials with the training key
-        # This key will be included in the header of all API requests
-        credentials = ApiKeyCredentials(in_headers={"Training-key": training_key})
-        
-        # Initialize the Custom Vision Training client with the endpoint and credentials
-        # This client is used to communicate with Azure's Custom Vision service
-        training_client = CustomVisionTrainingClient(training_endpoint, credentials)
+        # Initialize the Custom Vision Training client with the endpoint and training key
+        # The key is included in the header of all API requests, and the client keeps its
+        # connections open so concurrent uploads can reuse them
+        training_client = clients.custom_vision_training_client(training_endpoint, training_key)
 
         # ===== PROJECT RETRIEVAL =====
         # Fetch the Custom Vision project using the project ID
         # This verifies the connection and retrieves project details
-        custom_vision_project = training_client.get_project(project_id)
+        custom_vision_project = throttle.call('custom-vision-training', training_client.get_project, project_id)
 
         # ===== TRAINING WORKFLOW =====
         # Upload training images from the specified folder
@@ -75,10 +87,18 @@ def Upload_Images(folder):
     Upload training images to the Custom Vision project with appropriate tags.
     
     This function:
-    1. Retrieves all tags (categories/classes) defined in the project
-    2. For each tag, finds a corresponding subfolder in the training data
-    3. Reads each image in the subfolder
-    4. Uploads the image to Azure with the tag associated
+    1. Indexes the tags (categories/classes) defined in the project, creating a tag
+       for any subfolder that doesn't have one yet
+    2. For each tag, lists the images in the corresponding subfolder of the training data
+    3. Groups the images into batches (up to 64 images per request)
+    4. Uploads several batches at the same time, retrying batches that fail
+    
+    Images are read from disk only when their batch is about to be sent, so memory
+    use stays the same however many images the folder contains.
+    
+    Uploaded images are recorded in upload-manifest.db next to this script, keyed by
+    their content hash and tag. Re-running the script skips images that are already
+    in the project, and an interrupted run picks up after the last completed batch.
     
     Args:
         folder (str): Path to the root folder containing training images.
@@ -95,29 +115,53 @@ def Upload_Images(folder):
     │   └── image2.jpg
     └── orange/
         └── ...
+    
+    Optional .env settings:
+    - UploadBatchSize: Images per upload request (default and maximum 64)
+    - UploadConcurrency: Number of batches uploaded at the same time (default 4)
     """
     print("Uploading images...")
     
-    # Get all tags (categories) that exist in the Custom Vision project
-    # Tags must be pre-created in the project before uploading images
-    tags = training_client.get_tags(custom_vision_project.id)
+    # Each subfolder is named after the tag (category) of the images it contains
+    tag_names = sorted(name for name in os.listdir(folder) if os.path.isdir(os.path.join(folder, name)))
     
-    # Iterate through each tag/category
-    for tag in tags:
-        print(tag.name)  # Print the tag name for progress tracking
-        
-        # Get the path to the folder containing images for this tag
-        tag_folder_path = os.path.join(folder, tag.name)
-        
-        # Process each image file in this tag's folder
-        for image in os.listdir(tag_folder_path):
-            # Read the image file as binary data
-            image_path = os.path.join(tag_folder_path, image)
-            image_data = open(image_path, "rb").read()
+    # Index the tags that exist in the Custom Vision project by name,
+    # creating any tags that the training folders use but the project doesn't have yet
+    tags = TagIndex(training_client, custom_vision_project.id)
+    tags.ensure(tag_names)
+    
+    def training_images():
+        # Generator that describes each image without reading it
+        # Images are produced tag by tag, so each batch mostly holds images of a single tag
+        for tag_name in tag_names:
+            print(tag_name)  # Print the tag name for progress tracking
             
-            # Upload the image to the project with this tag
-            # The tag.id links the image to the correct category
-            training_client.create_images_from_data(custom_vision_project.id, image_data, [tag.id])
+            # Get the path to the folder containing images for this tag
+            tag_folder_path = os.path.join(folder, tag_name)
+            
+            for image in os.listdir(tag_folder_path):
+                # The tag ID links the image to the correct category
+                # The name includes the tag folder so images with the same filename stay distinct
+                yield UploadItem(name=tag_name + '/' + image,
+                                 path=os.path.join(tag_folder_path, image),
+                                 tag_ids=[tags[tag_name]])
+    
+    # Upload the images in concurrent batches
+    with UploadManifest(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'upload-manifest.db')) as manifest:
+        # Skip images whose content and labels were already uploaded to this project,
+        # and record each chunk as soon as the service accepts it
+        summary = upload_images(training_client, custom_vision_project.id,
+                                manifest.pending(custom_vision_project.id, training_images()),
+                                on_uploaded=lambda items: manifest.record(custom_vision_project.id, items),
+                                batch_size=int(os.getenv('UploadBatchSize') or 64),
+                                max_workers=int(os.getenv('UploadConcurrency') or 4))
+        skipped = manifest.skipped
+    
+    # Report the outcome, including any images that could not be uploaded
+    print("Images uploaded:", summary)
+    print("Already uploaded in an earlier run (skipped):", skipped)
+    for item, reason in summary.failed:
+        print(" Failed:", item.name, '-', reason)
 
 def Train_Model():
     """
@@ -125,37 +169,119 @@ def Train_Model():
     
     This function:
     1. Initiates a training iteration on the Custom Vision project
-    2. Polls the training status periodically
-    3. Waits until training is complete
+    2. Polls the training status, waiting longer between checks as training goes on
+    3. Stops when training completes, fails, or takes longer than the maximum wait
     4. Reports completion to the user
     
     During training, Azure's machine learning processes the tagged images
     to learn the visual characteristics of each category (apple, banana, etc.)
     
     Note: Training can take several minutes depending on the number of images.
-          The function checks status every 5 seconds to update the user.
+          The optional TrainingMaxWait setting in .env limits how many seconds to wait (default 3600).
     """
     print("Training ...")
     
     # Send the project to Azure for training
     # This initiates a machine learning process using the uploaded images
-    iteration = training_client.train_project(custom_vision_project.id)
+    iteration = throttle.call('custom-vision-training', training_client.train_project, custom_vision_project.id)
+    
+    # Wait for the iteration to reach a terminal state
+    # A failed or timed-out training raises an error, which main() reports
+    Wait_For_Iteration(training_client, custom_vision_project.id, iteration.id,
+                       max_wait=float(os.getenv('TrainingMaxWait') or 3600))
+    
+    # When the wait returns, training is complete
+    print("Model trained!")
+
+def Start_Training(client, project_id, **poll_options):
+    """
+    Start training a project and return immediately with a handle to the training.
+    
+    The returned concurrent.futures.Future resolves to the completed iteration (or raises
+    if training fails or times out), so one process can train several projects at once:
+    
+        handles = [Start_Training(client, project_id) for project_id in project_ids]
+        iterations = [handle.result() for handle in handles]
     
-    # Keep checking the training status until it's complete
-    # Training may take several minutes, so we poll periodically
-    while (iteration.status != "Completed"):
+    Args:
+        client: An authenticated CustomVisionTrainingClient
+        project_id (str): The ID of the project to train
+        poll_options: Optional initial_delay, max_delay and max_wait for Wait_For_Iteration
+    """
+    iteration = throttle.call('custom-vision-training', client.train_project, project_id)
+    return training_pollers.submit(Wait_For_Iteration, client, project_id, iteration.id, **poll_options)
+
+def Poll_Delays(initial_delay, max_delay):
+    """
+    Generate polling delays that double after each check, up to max_delay.
+    
+    Each delay is randomly shortened by up to half ("jitter") so that many pollers
+    started together don't all call the service at the same moment.
+    """
+    delay = initial_delay
+    while True:
+        yield delay * random.uniform(0.5, 1.0)
+        delay = min(delay * 2, max_delay)
+
+def Wait_For_Iteration(client, project_id, iteration_id, initial_delay=5, max_delay=60, max_wait=3600):
+    """
+    Block until a training iteration completes, polling with exponential backoff.
+    
+    Args:
+        client: An authenticated CustomVisionTrainingClient
+        project_id (str): The ID of the project being trained
+        iteration_id (str): The ID of the iteration returned by train_project
+        initial_delay (float): Seconds to wait before the first status check
+        max_delay (float): Longest wait between two status checks
+        max_wait (float): Seconds after which to stop waiting
+    
+    Returns:
+        The completed iteration
+    
+    Raises:
+        RuntimeError: If training fails
+        TimeoutError: If training hasn't finished within max_wait seconds
+    """
+    deadline = time.monotonic() + max_wait
+    for delay in Poll_Delays(initial_delay, max_delay):
+        # Never sleep past the deadline
+        time.sleep(max(0, min(delay, deadline - time.monotonic())))
+        
         # Fetch the latest status of the current training iteration
-        iteration = training_client.get_iteration(custom_vision_project.id, iteration.id)
+        iteration = throttle.call('custom-vision-training', client.get_iteration, project_id, iteration_id)
         
-        # Print the current status (e.g., "Training", "Validating")
+        # Print the current status (e.g., "Training", "Completed")
         print(iteration.status, '...')
         
-        # Wait 5 seconds before checking status again
-        # This prevents overwhelming the Azure API with requests
-        time.sleep(5)
+        if iteration.status in TERMINAL_STATUSES:
+            return Check_Iteration(iteration)
+        if time.monotonic() >= deadline:
+            raise TimeoutError('Training did not finish within {} seconds'.format(max_wait))
+
+async def Wait_For_Iteration_Async(client, project_id, iteration_id, initial_delay=5, max_delay=60, max_wait=3600):
+    """
+    Async version of Wait_For_Iteration, for driving trainings from an asyncio event loop.
     
-    # When the loop exits, training is complete
-    print("Model trained!")
+    The status check runs in a worker thread (the Custom Vision SDK is synchronous),
+    and the waits between checks don't block the event loop, so several trainings
+    can be awaited together with asyncio.gather().
+    """
+    deadline = time.monotonic() + max_wait
+    for delay in Poll_Delays(initial_delay, max_delay):
+        await asyncio.sleep(max(0, min(delay, deadline - time.monotonic())))
+        iteration = await asyncio.to_thread(throttle.call, 'custom-vision-training',
+                                           client.get_iteration, project_id, iteration_id)
+        print(iteration.status, '...')
+        if iteration.status in TERMINAL_STATUSES:
+            return Check_Iteration(iteration)
+        if time.monotonic() >= deadline:
+            raise TimeoutError('Training did not finish within {} seconds'.format(max_wait))
+
+def Check_Iteration(iteration):
+    """Return an iteration in a terminal state, or raise if its training failed."""
+    if iteration.status == "Failed":
+        raise RuntimeError('Training of iteration {} failed'.format(iteration.name))
+    return iteration
 
 
 if __name__ == "__main__":
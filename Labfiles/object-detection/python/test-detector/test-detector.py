@@ -1,15 +1,18 @@
-# Import Azure Custom Vision for making predictions on a trained model
-from azure.cognitiveservices.vision.customvision.prediction import CustomVisionPredictionClient
-# Import authentication credentials for API calls
-from msrest.authentication import ApiKeyCredentials
-# Import matplotlib for creating visualizations and displaying annotated images
-from matplotlib import pyplot as plt
-# Import PIL (Pillow) for image manipulation - Image for loading, ImageDraw for drawing boxes/annotations
-from PIL import Image, ImageDraw, ImageFont
-# Import NumPy for numerical operations (getting image dimensions)
-import numpy as np
 # Import os for system operations (clearing console, getting environment variables)
 import os
+# Import sys to locate the shared lab helpers
+import sys
+
+# Make the shared helpers in Labfiles/common/python importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'common', 'python'))
+# Import the shared client factory, which creates Azure clients with pooled keep-alive connections
+import clients
+# Import the shared annotation helpers, which draw boxes and labels on images with Pillow (PIL)
+import image_annotation
+# Import the shared preprocessing helpers, which can shrink images before upload (PREPROCESS_IMAGES=1)
+import image_preprocessing
+# Import the shared rate limiter, which keeps requests within the service quota and retries throttled ones
+import throttle
 
 def main():
     """
@@ -45,13 +48,10 @@ def main():
         # =============================================================================
         # STEP 2: AUTHENTICATE WITH AZURE CUSTOM VISION SERVICE
         # =============================================================================
-        # Create credentials object with the API key - this is used for all API requests
-        # The header "Prediction-key" tells Azure which API key to validate
-        credentials = ApiKeyCredentials(in_headers={"Prediction-key": prediction_key})
-        
-        # Initialize the prediction client with endpoint and credentials
+        # Initialize the prediction client with the endpoint and API key
+        # The key is sent in the "Prediction-key" header, which tells Azure which API key to validate
         # This client object will handle communication with the Azure Custom Vision service
-        prediction_client = CustomVisionPredictionClient(endpoint=prediction_endpoint, credentials=credentials)
+        prediction_client = clients.custom_vision_prediction_client(prediction_endpoint, prediction_key)
 
         # =============================================================================
         # STEP 3: LOAD IMAGE AND SEND TO MODEL FOR OBJECT DETECTION
@@ -60,12 +60,16 @@ def main():
         image_file = 'produce.jpg'
         print('Detecting objects in', image_file)
         
-        # Open the image file in binary read mode ('rb') - required for API transmission
-        # The 'with' statement ensures the file is properly closed after reading
-        with open(image_file, mode="rb") as image_data:
-            # Send the image to the Azure Custom Vision prediction service
-            # Returns a results object containing all detected objects and their confidence scores
-            results = prediction_client.detect_image(project_id, model_name, image_data)
+        # Read the image file as binary data - required for API transmission
+        # With preprocessing enabled, large photos are downsized and stripped of metadata first
+        # Bounding boxes are normalized (0.0 to 1.0), so they need no rescaling afterwards
+        prepared = image_preprocessing.prepare(image_file, 'custom-vision')
+
+        # Send the image to the Azure Custom Vision prediction service
+        # Returns a results object containing all detected objects and their confidence scores
+        # throttle.call() retries the request if the service responds 429 Too Many Requests
+        results = throttle.call('custom-vision-prediction', prediction_client.detect_image,
+                                project_id, model_name, prepared.data)
 
         # =============================================================================
         # STEP 4: PROCESS AND DISPLAY DETECTION RESULTS
@@ -101,38 +105,27 @@ def save_tagged_images(source_path, detected_objects):
     
     This function:
     1. Loads the image and gets its dimensions
-    2. Creates a visualization figure for display
-    3. Draws rectangles around each detected object (bounding boxes)
-    4. Adds labels with object names and confidence percentages
-    5. Saves the annotated image to a file
+    2. Draws rectangles around each detected object (bounding boxes)
+    3. Adds labels with object names and confidence percentages
+    4. Saves the annotated image to a file at its original resolution
     """
     
-    # Load the image using Pillow (PIL) and convert to NumPy array for dimension extraction
-    image = Image.open(source_path)
-    
-    # Get image dimensions: height (h), width (w), and channels (ch)
-    # np.array(image).shape returns (height, width, channels) for RGB images
-    h, w, ch = np.array(image).shape
+    # Load the image using Pillow (PIL)
+    image = image_annotation.load(source_path)
     
-    # Create a matplotlib figure for visualization
-    # figsize=(8, 8) creates an 8x8 inch figure
-    fig = plt.figure(figsize=(8, 8))
-    
-    # Turn off axis labels and tick marks for cleaner visualization
-    plt.axis('off')
-
-    # Create a drawing object to annotate the image
-    # ImageDraw allows us to draw shapes like lines and rectangles on the image
-    draw = ImageDraw.Draw(image)
+    # Get image dimensions: width (w) and height (h) in pixels
+    w, h = image.size
     
     # Calculate line width proportional to image width
     # Dividing by 100 ensures the border is visible but not overwhelming regardless of image size
-    lineWidth = int(w/100)
+    lineWidth = max(1, int(w/100))
     
     # Set the color for bounding boxes and labels
     color = 'magenta'
     
-    # Iterate through each detected object to draw its bounding box and label
+    # Collect the bounding box and label of each object to annotate
+    boxes = []
+    labels = []
     for detected_object in detected_objects:
         # Only show objects with a confidence > 50%
         # probability is a decimal (0.0 to 1.0), so multiply by 100 to get percentage
@@ -146,33 +139,21 @@ def save_tagged_images(source_path, detected_objects):
             height = detected_object.bounding_box.height * h
             width = detected_object.bounding_box.width * w
             
-            # Define the four corners of the bounding box rectangle
-            # Format: ((x1, y1), (x2, y2), (x3, y3), (x4, y4), (x1, y1))
-            # The last point closes the rectangle back to the starting point
-            points = (
-                (left, top),                          # Top-left corner
-                (left+width, top),                    # Top-right corner
-                (left+width, top+height),             # Bottom-right corner
-                (left, top+height),                   # Bottom-left corner
-                (left, top)                           # Close back to top-left
-            )
-            
-            # Draw the bounding box as a closed line/rectangle
-            draw.line(points, fill=color, width=lineWidth)
+            # Define the bounding box by its top-left and bottom-right corners
+            boxes.append((left, top, left+width, top+height))
             
             # Add text label above the bounding box with object name and confidence percentage
             # Format: "apple: 95.23%" (tag_name and probability formatted to 2 decimal places)
-            label_text = detected_object.tag_name + ": {0:.2f}%".format(detected_object.probability * 100)
-            plt.annotate(label_text, (left, top), backgroundcolor=color)
+            labels.append(detected_object.tag_name + ": {0:.2f}%".format(detected_object.probability * 100))
     
-    # Display the annotated image in the figure
-    plt.imshow(image)
+    # Draw the bounding boxes and their labels directly on the image
+    image_annotation.draw_boxes(image, boxes, color, width=lineWidth, labels=labels)
     
     # Define the output filename for the annotated image
     outputfile = 'output.jpg'
     
-    # Save the figure with annotations to a file
-    fig.savefig(outputfile)
+    # Save the annotated image to a file
+    image_annotation.save(image, outputfile)
     
     # Confirm to the user that the image has been saved
     print('Results saved in', outputfile)
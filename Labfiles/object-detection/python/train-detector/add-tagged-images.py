@@ -1,13 +1,23 @@
 # ===== IMPORTS =====
 # Azure Custom Vision SDK for training object detection models
-from azure.cognitiveservices.vision.customvision.training import CustomVisionTrainingClient
-# Models for creating image batches with tagged regions (for object detection)
-from azure.cognitiveservices.vision.customvision.training.models import ImageFileCreateBatch, ImageFileCreateEntry, Region
-# Authentication module for API key-based credentials
-from msrest.authentication import ApiKeyCredentials
-import time  # For handling delays if needed
+# Region model for describing the tagged bounding boxes (for object detection)
+from azure.cognitiveservices.vision.customvision.training.models import Region
 import json  # For parsing the tagged-images.json file
 import os   # For environment variables and file operations
+import sys  # For locating the shared lab helpers
+
+# Make the shared helpers in Labfiles/common/python importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'common', 'python'))
+# Creates Azure clients with pooled keep-alive connections
+import clients
+# Batched, concurrent uploads with retry
+from custom_vision_upload import UploadItem, upload_images
+# Tag name to tag ID lookup
+from tag_index import TagIndex
+# Record of images already uploaded, so re-runs skip them
+from upload_manifest import UploadManifest
+# Keeps requests within the service rate limit and retries throttled ones
+import throttle
 
 def main():
     """
@@ -46,18 +56,15 @@ def main():
         project_id = os.getenv('ProjectID')                # The Custom Vision project ID for object detection
 
         # ===== AUTHENTICATION =====
-        # Create authentication credentials using the training API key
-        # The key will be included in the "Training-key" header of all API requests
-        credentials = ApiKeyCredentials(in_headers={"Training-key": training_key})
-        
-        # Initialize the Custom Vision Training client
-        # This client provides methods to interact with the Custom Vision training service
-        training_client = CustomVisionTrainingClient(training_endpoint, credentials)
+        # Initialize the Custom Vision Training client with the training API key
+        # The key will be included in the "Training-key" header of all API requests, and
+        # the client keeps its connections open so concurrent uploads can reuse them
+        training_client = clients.custom_vision_training_client(training_endpoint, training_key)
 
         # ===== RETRIEVE PROJECT =====
         # Fetch the Custom Vision project from Azure using its ID
         # The project contains all tags and images for this object detection model
-        custom_vision_project = training_client.get_project(project_id)
+        custom_vision_project = throttle.call('custom-vision-training', training_client.get_project, project_id)
 
         # ===== UPLOAD IMAGES =====
         # Call the Upload_Images function to upload and tag all images from the 'images' folder
@@ -73,14 +80,28 @@ def Upload_Images(folder):
     Upload images with object detection tags to the Custom Vision project.
     
     This function:
-    1. Reads tag definitions from the Custom Vision project
-    2. Loads image metadata and bounding box coordinates from tagged-images.json
-    3. Creates batch entries for each image with its regions (bounding boxes)
-    4. Uploads the entire batch to Azure Custom Vision
+    1. Indexes the project's tags by name
+    2. Streams image metadata and bounding box coordinates from tagged-images.json,
+       one image at a time, skipping entries with invalid regions
+    3. Describes each image and its regions (bounding boxes) without reading the image yet,
+       creating any tags the JSON uses that the project doesn't have
+    4. Uploads the images in chunks, several chunks at a time, retrying chunks that fail
+    
+    Neither the JSON file nor the image files are loaded all at once: the first chunk
+    is uploaded while the rest of tagged-images.json is still being read, and peak
+    memory depends on the chunk size and concurrency rather than on the dataset size.
+    
+    Uploaded images are recorded in upload-manifest.db next to this script, keyed by
+    their content hash and regions. Re-running the script skips images that are already
+    in the project, and an interrupted run picks up after the last completed chunk.
     
     Parameters:
     - folder (str): Path to the folder containing the image files to upload
     
+    Optional .env settings:
+    - UploadBatchSize: Images per upload request (default and maximum 64)
+    - UploadConcurrency: Number of chunks uploaded at the same time (default 4)
+    
     Expected JSON format in tagged-images.json:
     {
         "files": [
@@ -102,24 +123,18 @@ def Upload_Images(folder):
     print("Uploading images...")
 
     # ===== GET PROJECT TAGS =====
-    # Retrieve all tag definitions from the Custom Vision project
+    # Index the tag definitions from the Custom Vision project by name
     # Tags are the object categories we want to detect (e.g., "cat", "dog", "bird")
     # Each tag has a unique ID that we'll use when marking regions in images
-    tags = training_client.get_tags(custom_vision_project.id)
-
-    # ===== INITIALIZE IMAGE BATCH =====
-    # Create an empty list to store image entries with their tagged regions
-    # Each entry will contain an image and its bounding box coordinates for each detected object
-    tagged_images_with_regions = []
-
-    # ===== LOAD TAGGED IMAGES FROM JSON =====
-    # Open and parse the JSON file containing image metadata and tag information
-    # This JSON file maps each image to the objects it contains and their locations
-    with open('tagged-images.json', 'r') as json_file:
-        tagged_images = json.load(json_file)
+    tags = TagIndex(training_client, custom_vision_project.id)
+
+    def tagged_images_with_regions():
+        # Generator that yields one upload item per image in the JSON file
+        # The image file itself is read later, when its chunk is uploaded
         
-        # Process each image in the JSON file
-        for image in tagged_images['files']:
+        # ===== STREAM TAGGED IMAGES FROM JSON =====
+        # Read tagged-images.json incrementally, one entry of the "files" array at a time
+        for image in Read_Tagged_Images('tagged-images.json'):
             # ===== EXTRACT IMAGE FILENAME =====
             # Get the filename of the image from the JSON
             file = image['filename']
@@ -136,8 +151,9 @@ def Upload_Images(folder):
                 # ===== LOOK UP TAG ID =====
                 # Find the tag ID that corresponds to this tag name
                 # Tag IDs are needed because the Azure API uses IDs, not names
-                # The 'next()' function searches through the tags list to find a match
-                tag_id = next(t for t in tags if t.name == tag_name).id
+                # The tag index is a dictionary, so this is a single lookup rather than a search
+                # A tag the project doesn't have yet is created the first time it is seen
+                tag_id = tags.id_for(tag_name)
                 
                 # ===== CREATE REGION OBJECT =====
                 # Create a Region object representing the bounding box for this detected object
@@ -150,34 +166,157 @@ def Upload_Images(folder):
                                      width=tag['width'],    # Width of bounding box (0.0 to 1.0)
                                      height=tag['height'])) # Height of bounding box (0.0 to 1.0)
             
-            # ===== ADD IMAGE TO BATCH =====
-            # Read the image file as binary data and create an ImageFileCreateEntry
-            # This entry contains the image data and all its tagged regions
-            with open(os.path.join(folder, file), mode="rb") as image_data:
-                tagged_images_with_regions.append(ImageFileCreateEntry(name=file, 
-                                                                        contents=image_data.read(), 
-                                                                        regions=regions))
-
-    # ===== UPLOAD BATCH =====
-    # Send all the images with their tagged regions to the Custom Vision service as a batch
-    # This is more efficient than uploading images one at a time
-    # The API processes the batch and returns status information for each image
-    upload_result = training_client.create_images_from_files(custom_vision_project.id, 
-                                                             ImageFileCreateBatch(images=tagged_images_with_regions))
+            # ===== ADD IMAGE TO UPLOAD =====
+            # Describe the image file and all its tagged regions
+            yield UploadItem(name=file, path=os.path.join(folder, file), regions=regions)
+
+    # ===== UPLOAD IN CHUNKS =====
+    # Send the images to the Custom Vision service in chunks of up to 64 images
+    # Several chunks are uploaded at once, and chunks that fail are retried
+    with UploadManifest(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'upload-manifest.db')) as manifest:
+        # Skip images whose content and labels were already uploaded to this project,
+        # and record each chunk as soon as the service accepts it
+        summary = upload_images(training_client, custom_vision_project.id,
+                                manifest.pending(custom_vision_project.id, tagged_images_with_regions()),
+                                on_uploaded=lambda items: manifest.record(custom_vision_project.id, items),
+                                batch_size=int(os.getenv('UploadBatchSize') or 64),
+                                max_workers=int(os.getenv('UploadConcurrency') or 4))
+        skipped = manifest.skipped
     
     # ===== CHECK UPLOAD STATUS =====
-    # Verify whether the batch upload was successful
-    # If any images failed to upload, we'll print detailed error information
-    if not upload_result.is_batch_successful:
-        # If the batch was not completely successful, print a failure message
-        print("Image batch upload failed.")
-        # Loop through each image in the result to show the status of individual uploads
-        for image in upload_result.images:
-            # Print the status of each image (e.g., "Success", "BadRequest", "Conflict")
-            print("Image status: ", image.status)
+    # Report the outcome, including the status of any images that failed to upload
+    if summary.failed:
+        print("Image upload incomplete:", summary)
+        for item, reason in summary.failed:
+            # Print the status of each failed image (e.g., "ErrorImageFormat", or the error message)
+            print("Image status: ", item.name, reason)
     else:
-        # If the batch was completely successful, print a success message
-        print("Images uploaded.")
+        print("Images uploaded:", summary)
+    print("Already uploaded in an earlier run (skipped):", skipped)
+
+# Largest entry (in characters) read from tagged-images.json before giving up on it
+MAX_ENTRY_SIZE = 1024 * 1024
+
+def Read_Tagged_Images(json_path, read_size=64 * 1024, max_entry_size=MAX_ENTRY_SIZE):
+    """
+    Incrementally parse tagged-images.json, yielding one entry of its "files" array at a time.
+    
+    The file is read in blocks of read_size characters, and each complete entry is
+    decoded as soon as its closing brace has been read, so only one entry (plus one
+    block of text) is held in memory however large the file is. Entries with missing
+    fields or invalid bounding boxes are reported and skipped. Only the "files" array
+    of the top-level object is read (other top-level values are skipped over).
+    
+    Parameters:
+    - json_path (str): Path to the JSON file
+    - read_size (int): Number of characters to read from the file at a time
+    - max_entry_size (int): Largest value, in characters, to hold in memory
+    
+    Yields:
+    - dict: One image entry, with "filename" and "tags" keys
+    
+    Raises:
+    - ValueError: If the file isn't valid JSON, has no top-level "files" array, or has
+      a value larger than max_entry_size
+    """
+    decoder = json.JSONDecoder()
+    with open(json_path, 'r') as json_file:
+
+        def fill(buffer, skip=' \t\r\n'):
+            # Drop the separators at the start of the buffer, reading until there's more to parse
+            buffer = buffer.lstrip(skip)
+            while not buffer:
+                block = json_file.read(read_size)
+                if not block:
+                    raise ValueError('{} ends before the end of the "files" array'.format(json_path))
+                buffer = block.lstrip(skip)
+            return buffer
+
+        def decode(buffer, what):
+            # Decode the JSON value at the start of the buffer, reading more blocks until it's complete
+            while True:
+                complete = False
+                try:
+                    value, end = decoder.raw_decode(buffer)
+                    # A value that ends with the buffer (such as a number) may continue in the next block
+                    if buffer[end:].strip():
+                        return value, buffer[end:]
+                    complete = True
+                except json.JSONDecodeError as ex:
+                    # Only an error near the end of the buffer (or in a string still being read)
+                    # can be fixed by reading more: anything else is a mistake in the file
+                    if not (ex.msg.startswith('Unterminated string') or ex.pos >= len(buffer) - 8):
+                        raise ValueError('{} is not valid JSON ({}): {}'.format(json_path, what, ex)) from None
+                if len(buffer) > max_entry_size:
+                    raise ValueError('{} in {} is larger than {} characters'.format(what, json_path, max_entry_size))
+                block = json_file.read(read_size)
+                if not block:
+                    if complete:
+                        return value, ''
+                    raise ValueError('{} ends in the middle of {}'.format(json_path, what))
+                buffer += block
+
+        # ===== FIND THE TOP-LEVEL "files" ARRAY =====
+        # Walk the keys of the top-level object, skipping the values before "files"
+        buffer = fill('')
+        if not buffer.startswith('{'):
+            raise ValueError('{} must contain a JSON object'.format(json_path))
+        buffer = buffer[1:]
+        while True:
+            buffer = fill(buffer, ' \t\r\n,')
+            if buffer.startswith('}'):
+                raise ValueError('No "files" array found in {}'.format(json_path))
+            key, buffer = decode(buffer, 'a top-level key')
+            buffer = fill(buffer)
+            if not buffer.startswith(':'):
+                raise ValueError('{} is not valid JSON (expected ":" after "{}")'.format(json_path, key))
+            buffer = fill(buffer[1:])
+            if key == 'files' and buffer.startswith('['):
+                buffer = buffer[1:]
+                break
+            _, buffer = decode(buffer, 'the "{}" value'.format(key))
+
+        # ===== DECODE ONE ENTRY AT A TIME =====
+        entry_number = 0
+        while True:
+            # Skip the whitespace and commas between entries
+            buffer = fill(buffer, ' \t\r\n,')
+            if buffer.startswith(']'):
+                return
+            entry, buffer = decode(buffer, 'entry {}'.format(entry_number + 1))
+            entry_number += 1
+
+            # ===== VALIDATE THE ENTRY =====
+            problems = Validate_Tagged_Image(entry)
+            if problems:
+                print('Skipping entry {} ({}): {}'.format(entry_number, entry.get('filename') if isinstance(entry, dict) else entry,
+                                                          '; '.join(problems)))
+                continue
+            yield entry
+
+def Validate_Tagged_Image(entry):
+    """
+    Check one tagged-images.json entry, returning a list of problems (empty if it is valid).
+    
+    Bounding boxes must use normalized coordinates: left and top from 0.0 to 1.0,
+    width and height greater than 0.0, and the box must fit inside the image.
+    """
+    if not isinstance(entry, dict) or 'filename' not in entry or not isinstance(entry.get('tags'), list):
+        return ['entry must have a "filename" and a "tags" list']
+
+    problems = []
+    tolerance = 1e-6  # Allow for rounding in the exported coordinates
+    for number, tag in enumerate(entry['tags'], 1):
+        try:
+            left, top, width, height = (float(tag[key]) for key in ('left', 'top', 'width', 'height'))
+            name = tag['tag']
+        except (KeyError, TypeError, ValueError):
+            problems.append('region {} must have a tag, left, top, width and height'.format(number))
+            continue
+        if not (0 <= left <= 1 and 0 <= top <= 1 and width > 0 and height > 0
+                and left + width <= 1 + tolerance and top + height <= 1 + tolerance):
+            problems.append('region {} ({}) is not a normalized box inside the image'.format(number, name))
+    return problems
 
 if __name__ == "__main__":
     """
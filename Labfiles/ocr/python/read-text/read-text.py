@@ -1,15 +1,27 @@
 # Import required libraries for environment variable management, system operations, and image processing
 from dotenv import load_dotenv  # Load environment variables from .env file
 import os  # Operating system operations (console clearing, environment variable access)
-import time  # Time module (currently imported but not used)
 import sys  # System-specific parameters and functions (command line argument handling)
-from PIL import Image, ImageDraw  # PIL/Pillow for image manipulation and drawing
-from matplotlib import pyplot as plt  # Matplotlib for image visualization and saving
+import json  # Writes the extracted text as JSON Lines
+from array import array  # Compact typed arrays for the extracted word and line columns
+import io  # In-memory buffers for encoding image tiles
+from concurrent.futures import ThreadPoolExecutor  # Saves the annotated images in parallel
 
 # Import Azure AI Vision libraries for optical character recognition (OCR)
-from azure.ai.vision.imageanalysis import ImageAnalysisClient  # Main client for Azure AI Vision
 from azure.ai.vision.imageanalysis.models import VisualFeatures  # Enum for selecting analysis features
-from azure.core.credentials import AzureKeyCredential  # Credentials handler for Azure API key authentication
+
+# Azure AI Vision accepts image files up to 20 MB
+MAX_IMAGE_BYTES = 20 * 1024 * 1024
+
+# Pillow's limit on the pixels in a page, raised for large scans (see read_pages)
+MAX_PAGE_PIXELS = 500_000_000
+
+# Make the shared helpers in Labfiles/common/python importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'common', 'python'))
+from analysis_cache import AnalysisCache  # On-disk cache of analysis results, so repeated images cost nothing
+import clients  # Creates Azure clients with pooled keep-alive connections
+import image_annotation  # Draws bounding polygons on images with PIL and saves them at native resolution
+import image_preprocessing  # Optionally shrinks images before upload (PREPROCESS_IMAGES=1)
 
 
 def main():
@@ -48,172 +60,416 @@ def main():
         # This client will be used to send image analysis requests to the Azure service
         # Parameters:
         #   - endpoint: The base URL of your Azure AI Vision resource
-        #   - credential: The API key wrapped in AzureKeyCredential for authentication
-        cv_client = ImageAnalysisClient(
-            endpoint=ai_endpoint,
-            credential=AzureKeyCredential(ai_key))
-        
-        # Read and prepare the image file for analysis
-        # Open the image file in binary read mode ('rb') to get raw bytes
-        with open(image_file, "rb") as f:
-            image_data = f.read()
+        #   - key: The API key used to authenticate each request
+        # The client keeps its connections open, so the tiles of a large scan share them
+        cv_client = clients.image_analysis_client(ai_endpoint, ai_key)
         
         # Inform the user which image is being processed
         print (f"\nReading text in {image_file}")
 
         # Send the image to Azure AI Vision service for text recognition (OCR)
-        # Parameters:
-        #   - image_data: The binary image data to analyze
-        #   - visual_features: List of analysis features to perform (only READ/OCR in this case)
-        # The READ feature performs Optical Character Recognition (OCR) on the image
-        result = cv_client.analyze(
-            image_data=image_data,
-            visual_features=[VisualFeatures.READ])
-
-        # Extract and display the recognized text lines from the analysis result
-        # Check if the READ result contains data (text was successfully detected)
-        if result.read is not None:
+        # Small single-page images are sent as they are; large scans and multi-page
+        # images are split into overlapping tiles that are read concurrently
+        # The cache returns the stored result if this exact image (or tile) was read before,
+        # and only calls the service (and stores its result) when it wasn't
+        # The result is one document of extracted text per page (None if no text was read)
+        pages = read_pages(cv_client, AnalysisCache(), image_file)
+
+        for page_number, document in enumerate(pages):
+            # Check if the READ result contains data (text was successfully detected)
+            if document is None:
+                continue
+
+            # Multi-page images get a page number in their output filenames
+            page_suffix = f'-page{page_number + 1}' if len(pages) > 1 else ''
+            if page_suffix:
+                print(f"\nPage {page_number + 1}")
+
+            # Append the extracted text to text.jsonl for downstream indexing
+            write_jsonl(image_file, document, 'text.jsonl', page_number)
+
             print("\nText:")
             
-            # Iterate through each line of text detected in the image
-            # result.read.blocks[0] gets the first text block
-            # .lines contains all the detected text lines within that block
-            for line in result.read.blocks[0].lines:
-                print(f" {line.text}")  # Print each complete line of text        
-            # Draw bounding boxes around detected text lines on the image
-            # This creates a visual annotation showing where text was found
-            annotate_lines(image_file, result.read)
-
-            # Extract and display individual words along with their confidence scores
+            # Print each complete line of text, from all the text blocks
+            lines = document['lines']
+            for offset, length in zip(lines['offset'], lines['length']):
+                print(f" {document['text'][offset:offset + length]}")
+
+            # Display individual words along with their confidence scores
             # This provides more granular detail about what was recognized
             print ("\nIndividual words:")
+            words = document['words']
+            for offset, length, confidence in zip(words['offset'], words['length'], words['confidence']):
+                # Print each word and its confidence score (0.00 to 1.00, shown as percentage)
+                # Higher confidence indicates the OCR engine is more certain about the recognition
+                print(f"  {document['text'][offset:offset + length]} (Confidence: {confidence:.2f}%)")
             
-            # Iterate through each detected line
-            for line in result.read.blocks[0].lines:
-                # Iterate through each word within the line
-                for word in line.words:
-                    # Print each word and its confidence score (0.00 to 1.00, shown as percentage)
-                    # Higher confidence indicates the OCR engine is more certain about the recognition
-                    print(f"  {word.text} (Confidence: {word.confidence:.2f}%)")
-            
-            # Draw bounding boxes around individual detected words on the image
-            # This creates a more detailed visual annotation at the word level
-            annotate_words(image_file, result.read)
+            # Draw bounding boxes around the detected text lines and individual words
+            # This creates visual annotations showing where text was found, at line and word level
+            # Set OCR_COMBINED_LAYER=1 to also save both layers drawn on one image
+            annotate_text(image_file, document, combined=os.getenv('OCR_COMBINED_LAYER') == '1',
+                          page=page_number, suffix=page_suffix)
 
     except Exception as ex:
         # Catch and print any errors that occur during execution
         # This could include authentication errors, file not found, network issues, etc.
         print(ex)
 
-def annotate_lines(image_file, detected_text):
+def extract_text(detected_text):
     """
-    Create a visual annotation of detected text lines by drawing bounding polygons.
+    Flatten an OCR read result into a compact columnar structure.
     
-    Args:
-        image_file: Path to the original image file
-        detected_text: The read result from Azure AI Vision containing detected lines
-    """
-    print(f'\nAnnotating lines of text in image...')
-
-    # Load the original image file for annotation
-    image = Image.open(image_file)
-    
-    # Create a matplotlib figure with dimensions matching the image (converted from pixels to inches at 100 DPI)
-    fig = plt.figure(figsize=(image.width/100, image.height/100))
+    Every block, line and word is walked once. The text of all the lines is joined
+    (one line per row) into a single string, and each line and word is described by
+    entries in flat typed arrays instead of per-word SDK objects:
     
-    # Hide the axis labels and ticks for a cleaner image output
-    plt.axis('off')
+        {
+            'text': 'all line text, separated by newlines',
+            'lines': {'offset', 'length', 'block', 'polygon'},
+            'words': {'offset', 'length', 'line', 'confidence', 'polygon'}
+        }
     
-    # Create a drawing context to add annotations to the image
-    draw = ImageDraw.Draw(image)
+    offset/length locate the line or word in 'text' (a word that can't be found in its
+    line's text has offset -1 and length 0), 'block' and 'line' are row numbers of the
+    containing block and line, and 'polygon' holds 8 numbers (4 x, y points) per row.
     
-    # Set the color for the bounding box outlines (cyan = light blue)
-    color = 'cyan'
+    Args:
+        detected_text: The read result from Azure AI Vision
+    """
+    document = empty_document()
+    lines, words = document['lines'], document['words']
+    text = []
+    position = 0
 
-    # Iterate through each detected text line
-    for line in detected_text.blocks[0].lines:
-        # Extract the bounding polygon coordinates for this line
-        # A bounding polygon is defined by 4 corner points (x, y coordinates)
-        r = line.bounding_polygon
-        
-        # Convert the polygon points to a tuple format expected by PIL's draw.polygon()
-        # Each point is extracted as (x, y) coordinate pair
-        rectangle = ((r[0].x, r[0].y),(r[1].x, r[1].y),(r[2].x, r[2].y),(r[3].x, r[3].y))
-        
-        # Draw the bounding polygon on the image
-        # Parameters: polygon outline color, line width of 3 pixels
-        draw.polygon(rectangle, outline=color, width=3)
+    for block_number, block in enumerate(detected_text.blocks):
+        for line in block.lines:
+            line_number = len(lines['offset'])
+            lines['offset'].append(position)
+            lines['length'].append(len(line.text))
+            lines['block'].append(block_number)
+            lines['polygon'].extend(polygon_coordinates(line.bounding_polygon))
 
-    # Display the annotated image
-    plt.imshow(image)
-    
-    # Remove extra padding around the image
-    plt.tight_layout(pad=0)
-    
-    # Set the output filename for the annotated image
-    textfile = 'lines.jpg'
+            # Locate each word in the line text, searching forward from the previous word
+            cursor = 0
+            for word in line.words:
+                found = line.text.find(word.text, cursor)
+                if found < 0:
+                    words['offset'].append(-1)
+                    words['length'].append(0)
+                else:
+                    words['offset'].append(position + found)
+                    words['length'].append(len(word.text))
+                    cursor = found + len(word.text)
+                words['line'].append(line_number)
+                words['confidence'].append(word.confidence)
+                words['polygon'].extend(polygon_coordinates(word.bounding_polygon))
+
+            text.append(line.text)
+            position += len(line.text) + 1
+
+    document['text'] = '\n'.join(text)
+    return document
+
+def empty_document():
+    """Return a document with no text and empty line and word columns."""
+    return {
+        'text': '',
+        'lines': {'offset': array('l'), 'length': array('l'), 'block': array('l'), 'polygon': array('f')},
+        'words': {'offset': array('l'), 'length': array('l'), 'line': array('l'),
+                  'confidence': array('f'), 'polygon': array('f')},
+    }
+
+def polygon_coordinates(bounding_polygon):
+    """Return the first 4 points of a bounding polygon as 8 flat x, y numbers."""
+    coordinates = []
+    for point in bounding_polygon[:4]:
+        coordinates.extend((point.x, point.y))
+    # Pad polygons with fewer than 4 points by repeating the last point
+    while len(coordinates) < 8:
+        coordinates.extend(coordinates[-2:] or (0, 0))
+    return coordinates
+
+def polygons(columns):
+    """Return the polygons of a lines or words column set as lists of 4 (x, y) points."""
+    flat = columns['polygon']
+    return [[(flat[i], flat[i + 1]), (flat[i + 2], flat[i + 3]), (flat[i + 4], flat[i + 5]), (flat[i + 6], flat[i + 7])]
+            for i in range(0, len(flat), 8)]
+
+def document_record(image_file, document, page=0):
+    """Return an extracted document as a JSON-serializable dict, with its columns as plain lists."""
+    return {
+        'image': image_file,
+        'page': page,
+        'text': document['text'],
+        'lines': dict((name, column.tolist()) for name, column in document['lines'].items()),
+        'words': dict((name, column.tolist()) for name, column in document['words'].items()),
+    }
+
+def write_jsonl(image_file, document, output_file, page=0):
+    """
+    Append an extracted document to a JSON Lines file, one image per line.
     
-    # Save the annotated image to disk
-    fig.savefig(textfile)
+    The columns are written as plain lists, so each line can be loaded straight into
+    arrays (or a dataframe) without creating an object per word.
+    """
+    record = document_record(image_file, document, page)
+    with open(output_file, 'a', encoding='utf-8') as jsonl_file:
+        jsonl_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+    print('\nExtracted text saved in', output_file)
+
+def read_pages(cv_client, cache, image_file, quiet=False):
+    """
+    Read the text on every page of an image file, tiling pages that are too large.
     
-    # Inform the user where the results were saved
-    print('  Results saved in', textfile)
+    A single-page image that is within the tile size and the service's file size limit
+    is sent as it is. Otherwise each page (frame) is cut into overlapping tiles of at
+    most OCR_TILE_SIZE pixels (default 4096) per side, overlapping by OCR_TILE_OVERLAP
+    pixels (default 200). The tiles are read concurrently (OCR_CONCURRENCY, default 4),
+    their word polygons are mapped back to page coordinates, and text read twice in the
+    overlap between tiles is kept only once. The size and tile count of each tiled page
+    is printed, unless quiet is True.
     
-def annotate_words(image_file, detected_text):
+    Returns:
+        list: One extracted document (see extract_text) per page, or None for a page with no text
     """
-    Create a visual annotation of detected individual words by drawing bounding polygons.
-    This provides more granular detail than line-level annotation.
+    tile_size = int(os.getenv('OCR_TILE_SIZE') or 4096)
+    overlap = int(os.getenv('OCR_TILE_OVERLAP') or 200)
+    workers = int(os.getenv('OCR_CONCURRENCY') or 4)
+    if tile_size <= 0 or not 0 <= overlap < tile_size:
+        # Tiles advance by tile_size - overlap pixels, so anything else would never finish the page
+        raise ValueError(f'OCR_TILE_OVERLAP ({overlap}) must be at least 0 and less than '
+                         f'OCR_TILE_SIZE ({tile_size})')
+
+    # Pillow is imported here rather than at the top of the script, so it's only loaded
+    # when it's needed (it reads image sizes and pages, and cuts large pages into tiles)
+    from PIL import Image
+
+    # Pillow warns about images over about 89 million pixels and refuses those over twice
+    # that, to guard against "decompression bombs". Very large scans are what tiling is for,
+    # so the limit is raised on purpose: pages over MAX_PAGE_PIXELS give a warning, and
+    # pages over twice that are still refused. (The setting applies to the whole process.)
+    if Image.MAX_IMAGE_PIXELS is not None and Image.MAX_IMAGE_PIXELS < MAX_PAGE_PIXELS:
+        Image.MAX_IMAGE_PIXELS = MAX_PAGE_PIXELS
+
+    # Image.open() only reads the header here, so this is cheap even for huge files
+    with Image.open(image_file) as image:
+        page_count = getattr(image, 'n_frames', 1)
+        width, height = image.size
+
+    if page_count == 1 and max(width, height) <= tile_size and os.path.getsize(image_file) <= MAX_IMAGE_BYTES:
+        # Read and prepare the image file for analysis
+        # With preprocessing enabled, the image is re-encoded (and downsized if needed) first,
+        # and the text polygons are mapped back to the original image afterwards
+        prepared = image_preprocessing.prepare(image_file, 'ocr')
+        result = cache.analyze(cv_client, image_data=prepared.data, visual_features=[VisualFeatures.READ])
+        image_preprocessing.rescale_analysis(result, prepared)
+        return [extract_text(result.read) if result.read is not None else None]
+
+    pages = []
+    with Image.open(image_file) as image, ThreadPoolExecutor(max_workers=workers) as executor:
+        for page_number in range(page_count):
+            image.seek(page_number)
+            page = image.convert('RGB')
+            tiles = page_tiles(page.width, page.height, tile_size, overlap)
+            if not quiet:
+                print(f'  Page {page_number + 1}: {page.width} x {page.height}, {len(tiles)} tiles')
+
+            def read_tile(tile):
+                box, core = tile
+                image_data = encode_tile(page.crop(box))
+                result = cache.analyze(cv_client, image_data=image_data, visual_features=[VisualFeatures.READ])
+                return extract_text(result.read) if result.read is not None else None, box, core
+
+            pages.append(merge_tiles(executor.map(read_tile, tiles)))
+    return pages
+
+def encode_tile(tile):
+    """
+    Encode a tile (a PIL image) for upload, within the service's file size limit.
     
-    Args:
-        image_file: Path to the original image file
-        detected_text: The read result from Azure AI Vision containing detected words
+    Tiles are encoded losslessly as PNG so small text isn't blurred by compression. A
+    detailed color scan can make a PNG tile larger than MAX_IMAGE_BYTES, in which case
+    it is encoded as JPEG instead, lowering the quality until it fits.
     """
-    print(f'\nAnnotating individual words in image...')
+    buffer = io.BytesIO()
+    tile.save(buffer, format='PNG')
+    if buffer.tell() <= MAX_IMAGE_BYTES:
+        return buffer.getvalue()
+    for quality in (95, 90, 80, 70, 60):
+        buffer = io.BytesIO()
+        tile.save(buffer, format='JPEG', quality=quality)
+        if buffer.tell() <= MAX_IMAGE_BYTES:
+            return buffer.getvalue()
+    raise ValueError(f'A {tile.width} x {tile.height} tile is over {MAX_IMAGE_BYTES} bytes even as JPEG; '
+                     'set a smaller OCR_TILE_SIZE')
 
-    # Load the original image file for annotation
-    image = Image.open(image_file)
+def page_tiles(width, height, tile_size, overlap):
+    """
+    Split a page into overlapping tiles.
     
-    # Create a matplotlib figure with dimensions matching the image (converted from pixels to inches at 100 DPI)
-    fig = plt.figure(figsize=(image.width/100, image.height/100))
+    Returns a list of (box, core) pairs. box is the (left, top, right, bottom) area to
+    crop. core is the part of the page this tile is responsible for: the seam between
+    two tiles runs through the middle of their overlap, so every point of the page
+    belongs to exactly one tile's core.
+    """
+    def spans(length):
+        if length <= tile_size:
+            return [(0, length, 0, length)]
+        step = tile_size - overlap
+        # The last tile is aligned to the edge, so every tile is full size
+        starts = list(range(0, length - tile_size, step)) + [length - tile_size]
+        result = []
+        for index, start in enumerate(starts):
+            core_start = 0 if index == 0 else (start + starts[index - 1] + tile_size) / 2
+            core_end = length if index == len(starts) - 1 else (starts[index + 1] + start + tile_size) / 2
+            result.append((start, start + tile_size, core_start, core_end))
+        return result
+
+    tiles = []
+    for top, bottom, core_top, core_bottom in spans(height):
+        for left, right, core_left, core_right in spans(width):
+            tiles.append(((left, top, right, bottom), (core_left, core_top, core_right, core_bottom)))
+    return tiles
+
+def merge_tiles(tile_results):
+    """
+    Merge the extracted text of a page's tiles into one document in page coordinates.
     
-    # Hide the axis labels and ticks for a cleaner image output
-    plt.axis('off')
+    Each word is kept only by the tile whose core contains the word's center, which
+    removes the duplicates read in the overlap between tiles. A line that crosses a seam
+    is read by both tiles; each tile keeps the fragment holding its own words (the line's
+    text and polygon are cut down to those words), and a fragment left with no words is
+    dropped. A line with no words at all is kept by the tile whose core contains its center.
     
-    # Create a drawing context to add annotations to the image
-    draw = ImageDraw.Draw(image)
+    Args:
+        tile_results: Iterable of (document, box, core) tuples from read_tile
     
-    # Set the color for the bounding box outlines (cyan = light blue)
-    color = 'cyan'
+    Returns:
+        dict: A document with the same columns as extract_text, or None if no text was read
+    """
+    merged = empty_document()
+    text = []
+    position = 0
+    found_text = False
 
-    # Nested loop: Iterate through each detected line, then each word within that line
-    for line in detected_text.blocks[0].lines:
-        for word in line.words:
-            # Extract the bounding polygon coordinates for this word
-            # A bounding polygon is defined by 4 corner points (x, y coordinates)
-            r = word.bounding_polygon
-            
-            # Convert the polygon points to a tuple format expected by PIL's draw.polygon()
-            # Each point is extracted as (x, y) coordinate pair
-            rectangle = ((r[0].x, r[0].y),(r[1].x, r[1].y),(r[2].x, r[2].y),(r[3].x, r[3].y))
-            
-            # Draw the bounding polygon on the image around each word
-            # Parameters: polygon outline color, line width of 3 pixels
-            draw.polygon(rectangle, outline=color, width=3)
+    def in_core(polygon, left, top, core):
+        center_x = left + sum(polygon[0::2]) / 4
+        center_y = top + sum(polygon[1::2]) / 4
+        return core[0] <= center_x < core[2] and core[1] <= center_y < core[3]
 
-    # Display the annotated image
-    plt.imshow(image)
-    
-    # Remove extra padding around the image
-    plt.tight_layout(pad=0)
+    for document, box, core in tile_results:
+        if document is None:
+            continue
+        found_text = True
+        left, top = box[0], box[1]
+        lines, words = document['lines'], document['words']
+        word_index = 0
+        block_offset = (merged['lines']['block'][-1] + 1) if len(merged['lines']['block']) else 0
+
+        for line_number in range(len(lines['offset'])):
+            polygon = lines['polygon'][line_number * 8:line_number * 8 + 8]
+            line_offset = lines['offset'][line_number]
+            line_text = document['text'][line_offset:line_offset + lines['length'][line_number]]
+
+            # Words are stored in line order, so the words of this line come next
+            line_words = []
+            while word_index < len(words['line']) and words['line'][word_index] == line_number:
+                line_words.append(word_index)
+                word_index += 1
+            kept = [word for word in line_words if in_core(words['polygon'][word * 8:word * 8 + 8], left, top, core)]
+
+            if not line_words:
+                if not in_core(polygon, left, top, core):
+                    continue
+            elif not kept:
+                continue
+            elif len(kept) < len(line_words):
+                # Only part of the line is this tile's: cut its text and polygon down to the kept words
+                located = [word for word in kept if words['offset'][word] >= 0]
+                if located:
+                    text_start = min(words['offset'][word] for word in located)
+                    text_end = max(words['offset'][word] + words['length'][word] for word in located)
+                else:
+                    text_start = text_end = line_offset
+                line_text = document['text'][text_start:text_end]
+                line_offset = text_start
+                xs = [x for word in kept for x in words['polygon'][word * 8:word * 8 + 8:2]]
+                ys = [y for word in kept for y in words['polygon'][word * 8 + 1:word * 8 + 8:2]]
+                polygon = [min(xs), min(ys), max(xs), min(ys), max(xs), max(ys), min(xs), max(ys)]
+
+            new_line_number = len(merged['lines']['offset'])
+            merged['lines']['offset'].append(position)
+            merged['lines']['length'].append(len(line_text))
+            merged['lines']['block'].append(block_offset + lines['block'][line_number])
+            merged['lines']['polygon'].extend(shift_polygon(polygon, left, top))
+
+            for word in kept:
+                offset = words['offset'][word]
+                merged['words']['offset'].append(position + offset - line_offset if offset >= 0 else -1)
+                merged['words']['length'].append(words['length'][word])
+                merged['words']['line'].append(new_line_number)
+                merged['words']['confidence'].append(words['confidence'][word])
+                merged['words']['polygon'].extend(shift_polygon(words['polygon'][word * 8:word * 8 + 8], left, top))
+
+            text.append(line_text)
+            position += len(line_text) + 1
+
+    if not found_text:
+        return None
+    merged['text'] = '\n'.join(text)
+    return merged
+
+def shift_polygon(polygon, left, top):
+    """Move 8 flat x, y polygon coordinates from tile coordinates to page coordinates."""
+    return [value + (left if index % 2 == 0 else top) for index, value in enumerate(polygon)]
+
+def annotate_text(image_file, document, combined=False, page=0, suffix=''):
+    """
+    Create visual annotations of the detected text lines and individual words.
     
-    # Set the output filename for the annotated image
-    textfile = 'words.jpg'
+    The image is decoded once, and the line and word polygons come straight from the
+    extracted document columns. Each overlay is drawn on a copy of the decoded pixels,
+    and the annotated images are encoded and saved in parallel.
     
-    # Save the annotated image to disk
-    fig.savefig(textfile)
+    Args:
+        image_file: Path to the original image file
+        document: The extracted text columns returned by extract_text
+        combined: Also save an image with both the line and word polygons drawn on it
+        page: The page (frame) of a multi-page image to annotate
+        suffix: Text added to the output filenames, such as '-page2'
     
+    Output files:
+        lines.jpg (line polygons), words.jpg (word polygons) and, if combined, text.jpg
+    """
+    print(f'\nAnnotating lines of text and individual words in image...')
+
+    # Load (decode) the original image file (or page) once
+    image = image_annotation.load(image_file, page)
+
+    # Get the bounding polygons of every line and word, from all the text blocks
+    # A bounding polygon is defined by 4 corner points (x, y coordinates)
+    line_polygons = polygons(document['lines'])
+    word_polygons = polygons(document['words'])
+
+    # Draw each overlay on its own copy of the decoded image
+    # Parameters: polygon outline color (cyan = light blue), line width of 3 pixels
+    layers = {}
+    if combined:
+        layers[f'text{suffix}.jpg'] = combined_image = image.copy()
+        image_annotation.draw_polygons(combined_image, word_polygons, 'yellow', width=2)
+        image_annotation.draw_polygons(combined_image, line_polygons, 'cyan', width=3)
+    layers[f'words{suffix}.jpg'] = words_image = image.copy()
+    image_annotation.draw_polygons(words_image, word_polygons, 'cyan', width=3)
+    layers[f'lines{suffix}.jpg'] = image
+    image_annotation.draw_polygons(image, line_polygons, 'cyan', width=3)
+
+    # Save the annotated images to disk in parallel (Pillow releases the GIL while encoding)
+    with ThreadPoolExecutor(max_workers=len(layers)) as executor:
+        list(executor.map(lambda textfile: image_annotation.save(layers[textfile], textfile), layers))
+
     # Inform the user where the results were saved
-    print('  Results saved in', textfile)
+    for textfile in sorted(layers):
+        print('  Results saved in', textfile)
 
 
 